@@ -0,0 +1,135 @@
+#!/usr/bin/python
+
+'''
+    Micro-benchmark: per-object cost of turning YAML mappings into model kwargs
+
+    Compares the old remove_empty_from_dict() scrubbing with the compiled
+    field mappers of yaml-to-netbox.py on a generated 100k interface document,
+    devices with their interfaces nested as in the YAML. The old function
+    recurses twice into every nested value, so it is timed on the flat
+    attributes SiteBuilder built per object and on whole device items with
+    their interface lists, where the double recursion compounds per level.
+    Nothing is written to the database, but the script module needs NetBox
+    to import, so run it with the NetBox virtualenv:
+
+        NETBOX_ROOT=/opt/netbox/netbox python3 benchmarks/attribute_mapping.py [interfaces]
+'''
+
+import importlib.util
+import os
+import sys
+import timeit
+
+NETBOX_ROOT = os.environ.get('NETBOX_ROOT', '/opt/netbox/netbox')
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'yaml-to-netbox.py')
+
+INTERFACES_PER_DEVICE = 100
+
+
+def setup_netbox():
+    sys.path.insert(0, NETBOX_ROOT)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'netbox.settings')
+    import django
+    django.setup()
+
+
+def load_script():
+    spec = importlib.util.spec_from_file_location('yaml_to_netbox', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def remove_empty_from_dict(d):
+    '''
+    the scrubbing SiteBuilder used before the field mappers, kept as the baseline
+    '''
+    if type(d) is dict:
+        return dict((k, remove_empty_from_dict(v)) for k, v in d.items() if v and remove_empty_from_dict(v))
+    elif type(d) is list:
+        return [remove_empty_from_dict(v) for v in d if v and remove_empty_from_dict(v)]
+    else:
+        return d
+
+
+def generate(count):
+    '''
+    device mappings as they come out of a parsed document, with count
+    interfaces between them, the same keys as the devices and interfaces
+    in example_1.yaml
+    '''
+    return [
+        {
+            'name': f'BENCH.RTR.{number}',
+            'facility': 101,
+            'device_type': 'ISR4331',
+            'device_role': 'router',
+            'rack': 'R1',
+            'position': None,
+            'face': None,
+            'status': 'planned',
+            'interfaces': [
+                {
+                    'name': f'1/1/{n + 1}',
+                    'type': '1000base-t',
+                    'lag': None,
+                    'parent': None,
+                    'mode': 'access',
+                    'untagged_vlan': None,
+                    'tagged_vlans': [],
+                    'mtu': 1500,
+                    'description': 'BLAH BLAH',
+                    'mgmt_only': False,
+                }
+                for n in range(INTERFACES_PER_DEVICE)
+            ],
+        }
+        for number in range(count // INTERFACES_PER_DEVICE)
+    ]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    setup_netbox()
+    script = load_script()
+    devices = generate(count)
+    count = sum(len(data['interfaces']) for data in devices)
+    # the looked up objects are given as context, so no ReferenceResolver is needed
+    related = {'site': 'site', 'device_type': 'device type', 'device_role': 'role', 'rack': 'rack'}
+
+    def flat():
+        # what the baseline SiteBuilder scrubbed per interface
+        for device in devices:
+            for data in device['interfaces']:
+                remove_empty_from_dict({
+                    'name': data['name'],
+                    'device': device['name'],
+                    'type': data['type'],
+                    'lag': None,
+                    'description': f"{device['name']} {data['name']}",
+                })
+
+    def nested():
+        # every device item with its interfaces
+        for device in devices:
+            remove_empty_from_dict(device)
+
+    def after():
+        for device in devices:
+            script.MAPPERS['device'](device, None, **related)
+            for data in device['interfaces']:
+                script.MAPPERS['interface'](data, None, device=device['name'], description=f"{device['name']} {data['name']}")
+
+    print(f"{count} interfaces on {len(devices)} devices, best of 5 runs")
+    print(f"{'':<32}{'total s':>10}{'per interface us':>18}")
+    for label, function in (
+        ('remove_empty_from_dict, flat', flat),
+        ('remove_empty_from_dict, nested', nested),
+        ('FieldMapper', after),
+    ):
+        best = min(timeit.repeat(function, number=1, repeat=5))
+        print(f"{label:<32}{best:>10.3f}{best / count * 1e6:>18.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+#!/usr/bin/python
+
+'''
+    Synthetic inputs for the scale benchmarks, see scale.py
+
+    Every site gets a rack, a router and a switch with eight interfaces each,
+    an MPLS circuit on the router and two cables (router to switch, router to
+    circuit). The links CSV holds one multi_connect.py row per site, joining
+    the free ports of its router and switch. The output only depends on the
+    number of sites, so two runs of a scale point always get the same input.
+    Nothing here needs NetBox:
+
+        python3 benchmarks/generate.py [output folder] [sites ...]
+'''
+
+import csv
+import os
+import sys
+
+import yaml
+
+SCALES = (10, 100, 1000, 10000)
+OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# objects the documents refer to, scale.py creates them before each run
+MANUFACTURER = 'Bench'
+DEVICE_TYPE = 'Bench 8P'
+DEVICE_ROLE = 'Bench'
+RACK_ROLE = 'Bench IDF'
+PROVIDER = 'Bench Provider'
+CIRCUIT_TYPE = 'Bench MPLS'
+PROVIDER_NETWORK = 'Bench MPLS'
+
+INTERFACES = '1/1/[1-8]'
+LINK_PORTS = '1/1/[3-8]'
+
+
+def facility(number):
+    return f"B{number:05d}"
+
+
+def site(number):
+    code = facility(number)
+    return {
+        'name': f"{code} Bench Site",
+        'slug': None,
+        'facility': code,
+        'status': 'planned',
+        'racks': [{
+            'name': 'A.1',
+            'status': 'planned',
+            'type': '2-post-frame',
+            'width': 19,
+            'u_height': 45,
+            'role': RACK_ROLE,
+        }],
+    }
+
+
+def devices(number):
+    code = facility(number)
+    return [
+        {
+            'name': f"{code}.{role}.A",
+            'facility': code,
+            'device_role': DEVICE_ROLE,
+            'manufacturer': MANUFACTURER,
+            'device_type': DEVICE_TYPE,
+            'rack': 'A.1',
+            'position': position,
+            'face': 'front',
+            'status': 'planned',
+            'interfaces': [{'name': INTERFACES, 'type': '1000base-t'}],
+        }
+        for role, position in (('RTR', 30), ('SW', 20))
+    ]
+
+
+def circuit(number):
+    return {
+        'cid': f"BENCH.{number:05d}",
+        'provider': PROVIDER,
+        'type': CIRCUIT_TYPE,
+        'status': 'planned',
+        'commit_rate': 1000000,
+        'port_speed': 1000000,
+        'a_facility': None,
+        'z_facility': facility(number),
+        'provider_net': PROVIDER_NETWORK,
+    }
+
+
+def cables(number):
+    code = facility(number)
+    return [
+        {
+            'type': 'cat6',
+            'status': 'planned',
+            'termination_a_device': f"{code}.RTR.A",
+            'termination_a_interface': '1/1/1',
+            'termination_b_device': f"{code}.SW.A",
+            'termination_b_interface': '1/1/1',
+            'circuit_id': None,
+        },
+        {
+            'type': 'smf',
+            'status': 'planned',
+            'termination_a_device': f"{code}.RTR.A",
+            'termination_a_interface': '1/1/2',
+            'termination_b_device': None,
+            'termination_b_interface': None,
+            'circuit_id': f"BENCH.{number:05d}",
+        },
+    ]
+
+
+def document(sites):
+    '''
+    a yaml-to-netbox.py document with this many sites
+    '''
+    numbers = range(1, sites + 1)
+    return {
+        'vars': {
+            'name': f"Scale benchmark, {sites} sites",
+            'schema_verison': 1,
+            'debug': False,
+            'wipe': False,
+            'globals': {'tenant': None},
+        },
+        'sites': [site(n) for n in numbers],
+        'devices': [device for n in numbers for device in devices(n)],
+        'circuits': [circuit(n) for n in numbers],
+        'cables': [cable for n in numbers for cable in cables(n)],
+    }
+
+
+def links(sites):
+    '''
+    multi_connect.py rows for the devices of document(sites)
+    '''
+    return [
+        {
+            'device_a': f"{facility(n)}.RTR.A",
+            'termination_name_a': LINK_PORTS,
+            'device_b': f"{facility(n)}.SW.A",
+            'termination_name_b': LINK_PORTS,
+        }
+        for n in range(1, sites + 1)
+    ]
+
+
+def write(folder, sites):
+    '''
+    write sites-<n>.yaml and links-<n>.csv, returns their paths
+    '''
+    os.makedirs(folder, exist_ok=True)
+    document_path = os.path.join(folder, f"sites-{sites}.yaml")
+    with open(document_path, 'w') as f:
+        yaml.safe_dump(document(sites), f, sort_keys=False)
+
+    links_path = os.path.join(folder, f"links-{sites}.csv")
+    rows = links(sites)
+    with open(links_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    return document_path, links_path
+
+
+def main():
+    folder = sys.argv[1] if len(sys.argv) > 1 else OUTPUT
+    scales = [int(n) for n in sys.argv[2:]] or SCALES
+    for sites in scales:
+        for path in write(folder, sites):
+            print(f"{path}: {os.path.getsize(path)} bytes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/python
+
+'''
+    Startup benchmark: module import time of every script in this repo
+
+    NetBox imports each script module whenever the scripts list is shown or
+    a job runs, so anything done at import time is paid over and over.
+    Each script is imported in a fresh interpreter, after Django is set up,
+    so shared imports (e.g. pandas) are not amortized between scripts.
+    Run it with the NetBox virtualenv:
+
+        NETBOX_ROOT=/opt/netbox/netbox python3 benchmarks/import_time.py [repeat]
+'''
+
+import glob
+import os
+import subprocess
+import sys
+
+NETBOX_ROOT = os.environ.get('NETBOX_ROOT', '/opt/netbox/netbox')
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# runs in the child interpreter, prints the import time in seconds
+PROBE = '''
+import importlib.util, os, sys, time
+sys.path.insert(0, {root!r})
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'netbox.settings')
+import django
+django.setup()
+spec = importlib.util.spec_from_file_location('probe', {path!r})
+module = importlib.util.module_from_spec(spec)
+start = time.perf_counter()
+spec.loader.exec_module(module)
+print(time.perf_counter() - start)
+'''
+
+
+def scripts():
+    '''
+    every script NetBox may load from this repo, hidden ones included
+    '''
+    paths = glob.glob(os.path.join(REPO, '*.py')) + glob.glob(os.path.join(REPO, 'hide_scripts', '*.py'))
+    return sorted(os.path.relpath(path, REPO) for path in paths if not path.endswith('__init__.py'))
+
+
+def import_time(path):
+    '''
+    seconds to import one script, None if the import failed
+    '''
+    probe = PROBE.format(root=NETBOX_ROOT, path=os.path.join(REPO, path))
+    result = subprocess.run([sys.executable, '-c', probe], capture_output=True, text=True)
+    if result.returncode:
+        print(f"{path}: import failed\n{result.stderr.strip().splitlines()[-1]}", file=sys.stderr)
+        return None
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    print(f"best of {repeat} imports, each in a fresh interpreter")
+    print(f"{'script':<50}{'ms':>10}")
+    total = 0
+    for path in scripts():
+        times = [import_time(path) for _ in range(repeat)]
+        if None in times:
+            print(f"{path:<50}{'failed':>10}")
+            continue
+        best = min(times)
+        total += best
+        print(f"{path:<50}{best * 1000:>10.1f}")
+    print(f"{'total':<50}{total * 1000:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+
+'''
+    Micro-benchmark: handing out point-to-point link subnets and addresses
+
+    Compares what bulk-site-device2.py used to do, a list of every subnet of
+    the free block and list(subnet.iter_hosts())[0] per address, with the
+    LinkAllocator of script_utils.py, for 1M links by default at /30, /31
+    and /127. Nothing touches the database, but script_utils needs NetBox
+    to import, so run it with the NetBox virtualenv:
+
+        NETBOX_ROOT=/opt/netbox/netbox python3 benchmarks/link_allocator.py [links]
+'''
+
+import os
+import sys
+import time
+import tracemalloc
+
+NETBOX_ROOT = os.environ.get('NETBOX_ROOT', '/opt/netbox/netbox')
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# prefix length of the links -> block to allocate them from
+BLOCKS = {
+    30: '10.0.0.0/8',
+    31: '10.0.0.0/8',
+    127: '2001:db8::/64',
+}
+
+
+def setup_netbox():
+    sys.path.insert(0, NETBOX_ROOT)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'netbox.settings')
+    import django
+    django.setup()
+
+
+def before(block, prefixlen, count):
+    '''
+    the allocation bulk-site-device2.py used before LinkAllocator, kept as
+    the baseline (only the subnets needed are listed, the script listed
+    the whole free block)
+    '''
+    import netaddr
+    mask = f"/{prefixlen}"
+    subnets = []
+    for subnet in netaddr.IPNetwork(block).subnet(prefixlen):
+        subnets.append(subnet)
+        if len(subnets) == count:
+            break
+    for subnet in subnets:
+        str(subnet)
+        str(list(subnet.iter_hosts())[0]) + mask
+        str(list(subnet.iter_hosts())[0] + 1) + mask
+
+
+def after(block, prefixlen, count):
+    from script_utils import LinkAllocator
+    links = LinkAllocator([block], prefixlen)
+    for _ in range(count):
+        links.allocate()
+
+
+def measure(function, *args):
+    '''
+    seconds of one run and peak MiB of another one with the memory traced
+    '''
+    start = time.perf_counter()
+    function(*args)
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak / 2**20
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    setup_netbox()
+    sys.path.insert(0, REPO)
+
+    print(f"{count} links")
+    print(f"{'':<8}{'':<16}{'total s':>10}{'per link us':>14}{'peak MiB':>10}")
+    for prefixlen, block in BLOCKS.items():
+        for label, function in (('list', before), ('LinkAllocator', after)):
+            seconds, peak = measure(function, block, prefixlen, count)
+            print(f"{'/' + str(prefixlen):<8}{label:<16}{seconds:>10.2f}{seconds / count * 1e6:>14.2f}{peak:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+#!/usr/bin/python
+
+'''
+    Scale benchmark: objects/second, queries per object and memory of the
+    import scripts at 10 to 10,000 sites
+
+    Each scale point runs a script's run() on the inputs of generate.py,
+    inside one transaction that is rolled back afterwards, so the database
+    is left as it was and every run starts from the same state. The objects
+    the inputs refer to (device types, roles, provider, ...) are created in
+    the same transaction. NetBox only runs on PostgreSQL, so point NETBOX_ROOT
+    at a NetBox install configured for a local test database (with DEBUG
+    off, or Django keeps every query in memory):
+
+        NETBOX_ROOT=/opt/netbox/netbox python3 benchmarks/scale.py [options] [sites ...]
+
+    --scripts yaml,bulk,multi   which scripts to run (default all of them)
+    --repeat N                  best wall time of N runs (default 1)
+    --memory                    one more run per point with the memory traced
+    --json PATH                 also write the results to a JSON file
+
+    yaml runs yaml-to-netbox.py on the document generate.py writes as
+    sites-<n>.yaml, bulk runs bulk-site-device2.py for the same number of
+    sites with BULK_DEVICES devices each, and multi runs multi_connect.py
+    once per row of links-<n>.csv, after the document of the same size was
+    imported; the inputs are generated in memory, the files are only needed
+    to run the scripts by hand
+'''
+
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import time
+
+import generate
+
+NETBOX_ROOT = os.environ.get('NETBOX_ROOT', '/opt/netbox/netbox')
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# bulk-site-device2.py: devices per site, the first two are the core switches
+BULK_DEVICES = 4
+BULK_INTERFACES = 'GigabitEthernet1/0/[1-48]'
+BULK_PREFIX = '10.0.0.0/8'
+
+
+class Rollback(Exception):
+    pass
+
+
+def setup_netbox():
+    sys.path.insert(0, NETBOX_ROOT)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'netbox.settings')
+    import django
+    django.setup()
+
+
+def load_script(filename):
+    spec = importlib.util.spec_from_file_location(filename[:-3].replace('-', '_'), os.path.join(REPO, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def create_fixtures():
+    '''
+    the objects the generated inputs refer to, returns the ones the
+    script forms would hand over as data
+    '''
+    from django.utils.text import slugify
+    from circuits.models import CircuitType, Provider, ProviderNetwork
+    from dcim.models import DeviceRole, DeviceType, InterfaceTemplate, Manufacturer, RackRole
+    from ipam.models import Prefix, Role
+    from tenancy.models import Tenant
+    from utilities.forms.utils import expand_alphanumeric_pattern
+
+    def get(model, name, **fields):
+        return model.objects.get_or_create(name=name, defaults={'slug': slugify(name), **fields})[0]
+
+    manufacturer = get(Manufacturer, generate.MANUFACTURER)
+    get(DeviceRole, generate.DEVICE_ROLE, color='9e9e9e')
+    get(RackRole, generate.RACK_ROLE, color='9e9e9e')
+    provider = get(Provider, generate.PROVIDER)
+    get(CircuitType, generate.CIRCUIT_TYPE)
+    ProviderNetwork.objects.get_or_create(name=generate.PROVIDER_NETWORK, provider=provider)
+    DeviceType.objects.get_or_create(
+        manufacturer=manufacturer, model=generate.DEVICE_TYPE, defaults={'slug': slugify(generate.DEVICE_TYPE)},
+    )
+
+    # bulk-site-device2.py wants its own tenant, prefix role and a switch with ports
+    switch, created = DeviceType.objects.get_or_create(
+        manufacturer=manufacturer, model='Bench 48P', defaults={'slug': 'bench-48p'},
+    )
+    if created:
+        InterfaceTemplate.objects.bulk_create([
+            InterfaceTemplate(device_type=switch, name=name, type='1000base-t')
+            for name in expand_alphanumeric_pattern(BULK_INTERFACES)
+        ])
+    tenant = get(Tenant, 'Sys Pro')
+    role = get(Role, 'SP Monitor')
+    Prefix.objects.get_or_create(prefix=BULK_PREFIX, defaults={'role': role, 'tenant': tenant})
+    return {
+        'switch': switch,
+        'role': DeviceRole.objects.get(name=generate.DEVICE_ROLE),
+    }
+
+
+def yaml_data(text):
+    return {
+        'yamlfile': None,
+        'yamltext': text,
+        'mode': 'create',
+        'stream': False,
+        'chunk_size': 0,
+        'verbose': False,
+        'workers': 0,
+        'profile': 'off',
+    }
+
+
+def multi_data(row):
+    from dcim.models import Device
+    return {
+        'device_a': Device.objects.get(name=row['device_a']),
+        'termination_type_a': 'interfaces',
+        'termination_name_a': row['termination_name_a'],
+        'device_b': Device.objects.get(name=row['device_b']),
+        'termination_type_b': 'interfaces',
+        'termination_name_b': row['termination_name_b'],
+        'cable_status': 'planned',
+        'cable_type': '',
+        'cable_tenant': None,
+        'cable_label': '',
+        'cable_color': '',
+        'cable_length': None,
+        'cable_length_unit': '',
+        'cable_tags': [],
+        'profile': 'off',
+    }
+
+
+def measure(scripts, name, sites, trace_memory):
+    '''
+    one run of a script at one scale point, in a transaction rolled back
+    afterwards, returns the ScriptProfiler stats and the objects and log
+    entries the run made
+    '''
+    import yaml
+    from django.db import transaction
+    from script_utils import ScriptProfiler
+
+    profiler = ScriptProfiler(None, 'table', trace_memory=trace_memory)
+    outcome = {}
+    try:
+        with transaction.atomic():
+            fixtures = create_fixtures()
+            document = generate.document(sites)
+            text = yaml.safe_dump(document, sort_keys=False)
+
+            if name == 'yaml':
+                script = scripts['yaml'].SiteBuilder()
+                runs = [yaml_data(text)]
+                outcome['objects'] = scripts['yaml'].count_objects(document)
+
+            elif name == 'bulk':
+                script = scripts['bulk'].MyCustScript()
+                runs = [{
+                    'site_prefix': f"BULK{sites}",
+                    'site_count': sites,
+                    'manufacturer': None,
+                    'device_model': fixtures['switch'],
+                    'device_role': fixtures['role'],
+                    'device_count': BULK_DEVICES,
+                    'link_length': '31',
+                    'topology': '',
+                    'verbose': False,
+                    'profile': 'off',
+                }]
+                interfaces = fixtures['switch'].interfacetemplates.count()
+                # per access switch two links, each with a prefix, two addresses and a cable
+                outcome['objects'] = sites * (1 + BULK_DEVICES * (1 + interfaces) + (BULK_DEVICES - 2) * 2 * 4)
+
+            else:
+                # the devices to connect come from the document, imported unmeasured
+                scripts['yaml'].SiteBuilder().run(yaml_data(text), True)
+                script = scripts['multi'].MultiConnect()
+                runs = [multi_data(row) for row in generate.links(sites)]
+                ports = len(scripts['multi'].expand_pattern(generate.LINK_PORTS))
+                outcome['objects'] = sites * ports
+
+            with profiler.phase(name):
+                for data in runs:
+                    script.run(data, True)
+            outcome['log'] = len(script.log)
+            outcome['failures'] = sum(1 for level, _ in script.log if level == 'failure')
+            raise Rollback
+    except Rollback:
+        pass
+    outcome.update(profiler.stats[name])
+    return outcome
+
+
+def main():
+    parser = argparse.ArgumentParser(description="scale benchmark of the import scripts")
+    parser.add_argument('sites', nargs='*', type=int, default=list(generate.SCALES))
+    parser.add_argument('--scripts', default='yaml,bulk,multi')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--memory', action='store_true')
+    parser.add_argument('--json')
+    options = parser.parse_args()
+
+    setup_netbox()
+    sys.path.insert(0, REPO)
+    scripts = {
+        'yaml': load_script('yaml-to-netbox.py'),
+        'bulk': load_script('bulk-site-device2.py'),
+        'multi': load_script('multi_connect.py'),
+    }
+
+    results = []
+    print(f"{'script':<8}{'sites':>8}{'objects':>10}{'s':>10}{'objects/s':>12}{'queries':>10}{'q/object':>10}{'MiB':>8}{'log':>8}{'failed':>8}")
+    for name in options.scripts.split(','):
+        for sites in options.sites:
+            runs = [measure(scripts, name, sites, False) for _ in range(options.repeat)]
+            best = min(runs, key=lambda run: run['seconds'])
+            if options.memory:
+                best['peak'] = measure(scripts, name, sites, True)['peak']
+            result = {'script': name, 'sites': sites, **best}
+            results.append(result)
+            print(
+                f"{name:<8}{sites:>8}{best['objects']:>10}{best['seconds']:>10.2f}"
+                f"{best['objects'] / best['seconds']:>12.0f}{best['queries']:>10}"
+                f"{best['queries'] / best['objects']:>10.2f}"
+                f"{(best['peak'] / 2**20 if options.memory else float('nan')):>8.1f}"
+                f"{best['log']:>8}{best['failures']:>8}"
+            )
+
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump({'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'results': results}, f, indent=1)
+        print(f"results written to {options.json}")
+
+
+if __name__ == '__main__':
+    main()
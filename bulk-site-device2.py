@@ -1,68 +1,326 @@
 from django.utils.text import slugify
 
 from ipam.models import Prefix, IPAddress
-from dcim.models import Cable, Device, DeviceRole, DeviceType, Manufacturer, Site, Location, Rack
+from dcim.models import Cable, Device, DeviceRole, DeviceType, InterfaceTemplate, Manufacturer, Site, Location, Rack
 from tenancy.models import Tenant
 
 from dcim.choices import *
+from dcim.constants import NONCONNECTABLE_IFACE_TYPES
 from ipam.choices import *
 
 from extras.scripts import *
+from utilities.forms.constants import ALPHANUMERIC_EXPANSION_PATTERN
+from utilities.forms.utils import expand_alphanumeric_pattern
 
-import netaddr
+import os, sys, re
+import yaml
+from collections import Counter, defaultdict
+
+# shared helpers live next to this script
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from script_utils import BULK_BATCH_SIZE, IPAMWriter, LinkPool, PortMap, ScriptLog, PROFILE_CHOICES, instantiate_components, profiled, record_changes
+
+
+# prefix length of the links between the access and core switches
+LINK_CHOICES = (
+    ('31', '/31 (RFC 3021)'),
+    ('30', '/30'),
+    ('127', '/127 (IPv6)'),
+)
+
+# the first two interfaces of an access switch go to core A and core B
+UPLINK_A = 'GigabitEthernet1/0/1'
+UPLINK_B = 'GigabitEthernet1/0/2'
+
+# core interfaces before this one are kept free, the access switches use the rest
+CORE_FIRST_PORT = 11
+
+# device names of a tier, fields are site, tier, index (in the tier), number (in the site) and slug (of the device type)
+DEVICE_NAME = '{slug}.{number}'
+
+# the prefix link subnets are taken from, unless the addressing of a topology names another role
+LINK_PREFIX_ROLE = 'SP Monitor'
 
 
 # common task functions which  can be reused in other scripts
 
-def add_ip_to_interface(self, interface, newaddress):
-    # create IP address as child of appropriate prefix
-    newaddress = IPAddress(
-        address = newaddress,
+def add_ip_to_interface(ipam, interface, newaddress):
+    # queue the IP address, assigned to the interface, for the next ipam.flush()
+    ipam.add_address(
+        interface,
+        newaddress,
         status = IPAddressStatusChoices.STATUS_RESERVED,
         description = f"{interface.device} {interface.name}",
     )
-    # save so the record can be assinged to the interface
-    newaddress.save()
-    # add ip address to interface
-    interface.ip_addresses.add(newaddress)
-    self.log_info(f"Saved address {newaddress} on {interface.device} {interface}")
-    
-    # this will remove ip addresses from an interface
-    # interface.ip_addresses.remove(newaddress)
     return
 
 
-def remove_ip_from_interface(self, interface, newaddress):
+def remove_ip_from_interface(log, interface, newaddress):
     # this will remove ip addresses from an interface
     interface.ip_addresses.remove(newaddress)
-    self.log_info(f"Removed address {newaddress} from {interface.device} {interface}")
+    log.record('removed', newaddress, f"Removed address {newaddress} from {interface.device} {interface}")
     return
 
 
-def add_ip_prefix(self, interface, newprefix):
-    # create new prefix as child of appropriate prefix
-    newprefix = Prefix(
-        prefix = newprefix,
+def add_ip_prefix(ipam, interface, newprefix):
+    # queue the new prefix for the next ipam.flush(), it becomes a child of the appropriate prefix
+    ipam.add_prefix(
+        newprefix,
         is_pool = False,
         status = PrefixStatusChoices.STATUS_RESERVED,
         description = f"{interface.device} {interface.name}",
     )
-    # save so the record can be assinged to the interface
-    result = newprefix.save()
-    self.log_info(f"Saved prefix {newprefix} : {result}")
     return
 
 
 
+def expand_ports(ports):
+    '''
+    a port name, a pattern like GigabitEthernet1/0/[1-48] or a list of them, as a list of names
+    '''
+    if isinstance(ports, str):
+        ports = [ports]
+    names = []
+    for port in ports or ():
+        if re.search(ALPHANUMERIC_EXPANSION_PATTERN, str(port)):
+            names.extend(expand_alphanumeric_pattern(port))
+        else:
+            names.append(str(port))
+    return names
+
+
+def default_topology(data):
+    '''
+    the shape this script always built, used when no topology is given:
+    the first two devices of a site are core A/B switches and every other
+    one is an access switch with a link to each core
+
+    Topology of the interface naming - http://asciiflow.com/
+
+            +-------+
+            |       |
+            | SW-A  | A          AZ +------+
+            |       +---------------+      |
+            +-------+               |      |
+                                    | SW-n |
+            +-------+ B          BZ |      |
+            |       +---------------+      |
+            | SW-B  |               +------+
+            |       |
+            +-------+
+
+    future consideration: http://go.drawthe.net/
+    '''
+    if (data.get('device_count') or 0) < 2:
+        raise ValueError("At least two devices per site are needed, for core A and B")
+    return {
+        'tiers': [
+            {'name': 'core', 'count': 2},
+            {
+                'name': 'access',
+                'count': data['device_count'] - 2,
+                'uplinks': {
+                    'to': 'core',
+                    'ports': [UPLINK_A, UPLINK_B],
+                    'peer_skip': CORE_FIRST_PORT,
+                    'addressing': 'link',
+                },
+            },
+        ],
+        'addressing': {
+            'link': {'role': LINK_PREFIX_ROLE, 'prefixlen': int(data.get('link_length') or 31)},
+        },
+    }
+
+
+class Topology:
+    '''
+    a tier description compiled into the plan of one site: every device of
+    every tier and every link between them, with the port at each end
+    tiers are listed top down, the uplinks of a tier go to a tier above it;
+    the ports are checked against the interface templates of the device
+    types, so a run is sized, and a tier short of ports found, before
+    anything is written; every site of a run gets the same plan
+    '''
+
+    def __init__(self, description, device_type, device_role):
+        if not isinstance(description, dict) or not isinstance(description.get('tiers'), list):
+            raise ValueError("A topology needs a list of tiers")
+
+        # addressing name -> (prefix role, prefix length of the links)
+        self.addressing = {}
+        for name, spec in (description.get('addressing') or {}).items():
+            spec = spec or {}
+            self.addressing[name] = (spec.get('role') or LINK_PREFIX_ROLE, int(spec.get('prefixlen') or 31))
+
+        self.tiers = {}
+        for tier in description['tiers']:
+            tier = self.tier(tier, device_type, device_role)
+            tier['first'] = sum(t['count'] for t in self.tiers.values())
+            self.tiers[tier['name']] = tier
+
+        # the interfaces of every device type, in interface order, with one query
+        self.templates = defaultdict(list)
+        types = {tier['device_type'].pk for tier in self.tiers.values()}
+        for type_id, name, type in InterfaceTemplate.objects.filter(device_type_id__in=types).values_list('device_type_id', 'name', 'type'):
+            self.templates[type_id].append((name, type))
+
+        # (tier, index in the tier) in device number order
+        self.devices = [(tier, index) for tier in self.tiers.values() for index in range(tier['count'])]
+        # (upper device number, port, lower device number, port, addressing name), numbers count from 0
+        self.links = []
+        self.used = defaultdict(set)
+        for tier in self.tiers.values():
+            for uplink in tier['uplinks']:
+                self.wire(tier, uplink)
+
+        names = [self.name(tier, index, number, '{site}') for number, (tier, index) in enumerate(self.devices)]
+        if len(set(names)) < len(names):
+            raise ValueError("Device names repeat within a site, use {index} or {number} in device_name")
+
+    def tier(self, tier, device_type, device_role):
+        '''
+        one tier of the description with its objects looked up and its uplinks as a list
+        '''
+        if not isinstance(tier, dict) or not tier.get('name'):
+            raise ValueError("Every tier needs a name")
+        name = tier['name']
+        if name in self.tiers:
+            raise ValueError(f"Tier {name} is listed twice")
+        tier = dict(tier)
+        tier['count'] = int(tier.get('count', 1))
+        if tier['count'] < 0:
+            raise ValueError(f"Tier {name} has a negative count")
+
+        if tier.get('device_type'):
+            types = DeviceType.objects.filter(model=tier['device_type'])
+            if tier.get('manufacturer'):
+                types = types.filter(manufacturer__name=tier['manufacturer'])
+            try:
+                tier['device_type'] = types.get()
+            except (DeviceType.DoesNotExist, DeviceType.MultipleObjectsReturned):
+                raise ValueError(f"Tier {name}: no single device type {tier['device_type']}, give its manufacturer")
+        else:
+            tier['device_type'] = device_type
+        if tier.get('device_role'):
+            try:
+                tier['device_role'] = DeviceRole.objects.get(name=tier['device_role'])
+            except DeviceRole.DoesNotExist:
+                raise ValueError(f"Tier {name}: no device role {tier['device_role']}")
+        else:
+            tier['device_role'] = device_role
+        tier.setdefault('device_name', DEVICE_NAME)
+
+        uplinks = tier.get('uplinks') or []
+        tier['uplinks'] = uplinks if isinstance(uplinks, list) else [uplinks]
+        for uplink in tier['uplinks']:
+            if not isinstance(uplink, dict):
+                raise ValueError(f"Tier {name}: uplinks are mappings with to, ports, links, ...")
+            if uplink.get('to') not in self.tiers:
+                raise ValueError(f"Tier {name}: uplinks go to a tier listed above it, not {uplink.get('to')}")
+            if uplink.get('addressing') and uplink['addressing'] not in self.addressing:
+                raise ValueError(f"Tier {name}: no addressing {uplink['addressing']}")
+        return tier
+
+    def ports(self, tier, names=None, skip=0):
+        '''
+        the named ports of a tier's device type, or all of them from the skip-th
+        on, leaving out those that can't take a cable
+        '''
+        templates = self.templates[tier['device_type'].pk]
+        if names is None:
+            return [port for port, type in templates[skip:] if type not in NONCONNECTABLE_IFACE_TYPES]
+        connectable = {port for port, type in templates if type not in NONCONNECTABLE_IFACE_TYPES}
+        missing = [port for port in names if port not in connectable]
+        if missing:
+            raise ValueError(f"Tier {tier['name']}: {tier['device_type']} has no cabled port {', '.join(missing[:5])}")
+        return names
+
+    def wire(self, tier, uplink):
+        '''
+        plan the links of one uplinks entry: every device of the tier gets
+        links to a group of devices of the upper tier (the whole tier unless
+        group is set), the groups taken in turn, and its ports and the upper
+        devices' ports are used in order
+        '''
+        upper = self.tiers[uplink['to']]
+        group = int(uplink.get('group') or upper['count'])
+        links = int(uplink.get('links', 1))
+        if not group or upper['count'] % group:
+            raise ValueError(f"Tier {tier['name']}: {upper['name']} has {upper['count']} devices, not groups of {group}")
+        own_ports = self.ports(tier, list(dict.fromkeys(expand_ports(uplink.get('ports')))))
+        if uplink.get('peer_ports'):
+            peer_ports = self.ports(upper, expand_ports(uplink['peer_ports']))
+        else:
+            peer_ports = self.ports(upper, skip=int(uplink.get('peer_skip', 0)))
+
+        # next free peer port index per upper device
+        cursor = defaultdict(int)
+        for index in range(tier['count']):
+            lower = tier['first'] + index
+            own = iter([port for port in own_ports if port not in self.used[lower]])
+            start = upper['first'] + (index % (upper['count'] // group)) * group
+            for number in range(start, start + group):
+                for _ in range(links):
+                    port = next(own, None)
+                    if port is None:
+                        raise ValueError(f"Tier {tier['name']}: {len(own_ports)} uplink ports are too few for {group * links} links per device")
+                    while cursor[number] < len(peer_ports) and peer_ports[cursor[number]] in self.used[number]:
+                        cursor[number] += 1
+                    if cursor[number] == len(peer_ports):
+                        raise ValueError(
+                            f"Tier {upper['name']} runs out of ports: device {number - upper['first'] + 1} has none left "
+                            f"for device {index + 1} of tier {tier['name']}"
+                        )
+                    peer = peer_ports[cursor[number]]
+                    self.used[number].add(peer)
+                    self.used[lower].add(port)
+                    self.links.append((number, peer, lower, port, uplink.get('addressing')))
+
+    def name(self, tier, index, number, site):
+        return tier['device_name'].format(
+            site=site, tier=tier['name'], index=index + 1, number=number + 1, slug=tier['device_type'].slug,
+        )
+
+    def port_names(self):
+        '''
+        every port name the links use, to load only those interfaces
+        '''
+        return {port for link in self.links for port in (link[1], link[3])}
+
+    def links_needed(self, sites):
+        '''
+        links per addressing name for this many sites
+        '''
+        counts = Counter(link[4] for link in self.links if link[4])
+        return {name: count * sites for name, count in counts.items()}
+
+    def size(self, sites):
+        '''
+        the objects a run over this many sites creates, by model
+        '''
+        addressed = sum(1 for link in self.links if link[4])
+        interfaces = sum(len(self.templates[tier['device_type'].pk]) for tier, _ in self.devices)
+        return {
+            'sites': sites,
+            'devices': sites * len(self.devices),
+            'interfaces': sites * interfaces,
+            'cables': sites * len(self.links),
+            'prefixes': sites * addressed,
+            'IP addresses': sites * addressed * 2,
+        }
+
+
+
 class MyCustScript(Script):
 
     class Meta:
         name = "Bulk generate sites & devices"
         description = "Complex sample script for creating sites, devices, interfaces, \
                        cables, prefixes and address assignments to the interfaces. \
-                       This will take a very long time to run if you make too many sites \
-                       or devices, so be careful!!"
-        field_order = ['site_prefix', 'site_count', 'device_role', 'device_model', 'device_count']
+                       The devices of a site are built from a description of tiers and \
+                       their uplinks, sized and checked before anything is written."
+        field_order = ['site_prefix', 'site_count', 'device_role', 'device_model', 'device_count', 'link_length', 'topology', 'verbose', 'profile']
         commit_default = False
 
     site_prefix = StringVar(
@@ -91,203 +349,162 @@ class MyCustScript(Script):
         #display_field = 'name',
     )
     device_count = IntegerVar(
-        description = "How many devices at each site"
+        description = "How many devices at each site, two cores and the rest access switches (without a topology)",
+        required = False
+    )
+    link_length = ChoiceVar(
+        choices = LINK_CHOICES,
+        default = '31',
+        description = "Link subnets, taken from the SP Monitor prefix of the same address family"
+    )
+    topology = TextVar(
+        description = "Tiers of devices and their uplinks in YAML, see example_topology.yaml; \
+                       the device role and model above are the defaults of the tiers",
+        required = False
+    )
+    verbose = BooleanVar(
+        description = "Log every object, instead of a few examples and a summary table",
+        required = False
+    )
+    profile = ChoiceVar(
+        choices = PROFILE_CHOICES,
+        default = 'off',
+        description = "Report time, SQL queries, rows written and peak memory (slows the run down)"
     )
 
 
+    @profiled
     def run(self, data, commit):
 
+        # per object messages are summarized unless verbose is checked
+        log = ScriptLog(self, verbose=data.get('verbose'))
 
         TENANT_NAME = 'Sys Pro'
 
-        # Setting mask to a /24-30 should work.  /31 is not supported with netaddr module.
-        MASK = '/31'
-        MASK_INT = 31
-        SIZING_NET = '0.0.0.0' + MASK
-        list_of_subnets = []
-
         # Header used for generating a CSV table output of all the new devices
         output = ['name,make,model']
 
-        # add up home many IPs are needed based on MASK variable
-        addys_required = data['site_count'] * (data['device_count'] - 2) * 2 * len(netaddr.IPNetwork(SIZING_NET))   
-
+        # everything the new objects refer to is looked up once
+        try:
+            tenant = Tenant.objects.get(name=TENANT_NAME)
+        except Tenant.DoesNotExist:
+            self.log_failure(f"Can't find the tenant {TENANT_NAME}!")
+            return
 
-        # check for available IP addresses based on role name and tenant
+        # compile the topology into the plan of one site, which checks every port
+        # against the device type templates, before writing anything
         try:
-            prefix = Prefix.objects.get(role__name='SP Monitor', tenant__name=TENANT_NAME)
-        except:
-            self.log_failure("Can't find any prefixes or some other error!")
-        
-        # available_ips = iter(prefix.get_available_ips())
-
-        avail_cidrs = prefix.get_available_prefixes()
-        self.log_info(f"Available cidrs {avail_cidrs}.")
-
-        for new_cidr in avail_cidrs.iter_cidrs():
-            self.log_info(f"Looping {new_cidr} len={len(netaddr.IPNetwork(new_cidr))} need={addys_required}.")
-            if addys_required <= len(netaddr.IPNetwork(new_cidr)):
-                self.log_info(f"Adequate address space exists in this cidr {new_cidr}.")
-                break
-            else:
-                self.log_warning("This prefix too little, looking for another one.")
-        
-        
-        # build a list of Subnets 
-        
-        # need to get subnets to assign to interfaces, so iterate through the available prefix and build a list of /30s
-        # this creates a list of subnets of type IPNetwork('2.11.128.0/30')
-        # Note: there is a limitation of netaddr as it cannot suport /31s
-
-        for subnet in new_cidr.subnet(MASK_INT):
-            list_of_subnets.append(subnet)
-     
-        self.log_info(f"{MASK} Subnets: {list_of_subnets}")
-
-
-        # Use this varible to index list_of_subnets[subnet_index]
-        subnet_index = 0
-
-        # Create the new sites
-        for site_num in range(1, data['site_count'] + 1):
+            description = yaml.safe_load(data['topology']) if data.get('topology') else default_topology(data)
+            with self.profiler.phase('plan'):
+                topology = Topology(description, data['device_model'], data['device_role'])
+        except (ValueError, TypeError, yaml.YAMLError) as e:
+            self.log_failure(f"Can't build the topology: {e}")
+            return
+
+        site_count = data['site_count']
+        size = topology.size(site_count)
+        self.log_info("Objects to create\n\n" + "\n".join(
+            ["| Model | Count |", "|---|---:|"] + [f"| {model} | {count} |" for model, count in size.items()]
+        ))
+
+        # link subnets are handed out from the free space of a prefix as they are needed,
+        # addressing names with the same prefix share it, so the blocks of every name are
+        # set aside up front from one pool per prefix and the whole demand has to fit
+        demand = defaultdict(dict)   # (prefix role, address family) -> {addressing name: links needed}
+        for name, needed in topology.links_needed(site_count).items():
+            role, prefixlen = topology.addressing[name]
+            demand[role, 6 if prefixlen > 32 else 4][name] = needed
+
+        links = {}
+        for (role, family), names in demand.items():
+
+            # check for available IP addresses based on role name, tenant and address family
+            try:
+                prefix = Prefix.objects.get(role__name=role, tenant__name=TENANT_NAME, prefix__family=family)
+            except (Prefix.DoesNotExist, Prefix.MultipleObjectsReturned):
+                self.log_failure(f"Can't find the IPv{family} {role} prefix of {TENANT_NAME}!")
+                return
+
+            pool = LinkPool(prefix.get_available_prefixes().iter_cidrs())
+            # the largest links first, what is left stays aligned for the smaller ones
+            names = sorted(names.items(), key=lambda item: topology.addressing[item[0]][1])
+            needed = ", ".join(f"{count} /{topology.addressing[name][1]} links for {name}" for name, count in names)
+            self.log_info(f"{pool.free()} free addresses in {prefix}, {needed} needed.")
+            try:
+                for name, count in names:
+                    links[name] = pool.carve(topology.addressing[name][1], count)
+            except ValueError:
+                self.log_failure(f"Not enough free address space in {prefix} for {needed}!")
+                return
+
+        # prefixes and addresses are written in bulk once all sites are built
+        ipam = IPAMWriter(log)
+        port_names = topology.port_names()
+
+        # Create the new sites, all in one go
+        sites = []
+        for site_num in range(1, site_count + 1):
             site_name = f"{data['site_prefix']}.{str(site_num)}"
-            site = Site(
+            sites.append(Site(
                 name = site_name,
-                tenant = Tenant.objects.get(name=TENANT_NAME),
+                tenant = tenant,
                 slug = slugify(site_name),
                 status = SiteStatusChoices.STATUS_PLANNED,
-            )
-            site.save()
-            self.log_success(f"Created new site: {site}")
-
+            ))
+        sites = Site.objects.bulk_create(sites, batch_size=BULK_BATCH_SIZE)
+        record_changes(self, sites)
+        for site in sites:
+            log.record('created', site, f"Created new site: {site}")
 
+        for site in sites:
 
-            # Create devices in new site
-            for device_num in range(1, data['device_count'] + 1): # the range starts with "1"
-                device = Device(
+            # Create the devices of every tier in new site, in batches, then their interfaces etc. from the device types
+            devices = [
+                Device(
                     site=site,
-                    tenant = Tenant.objects.get(name=TENANT_NAME),
-                    device_type=data['device_model'],
-                    name = f"{data['device_model'].slug}.{device_num}",
+                    tenant = tenant,
+                    device_type=tier['device_type'],
+                    name = topology.name(tier, index, number, site.name),
                     status=DeviceStatusChoices.STATUS_PLANNED,
-                    device_role=data['device_role'],
+                    device_role=tier['device_role'],
                 )
-                device.save()
-                self.log_success(f"Created {device} @ {site}")
-
-                # Somewhat lazy method, but assume the first two devices are core A/B switches
-                # grab the first device and save as object for later
-                if device_num == 1:
-                    corea = device
-                    corea_iface = device.interfaces.all() # also grab a list/array of all Core A's interfaces
-                    #self.log_info(f"This is Core A: {device}")
-                    self.log_info(f"This is Core As first interface: {corea_iface[0]}")
-
-                # grab the second device and save as object for later
-                if device_num == 2:
-                    coreb = device
-                    coreb_iface = device.interfaces.all() # also grab all Core B's interfaces
-                    #self.log_info(f"This is Core B: {device}")
-                    self.log_info(f"This is Core Bs first interface: {coreb_iface[0]}")
-
-            # Use this varible to index ports on CORE A/B switches
-            # start with 10th interface
-            core_iface_index = 11
-
-            # Iterate over each device in site, to do various things
-            for device in Device.objects.filter(site=site):
-
-                # A crude method to connect each device to core A and B
-                # grab the core interfaces, no check is done to ensure enough ports
-                a_iface = corea_iface[core_iface_index] # next interface on core A
-                b_iface = coreb_iface[core_iface_index] # next interface on core B
-              
-                # don't connect anything between core A and B devices
-                if device != corea and device != coreb:
-
-                    self.log_info(f"Subnet Index = {subnet_index}")
-
-                    '''
-                    Topology of the interface naming - http://asciiflow.com/
-
-                            +-------+
-                            |       |
-                            | SW-A  | A          AZ +------+
-                            |       +---------------+      |
-                            +-------+               |      |
-                                                    | SW-n |
-                            +-------+ B          BZ |      |
-                            |       +---------------+      |
-                            | SW-B  |               +------+
-                            |       |
-                            +-------+
-
-                    future consideration: http://go.drawthe.net/
-
-                    '''
- 
-
-                    az_iface = device.interfaces.get(name='GigabitEthernet1/0/1') # first interface goes to core A
-                    bz_iface = device.interfaces.get(name='GigabitEthernet1/0/2') # second interface goes to core B
-
-                    # first subnet used for link to A core, second one is for link to B core
-                    a_az_subnet = list_of_subnets[subnet_index]
-                    b_bz_subnet = list_of_subnets[subnet_index+1]
-                    
-                    add_ip_prefix(self, a_iface, str(a_az_subnet))
-                    add_ip_prefix(self, b_iface, str(b_bz_subnet))
-
-                    # add ip address to interface on core A ("A" side)
-                    a_iface_address = str(list(a_az_subnet.iter_hosts())[0]) + MASK
-                    self.log_info(f"{a_iface.device} {a_iface.name} assigned {a_iface_address} ")
-                    add_ip_to_interface(self, a_iface, a_iface_address)
-                    # add ip address to interface on other device ("Z" side)                    
-                    az_iface_address = str(list(a_az_subnet.iter_hosts())[0] + 1) + MASK
-                    add_ip_to_interface(self, az_iface, az_iface_address)
-                    
-                    
-
-                    # add ip address to interface on core B ("A" side)
-                    b_iface_address = str(list(b_bz_subnet.iter_hosts())[0]) + MASK
-                    self.log_info(f"{b_iface.device} {b_iface.name} assigned {b_iface_address} ")
-                    add_ip_to_interface(self, b_iface, b_iface_address)
-                    # add ip address to interface on other device ("Z" side)                    
-                    bz_iface_address = str(list(b_bz_subnet.iter_hosts())[0] + 1) + MASK
-                    add_ip_to_interface(self, bz_iface, bz_iface_address)
-                    
-
-                    # Create a cable from core A to next device az_iface
-                    cable = Cable(
-                                termination_a=a_iface,
-                                #termination_a_type=interface_ct,
-                                termination_b=az_iface,
-                                #termination_b_type=interface_ct,
-                                #label=label,
-                                status=LinkStatusChoices.STATUS_PLANNED
-                    )
-                    #self.log_info(f"{a_iface.device} {a_iface.name} to {z1_iface.device} {z1_iface.name} : saving cable")
-                    cable.save()
-                    self.log_success(f"{a_iface.device} to {az_iface.device} : created cable {cable}")
-
-                    # Create a cable from core B to next device bz_iface
-                    cable = Cable(
-                                termination_a=b_iface,
-                                #termination_a_type=interface_ct,
-                                termination_b=bz_iface,
-                                #termination_b_type=interface_ct,
-                                #label=label,
-                                status=LinkStatusChoices.STATUS_PLANNED
-                    )
-                    #self.log_info(f"{b_iface.device} {a_iface.name} to {z2_iface.device} {z1_iface.name} : saving cable")
-                    cable.save()
-                    self.log_success(f"{b_iface.device} to {bz_iface.device} : created cable {cable}")
-
-                    # increment counters
-                    core_iface_index = core_iface_index + 1
-                    subnet_index = subnet_index + 2   # increment by 2, since two interfaces were allocated per loop
-                    
-
-                # build device attributes list for doing CSV output later
+                for number, (tier, index) in enumerate(topology.devices)
+            ]
+            for start in range(0, len(devices), BULK_BATCH_SIZE):
+                batch = Device.objects.bulk_create(devices[start:start + BULK_BATCH_SIZE])
+                record_changes(self, batch)
+                instantiate_components(batch)
+                for device in batch:
+                    log.record('created', device, f"Created {device} @ {site}")
+
+            # load the planned ports of the new devices once, the plan says which to connect
+            ports = PortMap(devices, names=port_names)
+
+            for upper, upper_port, lower, lower_port, addressing in topology.links:
+                a_iface = ports.get(devices[upper], upper_port)
+                z_iface = ports.get(devices[lower], lower_port)
+
+                if addressing:
+                    link = links[addressing].allocate()
+                    add_ip_prefix(ipam, a_iface, link.prefix)
+
+                    # add ip address to interface on the upper device ("A" side)
+                    log.detail(f"{a_iface.device} {a_iface.name} assigned {link.a} ")
+                    add_ip_to_interface(ipam, a_iface, link.a)
+                    # add ip address to interface on other device ("Z" side)
+                    add_ip_to_interface(ipam, z_iface, link.z)
+
+                # Create a cable from the upper device to the next device z_iface
+                cable = Cable(
+                            termination_a=a_iface,
+                            termination_b=z_iface,
+                            status=LinkStatusChoices.STATUS_PLANNED
+                )
+                cable.save()
+                log.record('created', cable, f"{a_iface.device} to {z_iface.device} : created cable {cable}")
+
+            # build device attributes list for doing CSV output later
+            for device in devices:
                 attrs = [
                     device.name,
                     device.device_type.manufacturer.name,
@@ -295,5 +512,9 @@ class MyCustScript(Script):
                 ]
                 output.append(','.join(attrs))
 
+        with self.profiler.phase('ipam'):
+            ipam.flush()
+        log.summary()
+
         # Output the CSV Table results
-        return('\n'.join(output)) 
+        return('\n'.join(output))
@@ -3,7 +3,6 @@ from django.utils.text import slugify
 from dcim.models import Device, Site, Interface
 from ipam.models import Prefix, IPAddress
 from extras.scripts import *
-import pandas as pd
 
 '''
     This script consumes exported CSV data from Nokia NSP Network Resource>IP Addresses
@@ -117,6 +116,9 @@ class MyScript(Script):
         
         self.log_info(f"Assumes all devices exist in NetBox, and will skip any interfaces that already exist")
 
+        # pandas takes a while to import, so only scripts that run pay for it
+        import pandas as pd
+
         df = pd.read_csv(data['csvfile'])
         
         self.log_success(f"CSV file read")
@@ -2,7 +2,6 @@ from django.utils.text import slugify
 
 from dcim.models import Device, Site, Location, Rack
 from extras.scripts import *
-import pandas as pd
 
 
 
@@ -81,6 +80,9 @@ class MyScript(Script):
         
         self.log_info(f"Assumes all devices are racked on the front side of the the rack")
 
+        # pandas takes a while to import, so only scripts that run pay for it
+        import pandas as pd
+
         df = pd.read_csv(data['csvfile'])
         output = []
 
@@ -13,6 +13,11 @@ from tenancy.models import Tenant
 from utilities.choices import ColorChoices
 from utilities.forms.constants import ALPHANUMERIC_EXPANSION_PATTERN
 from utilities.forms.utils import expand_alphanumeric_pattern
+import os, sys
+
+# shared helpers live next to this script
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from script_utils import PROFILE_CHOICES, profiled
 
 NO_CHOICE = ()
 # https://github.com/netbox-community/netbox/issues/8228
@@ -56,7 +61,9 @@ class MultiConnect(Script):
     cable_length = IntegerVar(required=False, label="Cable Length") # unfortunately there is no DecimalVar
     cable_length_unit = ChoiceVar(choices=NO_CHOICE+CableLengthUnitChoices.CHOICES, required=False, label="Cable Length Unit")
     cable_tags = MultiObjectVar(model=Tag, required=False, label="Cable Tags")
+    profile = ChoiceVar(choices=PROFILE_CHOICES, default='off', label="Profile", description="Report time, SQL queries, rows written and peak memory (slows the run down)")
 
+    @profiled
     def run(self, data, commit):
         device_a = data["device_a"]
         device_b = data["device_b"]
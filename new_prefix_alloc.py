@@ -10,6 +10,11 @@ from ipam.choices import *
 from extras.scripts import *
 
 import netaddr
+import os, sys
+
+# shared helpers live next to this script
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from script_utils import PROFILE_CHOICES, profiled
 
 
 CIDR_RangeStart = 30
@@ -46,7 +51,7 @@ class MyCustScript(Script):
     class Meta:
         name = "Allocate Prefixes to VLAN"
         description = "calculates and generates child prefixes space from a parent prefix"
-        field_order = ['tenant','role','vlan','site_count','ip_count','ip_reserved','parent_prefix']
+        field_order = ['tenant','role','vlan','site_count','ip_count','ip_reserved','parent_prefix','profile']
         commit_default = False
 
     tenant = ObjectVar(
@@ -88,9 +93,15 @@ class MyCustScript(Script):
             'role_id': '$role'
         }
     )
+    profile = ChoiceVar(
+        choices = PROFILE_CHOICES,
+        default = 'off',
+        description = "Report time, SQL queries, rows written and peak memory (slows the run down)"
+    )
 
 
 
+    @profiled
     def run(self, data, commit):
 
 
@@ -0,0 +1,716 @@
+'''
+    Common task functions shared by the scripts in this folder
+
+    NetBox loads every script module by path without adding this folder to
+    sys.path, so scripts import this module like so:
+
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        from script_utils import wipe_sites
+
+    There are no Script classes in here, so NetBox does not list it.
+'''
+
+import functools
+import ipaddress
+import json
+import os
+import queue
+import socket
+import threading
+import time
+import tracemalloc
+from collections import defaultdict, namedtuple
+from contextlib import ExitStack, contextmanager
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, connections, transaction
+from django.db.models import Q
+
+from circuits.models import Circuit, CircuitTermination
+from dcim.models import Cable, Device, DeviceType, Interface, Location, Rack, Site
+from extras.choices import ObjectChangeActionChoices
+from extras.models import ObjectChange
+from ipam.models import IPAddress, Prefix
+from ipam.utils import rebuild_prefixes
+
+
+# max number of objects sent to the database per bulk_create call
+BULK_BATCH_SIZE = 500
+
+# DeviceType relations holding the component templates, in the order
+# Device.save() instantiates them
+COMPONENT_TEMPLATES = (
+    'consoleporttemplates',
+    'consoleserverporttemplates',
+    'powerporttemplates',
+    'poweroutlettemplates',
+    'interfacetemplates',
+    'rearporttemplates',
+    'frontporttemplates',
+    'modulebaytemplates',
+    'devicebaytemplates',
+)
+
+# per object messages logged for each model and action before ScriptLog only counts them
+LOG_EXAMPLES = 5
+
+
+class ScriptLog:
+    '''
+    aggregated logging for scripts that touch many objects
+    per object messages are counted per phase, model and action, only the
+    first few of each are logged as examples and summary() logs the counts
+    as a table; failures are always logged in full
+    with verbose=True every message is logged, like self.log_success() would
+    '''
+
+    def __init__(self, script, verbose=False, examples=LOG_EXAMPLES):
+        self.script = script
+        self.verbose = verbose
+        self.examples = examples
+        self.current = ''
+        self.counts = defaultdict(int)    # (phase, model, action) -> count
+        self.quiet = set()                # keys past their examples
+
+    @contextmanager
+    def phase(self, name):
+        '''
+        count everything logged inside the with block under a phase name
+        '''
+        previous, self.current = self.current, name
+        try:
+            yield self
+        finally:
+            self.current = previous
+
+    @staticmethod
+    def label(model):
+        '''
+        the name objects are counted under, from a model, an object or a string
+        '''
+        meta = getattr(model, '_meta', None)
+        return str(meta.verbose_name) if meta else str(model)
+
+    def record(self, action, obj, message=None):
+        '''
+        one object was e.g. created, message defaults to "<action> <model> <obj>"
+        '''
+        self.record_many(action, obj, 1, message or f"{action.capitalize()} {self.label(obj)} {obj}")
+
+    def record_many(self, action, model, count, message=None):
+        '''
+        a number of objects of one model were e.g. created at once
+        '''
+        if not count:
+            return
+        key = (self.current, self.label(model), action)
+        logged = self.counts[key]
+        self.counts[key] += count
+        if message is None:
+            message = f"{action.capitalize()} {count} {self.label(model)}"
+        if self.verbose or logged < self.examples:
+            self.script.log_success(message)
+        elif key not in self.quiet:
+            self.quiet.add(key)
+            self.script.log_info(f"Further {self.label(model)} {action} are only counted, see the summary")
+
+    def detail(self, message):
+        '''
+        a progress message only logged with verbose=True
+        '''
+        if self.verbose:
+            self.script.log_info(message)
+
+    def failed(self, obj, message):
+        '''
+        failures are always logged
+        '''
+        self.counts[(self.current, self.label(obj), 'failed')] += 1
+        self.script.log_failure(message)
+
+    def merge(self, counts):
+        '''
+        add the counts of another ScriptLog, e.g. one from a worker process
+        '''
+        for key, count in counts.items():
+            self.counts[key] += count
+
+    def summary(self):
+        '''
+        log the counts as one table, in the order the phases ran
+        '''
+        if not self.counts:
+            return
+        rows = [f"| {phase or '-'} | {model} | {action} | {count} |" for (phase, model, action), count in self.counts.items()]
+        table = ["| Phase | Model | Action | Count |", "|---|---|---|---:|"] + rows
+        self.script.log_info("Summary\n\n" + "\n".join(table))
+        return
+
+
+# where ScriptProfiler writes its JSON reports, next to the example YAML documents
+PROFILE_PATH = "/opt/netbox-scripts/profiles/"
+
+# the profile Script variable: off, a table in the output, or a table and a JSON file
+PROFILE_CHOICES = (
+    ('off', 'Off'),
+    ('table', 'Table'),
+    ('json', 'Table and JSON file'),
+)
+
+# the statements whose rowcount is reported as rows written
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE')
+
+
+class ScriptProfiler:
+    '''
+    wall time, database queries, database time, rows written and peak
+    memory of each phase of a script run, reported as one table
+    phases may nest and repeat, every row is inclusive of the phases
+    inside it and sums all the times that phase was entered
+    nothing is measured unless a mode is given, tracing the memory
+    slows a run down noticeably, so it is meant for test runs (or
+    switched off with trace_memory=False, the peaks are then 0)
+    '''
+
+    FIELDS = ('calls', 'seconds', 'queries', 'db_seconds', 'rows', 'peak')
+
+    def __init__(self, script, mode=None, trace_memory=True):
+        self.script = script
+        self.trace_memory = trace_memory
+        self.mode = None
+        self.stats = {}       # phase name -> FIELDS
+        self.active = []      # [stats, base memory, peak memory] of the phases being measured
+        self.configure(mode)
+
+    def configure(self, mode):
+        '''
+        switch profiling on, mode is 'table' (or True) or 'json' to also
+        write the report to PROFILE_PATH; an off mode changes nothing, so
+        e.g. the document vars can't switch off what the form switched on
+        '''
+        if mode and mode != 'off':
+            self.mode = 'json' if mode == 'json' else 'table'
+        return
+
+    @property
+    def enabled(self):
+        return self.mode is not None
+
+    def _execute(self, execute, sql, params, many, context):
+        '''
+        database execute wrapper, counts every query towards the active phases
+        '''
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            rows = 0
+            if sql.lstrip()[:6].upper() in WRITE_STATEMENTS:
+                rows = max(context['cursor'].rowcount, 0)
+            for stats, _, _ in self.active:
+                stats['queries'] += 1
+                stats['db_seconds'] += elapsed
+                stats['rows'] += rows
+
+    @contextmanager
+    def phase(self, name):
+        '''
+        measure everything done inside the with block under a phase name
+        '''
+        if not self.enabled:
+            yield self
+            return
+
+        stats = self.stats.setdefault(name, dict.fromkeys(self.FIELDS, 0))
+        # a phase entered again inside itself is already being measured
+        if any(frame[0] is stats for frame in self.active):
+            yield self
+            return
+
+        # memory is only traced while phases are measured
+        started = self.trace_memory and not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        if self.active:
+            # the peak is reset for this phase, keep the one of the outer phase so far
+            self.active[-1][2] = max(self.active[-1][2], tracemalloc.get_traced_memory()[1])
+        if hasattr(tracemalloc, 'reset_peak') and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        frame = [stats, current, current]
+
+        with ExitStack() as stack:
+            # the outermost phase instruments this thread's connection, see
+            # run_in_own_transaction() and run_in_processes() for the others
+            if not self.active:
+                stack.enter_context(connection.execute_wrapper(self._execute))
+            self.active.append(frame)
+            start = time.perf_counter()
+            try:
+                yield self
+            finally:
+                stats['calls'] += 1
+                stats['seconds'] += time.perf_counter() - start
+                self.active.pop()
+                frame[2] = max(frame[2], tracemalloc.get_traced_memory()[1])
+                stats['peak'] = max(stats['peak'], frame[2] - frame[1])
+                if self.active:
+                    self.active[-1][2] = max(self.active[-1][2], frame[2])
+                if started:
+                    tracemalloc.stop()
+
+    def snapshot(self):
+        '''
+        a copy of the stats so far, see since()
+        '''
+        return {name: dict(stats) for name, stats in self.stats.items()}
+
+    def since(self, snapshot):
+        '''
+        what was measured after a snapshot, e.g. in a worker process, for merge()
+        '''
+        delta = {}
+        for name, stats in self.stats.items():
+            before = snapshot.get(name, {})
+            delta[name] = {field: stats[field] - before.get(field, 0) for field in self.FIELDS}
+            delta[name]['peak'] = stats['peak']
+        return delta
+
+    def merge(self, stats):
+        '''
+        add the stats of another ScriptProfiler, e.g. one from a worker
+        process; times are summed over the workers, peaks are the largest one
+        '''
+        for name, other in stats.items():
+            mine = self.stats.setdefault(name, dict.fromkeys(self.FIELDS, 0))
+            for field in self.FIELDS:
+                mine[field] = max(mine[field], other[field]) if field == 'peak' else mine[field] + other[field]
+
+    def report(self):
+        '''
+        log the stats as one table, in the order the phases were first
+        entered, and write them to a JSON file in json mode
+        '''
+        if not self.enabled or not self.stats:
+            return
+        rows = [
+            f"| {name} | {stats['calls']} | {stats['seconds']:.3f} | {stats['queries']} | "
+            f"{stats['db_seconds']:.3f} | {stats['rows']} | {stats['peak'] / 2**20:.1f} |"
+            for name, stats in self.stats.items()
+        ]
+        table = [
+            "| Phase | Calls | Time (s) | Queries | DB time (s) | Rows written | Peak memory (MiB) |",
+            "|---|---:|---:|---:|---:|---:|---:|",
+        ] + rows
+        self.script.log_info("Profile\n\n" + "\n".join(table))
+
+        if self.mode == 'json':
+            path = os.path.join(PROFILE_PATH, f"{type(self.script).__name__}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+            try:
+                os.makedirs(PROFILE_PATH, exist_ok=True)
+                with open(path, "w") as f:
+                    json.dump({'script': type(self.script).__name__, 'phases': self.stats}, f, indent=1)
+            except OSError as e:
+                self.script.log_warning(f"Unable to write the profile to {path}: {e}")
+            else:
+                self.script.log_info(f"Profile written to {path}")
+        return
+
+
+def profiled(run):
+    '''
+    decorator for Script.run(), with the profile Script variable set the
+    whole run is measured as the phase "run" and reported at the end
+    run() may measure phases of its own with self.profiler.phase()
+    '''
+    @functools.wraps(run)
+    def wrapper(self, data, commit):
+        self.profiler = ScriptProfiler(self, data.get('profile'))
+        try:
+            with self.profiler.phase('run'):
+                return run(self, data, commit)
+        finally:
+            self.profiler.report()
+    return wrapper
+
+
+# one point-to-point link, as the strings Prefix(prefix=) and IPAddress(address=) take
+Link = namedtuple('Link', 'prefix a z')
+
+
+class LinkAllocator:
+    '''
+    hands out point-to-point link subnets from free address blocks in order,
+    with integer arithmetic instead of building the list of every subnet
+    /31 (RFC 3021) and /127 links use both of their addresses, longer
+    subnets like /30 the first two hosts after the network address
+    blocks smaller than a link are skipped, len() is the links left
+    '''
+
+    def __init__(self, blocks, prefixlen):
+        self.prefixlen = prefixlen
+        self.blocks = []    # [first address as int, links in the block]
+        self.version = None
+        for block in blocks:
+            network = ipaddress.ip_network(str(block))
+            if self.version and network.version != self.version:
+                raise ValueError(f"{network} is not an IPv{self.version} block")
+            self.version = network.version
+            if network.prefixlen <= prefixlen < network.max_prefixlen:
+                self.blocks.append([int(network.network_address), 1 << (prefixlen - network.prefixlen)])
+        # allocate() takes from the end
+        self.blocks.reverse()
+        self.size = 1 << ((32 if self.version == 4 else 128) - prefixlen)
+        # no network and broadcast address to skip on /31 and /127
+        self.host = 0 if self.size == 2 else 1
+        self.family = socket.AF_INET if self.version == 4 else socket.AF_INET6
+        self.length = 4 if self.version == 4 else 16
+
+    def __len__(self):
+        return sum(count for _, count in self.blocks)
+
+    def __iter__(self):
+        while self.blocks:
+            yield self.allocate()
+
+    def address(self, value):
+        return f"{socket.inet_ntop(self.family, value.to_bytes(self.length, 'big'))}/{self.prefixlen}"
+
+    def allocate(self):
+        '''
+        the next free link, ValueError when the blocks are used up
+        '''
+        if not self.blocks:
+            raise ValueError(f"No /{self.prefixlen} links left to allocate")
+        block = self.blocks[-1]
+        first = block[0]
+        block[0] += self.size
+        block[1] -= 1
+        if not block[1]:
+            self.blocks.pop()
+        return Link(self.address(first), self.address(first + self.host), self.address(first + self.host + 1))
+
+
+class LinkPool:
+    '''
+    the free address blocks of one prefix, shared by every kind of link
+    taken from it: carve() sets aside the blocks for a number of links of
+    one length and returns a LinkAllocator over them, so links of several
+    lengths from one prefix never overlap
+    carving the shortest prefix lengths first keeps the rest aligned for
+    the longer ones
+    '''
+
+    def __init__(self, blocks):
+        self.blocks = [ipaddress.ip_network(str(block)) for block in blocks]
+
+    def free(self):
+        '''
+        the free addresses left, more than len() can return in IPv6
+        '''
+        return sum(block.num_addresses for block in self.blocks)
+
+    def carve(self, prefixlen, count):
+        '''
+        a LinkAllocator for count links, ValueError when they don't fit in
+        what is left, the pool is then left as it was
+        '''
+        taken, left = [], []
+        for block in self.blocks:
+            if not count or not block.prefixlen <= prefixlen < block.max_prefixlen:
+                left.append(block)
+                continue
+            size = 1 << (block.max_prefixlen - prefixlen)
+            links = min(count, block.num_addresses // size)
+            count -= links
+            end = links * size
+            taken.extend(ipaddress.summarize_address_range(block.network_address, block.network_address + (end - 1)))
+            if end < block.num_addresses:
+                left.extend(ipaddress.summarize_address_range(block.network_address + end, block.broadcast_address))
+        if count:
+            raise ValueError(f"{count} more /{prefixlen} links than there is free space for")
+        self.blocks = left
+        return LinkAllocator(taken, prefixlen)
+
+
+def record_changes(script, objects, action=ObjectChangeActionChoices.ACTION_CREATE):
+    '''
+    the changelog entries save() and its signals would have written, for
+    objects written with bulk_create or bulk_update, with one bulk_create;
+    they carry the user and request id of the script run, nothing is
+    recorded without a request (e.g. a script run outside of NetBox)
+    '''
+    request = getattr(script, 'request', None)
+    if request is None:
+        return
+    changes = []
+    for obj in objects:
+        change = obj.to_objectchange(action)
+        change.user = request.user
+        change.user_name = request.user.username
+        change.request_id = request.id
+        changes.append(change)
+    ObjectChange.objects.bulk_create(changes, batch_size=BULK_BATCH_SIZE)
+    return
+
+
+class IPAMWriter:
+    '''
+    collects new prefixes and interface addresses and writes them with
+    bulk_create in flush(), instead of a save() per object and an M2M add
+    per address; each address is assigned to its interface as it is built
+    bulk_create skips Prefix.save() and its signals, so flush() rebuilds
+    the prefix hierarchy (depth and children) of the VRFs it wrote
+    prefixes to, once per flush, and records the changelog of the script run
+    '''
+
+    def __init__(self, log, batch_size=BULK_BATCH_SIZE):
+        self.log = log
+        self.batch_size = batch_size
+        self.prefixes = []
+        self.addresses = []
+
+    def add_prefix(self, prefix, **attributes):
+        self.prefixes.append(Prefix(prefix=prefix, **attributes))
+
+    def add_address(self, interface, address, **attributes):
+        self.addresses.append(IPAddress(address=address, assigned_object=interface, **attributes))
+
+    def flush(self):
+        '''
+        write everything collected so far, returns (prefixes, addresses) written
+        '''
+        prefixes, self.prefixes = self.prefixes, []
+        addresses, self.addresses = self.addresses, []
+        if prefixes:
+            Prefix.objects.bulk_create(prefixes, batch_size=self.batch_size)
+            for vrf_id in {prefix.vrf_id for prefix in prefixes}:
+                rebuild_prefixes(vrf_id)
+            record_changes(self.log.script, prefixes)
+            self.log.record_many('created', Prefix, len(prefixes), f"Saved {len(prefixes)} prefixes, first {prefixes[0]}")
+        if addresses:
+            IPAddress.objects.bulk_create(addresses, batch_size=self.batch_size)
+            record_changes(self.log.script, addresses)
+            self.log.record_many(
+                'created', IPAddress, len(addresses),
+                f"Saved {len(addresses)} addresses, first {addresses[0]} on {addresses[0].assigned_object.device} {addresses[0].assigned_object}"
+            )
+        return len(prefixes), len(addresses)
+
+
+def instantiate_components(devices):
+    '''
+    what Device.save() does for a new device, for a whole batch of devices
+    made with bulk_create: create the components defined by the device
+    types, one query per template model and one bulk_create per component model
+    '''
+    by_type = defaultdict(list)
+    for device in devices:
+        by_type[device.device_type_id].append(device)
+
+    for relation in COMPONENT_TEMPLATES:
+        # e.g. module bays only exist in newer NetBox versions
+        if not hasattr(DeviceType, relation):
+            continue
+        template_model = getattr(DeviceType, relation).rel.related_model
+        components = defaultdict(list)
+        for template in template_model.objects.filter(device_type_id__in=by_type):
+            for device in by_type[template.device_type_id]:
+                components[template.component_model].append(template.instantiate(device=device))
+        for model, objs in components.items():
+            model.objects.bulk_create(objs, batch_size=BULK_BATCH_SIZE)
+    return
+
+
+class PortMap:
+    '''
+    the interfaces of a batch of devices, loaded with one query, by device
+    and name, so the ports of a plan are looked up in memory
+    with names only the interfaces of those names are loaded, for plans
+    that name every port they use
+    '''
+
+    def __init__(self, devices, names=None):
+        devices = {device.pk: device for device in devices}
+        self.interfaces = {}                # (device pk, name) -> interface
+        interfaces = Interface.objects.filter(device_id__in=devices)
+        if names is not None:
+            interfaces = interfaces.filter(name__in=names)
+        for interface in interfaces:
+            # the device is in memory already, don't fetch it again per interface
+            interface.device = devices[interface.device_id]
+            self.interfaces[(interface.device_id, interface.name)] = interface
+
+    def get(self, device, name):
+        return self.interfaces[(device.pk, name)]
+
+
+def plan_site_wipe(sites):
+    '''
+    the full dependency closure of some sites as (name, queryset) pairs, in
+    the order they must be deleted
+    every queryset is built from subqueries, so nothing is read until it is deleted
+    '''
+    devices = Device.objects.filter(site__in=sites)
+    interfaces = Interface.objects.filter(device__in=devices)
+    circuits = Circuit.objects.filter(pk__in=CircuitTermination.objects.filter(site__in=sites).values('circuit'))
+    terminations = CircuitTermination.objects.filter(circuit__in=circuits)
+
+    interface_type = ContentType.objects.get_for_model(Interface)
+    termination_type = ContentType.objects.get_for_model(CircuitTermination)
+
+    cables = Cable.objects.filter(
+        Q(_termination_a_device__in=devices) |
+        Q(_termination_b_device__in=devices) |
+        Q(termination_a_type=termination_type, termination_a_id__in=terminations.values('pk')) |
+        Q(termination_b_type=termination_type, termination_b_id__in=terminations.values('pk'))
+    )
+    addresses = IPAddress.objects.filter(
+        assigned_object_type=interface_type,
+        assigned_object_id__in=interfaces.values('pk'),
+    )
+
+    return [
+        ('cables', cables),
+        ('ip addresses', addresses),
+        ('interfaces', interfaces),
+        ('devices', devices),
+        ('racks', Rack.objects.filter(site__in=sites)),
+        ('locations', Location.objects.filter(site__in=sites)),
+        ('circuits', circuits),
+        ('sites', Site.objects.filter(pk__in=[site.pk for site in sites])),
+    ]
+
+
+def wipe_sites(self, sites):
+    '''
+    WARNING: This deletes the sites and everything in or attached to them,
+    including any circuit terminating at one of them.
+    one queryset delete per model instead of one delete per object
+    returns the number of deleted objects per model
+    '''
+    sites = list(sites)
+    if not sites:
+        self.log_info(f"No sites to delete, skipping this")
+        return {}
+
+    self.log_warning(f"{len(sites)} sites will be wiped/erased: {', '.join(str(site) for site in sites)}")
+
+    counts = {}
+    for name, queryset in plan_site_wipe(sites):
+        total, per_model = queryset.delete()
+        # cascades (e.g. console ports of a device) are reported under their own model
+        for label, count in per_model.items():
+            if count:
+                counts[label] = counts.get(label, 0) + count
+        self.log_debug(f"Deleted {total} objects with the {name}")
+
+    for label, count in sorted(counts.items()):
+        self.log_warning(f"Deleted {count} {label}")
+    return counts
+
+
+def run_in_own_transaction(function, *args):
+    '''
+    run function in a transaction that commits on its own, instead of joining
+    the one NetBox wraps around Script.run()
+    Django gives every thread its own database connection, so the function
+    runs in a short lived thread, exceptions are raised again in the caller
+    '''
+    outcome = {}
+    # e.g. a ScriptProfiler measuring the caller also measures the thread
+    wrappers = list(connection.execute_wrappers)
+
+    def target():
+        connection.execute_wrappers.extend(wrappers)
+        try:
+            with transaction.atomic():
+                outcome['result'] = function(*args)
+        except Exception as e:
+            outcome['error'] = e
+        finally:
+            connections.close_all()
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome.get('result')
+
+
+# the database connections forked workers inherit from NetBox, see run_in_processes()
+_INHERITED_CONNECTIONS = []
+
+
+def _fresh_connections():
+    '''
+    give a forked worker database connections of its own
+    the inherited ones share their socket with the parent (and its open
+    transaction), so they are kept referenced and never closed from here
+    '''
+    for alias in connections:
+        inherited = connections[alias]
+        _INHERITED_CONNECTIONS.append(inherited)
+        connections[alias] = connections.create_connection(alias)
+        # e.g. a ScriptProfiler measuring the parent keeps measuring the worker
+        connections[alias].execute_wrappers.extend(inherited.execute_wrappers)
+
+
+def run_in_processes(function, items, workers):
+    '''
+    call function(item) for every item in a pool of forked worker processes,
+    each one with its own database connections (so nothing they write is
+    part of the Script transaction), returns (result, error) per item in
+    the order of items
+    function and items are inherited through the fork, only the results
+    and error messages cross back so they must pickle
+    '''
+    # only the scripts that use workers pay for importing multiprocessing
+    import multiprocessing
+
+    context = multiprocessing.get_context('fork')
+    tasks = context.Queue()
+    results = context.Queue()
+    count = min(workers, len(items))
+    for number in range(len(items)):
+        tasks.put(number)
+    for _ in range(count):
+        tasks.put(None)
+
+    def worker():
+        _fresh_connections()
+        for number in iter(tasks.get, None):
+            try:
+                results.put((number, function(items[number]), None))
+            except Exception as e:
+                # the exception itself may not pickle
+                results.put((number, None, f"{type(e).__name__}: {e}"))
+        connections.close_all()
+
+    processes = [context.Process(target=worker, daemon=True) for _ in range(count)]
+    for process in processes:
+        process.start()
+
+    outcomes = [None] * len(items)
+    pending = len(items)
+    while pending:
+        try:
+            number, result, error = results.get(timeout=5)
+        except queue.Empty:
+            # a worker that died without reporting would leave us waiting forever
+            if all(process.exitcode is not None for process in processes):
+                for number, outcome in enumerate(outcomes):
+                    if outcome is None:
+                        outcomes[number] = (None, "the worker process died")
+                break
+            continue
+        outcomes[number] = (result, error)
+        pending -= 1
+
+    for process in processes:
+        process.join(timeout=5)
+        if process.is_alive():
+            process.terminate()
+    return outcomes
@@ -0,0 +1,58 @@
+#!/usr/bin/python
+
+'''
+    Link subnets of bulk-site-device2.py: addressing names that share a
+    prefix take their links from one LinkPool and never overlap. Nothing
+    touches the database, but script_utils needs NetBox to import, so run
+    it with the NetBox virtualenv:
+
+        NETBOX_ROOT=/opt/netbox/netbox python3 -m unittest discover tests
+'''
+
+import ipaddress
+import os
+import sys
+import unittest
+
+NETBOX_ROOT = os.environ.get('NETBOX_ROOT', '/opt/netbox/netbox')
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+script_utils = None
+
+
+def setUpModule():
+    global script_utils
+    sys.path.insert(0, NETBOX_ROOT)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'netbox.settings')
+    import django
+    django.setup()
+    sys.path.insert(0, REPO)
+    import script_utils
+
+
+class LinkPoolTest(unittest.TestCase):
+
+    def test_two_names_on_one_prefix(self):
+        # 10.0.0.4/30 is taken, the rest of the /27 is free
+        pool = script_utils.LinkPool(['10.0.0.0/30', '10.0.0.8/29', '10.0.0.16/28'])
+        core = pool.carve(30, 4)
+        access = pool.carve(31, 6)
+        subnets = [ipaddress.ip_network(link.prefix) for link in list(core) + list(access)]
+        self.assertEqual(len(subnets), 10)
+        for i, subnet in enumerate(subnets):
+            for other in subnets[i + 1:]:
+                self.assertFalse(subnet.overlaps(other), f"{subnet} overlaps {other}")
+        self.assertEqual(pool.free(), 28 - 4 * 4 - 6 * 2)
+
+    def test_total_demand_must_fit(self):
+        pool = script_utils.LinkPool(['10.0.0.0/28'])
+        pool.carve(30, 3)
+        with self.assertRaises(ValueError):
+            pool.carve(31, 3)
+        # a failed carve leaves the pool as it was
+        self.assertEqual(pool.free(), 4)
+        self.assertEqual(len(pool.carve(31, 2)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/python
+
+'''
+    Reconcile mode of yaml-to-netbox.py: only the sections a document has
+    are compared, so a partial document deletes nothing it doesn't mention.
+    Nothing touches the database, but the script module needs NetBox to
+    import, so run it with the NetBox virtualenv:
+
+        NETBOX_ROOT=/opt/netbox/netbox python3 -m unittest discover tests
+'''
+
+import importlib.util
+import os
+import sys
+import unittest
+
+NETBOX_ROOT = os.environ.get('NETBOX_ROOT', '/opt/netbox/netbox')
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+script = None
+
+# what NetBox holds for the sites of the documents below
+EXISTING = {
+    'rack': {('101', 'R1'), ('101', 'R2'), ('102', 'R1')},
+    'device': {'sw1', 'sw2'},
+    'circuit': {'C1', 'C2'},
+    'cable': {frozenset({('interface', 'sw1', 'ge-0/0/0'), ('interface', 'sw2', 'ge-0/0/0')})},
+}
+
+
+def setUpModule():
+    global script
+    sys.path.insert(0, NETBOX_ROOT)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'netbox.settings')
+    import django
+    django.setup()
+    sys.path.insert(0, REPO)
+    spec = importlib.util.spec_from_file_location('yaml_to_netbox', os.path.join(REPO, 'yaml-to-netbox.py'))
+    script = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(script)
+
+
+class ReconcileScopeTest(unittest.TestCase):
+
+    def test_missing_sections_delete_nothing(self):
+        document = {
+            'vars': {'schema_verison': 1},
+            'sites': [{'facility': 101, 'name': 'one'}, {'facility': 102, 'name': 'two'}],
+            'devices': [{'name': 'sw1'}],
+        }
+        stale = script.stale_keys(document, EXISTING, {'device': {'sw1'}})
+        self.assertEqual(stale['device'], {'sw2'})
+        self.assertNotIn('circuit', stale)
+        self.assertNotIn('cable', stale)
+        # neither site lists its racks
+        self.assertEqual(stale['rack'], set())
+
+    def test_present_sections_are_compared(self):
+        document = {
+            'vars': {'schema_verison': 1},
+            'sites': [{'facility': 101, 'name': 'one', 'racks': [{'name': 'R1'}]}, {'facility': 102, 'name': 'two'}],
+            'circuits': [],
+            'cables': [],
+        }
+        stale = script.stale_keys(document, EXISTING, {'rack': {('101', 'R1')}})
+        self.assertEqual(stale['rack'], {('101', 'R2')})
+        self.assertEqual(stale['circuit'], {'C1', 'C2'})
+        self.assertEqual(stale['cable'], EXISTING['cable'])
+        self.assertNotIn('device', stale)
+
+
+if __name__ == '__main__':
+    unittest.main()
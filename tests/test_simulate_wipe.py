@@ -0,0 +1,68 @@
+#!/usr/bin/python
+
+'''
+    Simulate mode of yaml-to-netbox.py: with wipe set, the objects of the
+    wiped sites are left out of the checks, including the cables of their
+    template interfaces. Nothing touches the database, but the script module
+    needs NetBox to import, so run it with the NetBox virtualenv:
+
+        NETBOX_ROOT=/opt/netbox/netbox python3 -m unittest discover tests
+'''
+
+import importlib.util
+import os
+import sys
+import unittest
+
+NETBOX_ROOT = os.environ.get('NETBOX_ROOT', '/opt/netbox/netbox')
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+script = None
+
+WIPED_SITE = 7
+
+
+def setUpModule():
+    global script
+    sys.path.insert(0, NETBOX_ROOT)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'netbox.settings')
+    import django
+    django.setup()
+    sys.path.insert(0, REPO)
+    spec = importlib.util.spec_from_file_location('yaml_to_netbox', os.path.join(REPO, 'yaml-to-netbox.py'))
+    script = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(script)
+
+
+def simulator(wiped):
+    '''
+    a simulator for two new devices sw1 and sw2, whose device type creates
+    ge-0/0/1; sw1 already exists in the wiped site with that port cabled
+    '''
+    refs = script.ReferenceResolver()
+    device = script.Device(name='sw1', site_id=WIPED_SITE)
+    refs.add('interface', script.Interface(device=device, name='ge-0/0/1', cable_id=1), 'sw1', 'ge-0/0/1')
+    simulator = script.BuildSimulator(refs)
+    device_type = script.DeviceType(pk=1, model='switch')
+    simulator.ports[device_type.pk].add('ge-0/0/1')
+    simulator.device_types.update({'sw1': device_type, 'sw2': device_type})
+    if wiped:
+        simulator.wiped_sites.add(WIPED_SITE)
+    return simulator
+
+
+class SimulateWipeTest(unittest.TestCase):
+
+    def test_cabled_template_port_of_a_wiped_site(self):
+        wiped = simulator(wiped=True)
+        wiped.simulate_cable(('interface', 'sw1', 'ge-0/0/1'), ('interface', 'sw2', 'ge-0/0/1'))
+        self.assertEqual(wiped.conflicts, [])
+
+    def test_cabled_template_port_without_wipe(self):
+        kept = simulator(wiped=False)
+        kept.simulate_cable(('interface', 'sw1', 'ge-0/0/1'), ('interface', 'sw2', 'ge-0/0/1'))
+        self.assertEqual(kept.conflicts, ["interface sw1/ge-0/0/1: is already connected"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+
+'''
+    Streamed uploads of yaml-to-netbox.py: empty documents are skipped the
+    way the loaded path skips them. Nothing touches the database, but the
+    script module needs NetBox to import, so run it with the NetBox virtualenv:
+
+        NETBOX_ROOT=/opt/netbox/netbox python3 -m unittest discover tests
+'''
+
+import importlib.util
+import io
+import os
+import sys
+import unittest
+
+NETBOX_ROOT = os.environ.get('NETBOX_ROOT', '/opt/netbox/netbox')
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+script = None
+
+
+def setUpModule():
+    global script
+    sys.path.insert(0, NETBOX_ROOT)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'netbox.settings')
+    import django
+    django.setup()
+    sys.path.insert(0, REPO)
+    spec = importlib.util.spec_from_file_location('yaml_to_netbox', os.path.join(REPO, 'yaml-to-netbox.py'))
+    script = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(script)
+
+
+def streamed(text):
+    '''
+    the documents of an upload as lists of (key, value), sections read in full
+    '''
+    return [
+        [(key, list(value) if hasattr(value, '__next__') else value) for key, value in sections]
+        for sections in script.iter_yaml_documents(io.StringIO(text))
+    ]
+
+
+class StreamDocumentsTest(unittest.TestCase):
+
+    def test_trailing_separator(self):
+        documents = streamed("vars:\n  name: one\nsites:\n- name: A\n---\n")
+        self.assertEqual(documents, [[('vars', {'name': 'one'}), ('sites', [{'name': 'A'}])]])
+
+    def test_empty_documents_are_skipped(self):
+        documents = streamed("---\n---\nvars: {name: one}\n---\n{}\n---\nvars: {name: two}\n...\n---\n")
+        self.assertEqual(documents, [[('vars', {'name': 'one'})], [('vars', {'name': 'two'})]])
+
+    def test_validation_counts_only_real_documents(self):
+        validator = script.DocumentValidator()
+        for sections in script.iter_yaml_documents(io.StringIO("vars: {name: one, schema_verison: 1}\n---\n")):
+            validator.start_document()
+            for key, value in sections:
+                validator.check(key, value)
+            validator.end_document()
+        self.assertEqual(validator.documents, 1)
+        self.assertEqual(validator.errors, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
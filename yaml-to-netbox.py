@@ -17,16 +17,33 @@
 
 from django.utils.text import slugify
 from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ObjectDoesNotExist
 from django.db import transaction
-import yaml, io, sys, re
+from django.db.models import Count, Q
+import yaml, io, os, sys, re, json, hashlib, time
+from decimal import Decimal
+from itertools import chain, groupby
+from string import Formatter
+from collections import ChainMap, defaultdict
+from collections.abc import Mapping
+
+# the libyaml based loader is several times faster, when PyYAML was built with it
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
 
 from dcim.choices import DeviceStatusChoices, SiteStatusChoices, LinkStatusChoices
+from dcim.choices import RackStatusChoices, RackTypeChoices, RackWidthChoices, DeviceFaceChoices
+from dcim.choices import InterfaceTypeChoices, CableTypeChoices
+from circuits.choices import CircuitStatusChoices
 from dcim.models import Site, Location, Rack, RackRole
-from dcim.models import Device, DeviceRole, DeviceType, Interface, Cable
+from dcim.models import Device, DeviceRole, DeviceType, Interface, InterfaceTemplate, Cable
 from circuits.models import Circuit, CircuitType, CircuitTermination, ProviderNetwork, Provider
 from tenancy.models import Tenant
+from extras.choices import ObjectChangeActionChoices
 from extras.models import Tag
-from extras.scripts import Script, ChoiceVar, ObjectVar, StringVar, IntegerVar, MultiObjectVar, FileVar, TextVar
+from extras.scripts import Script, BooleanVar, ChoiceVar, ObjectVar, StringVar, IntegerVar, MultiObjectVar, FileVar, TextVar
 #from extras.scripts import *
 
 from netbox.settings import VERSION
@@ -34,14 +51,66 @@ from utilities.choices import ColorChoices
 from utilities.forms.constants import ALPHANUMERIC_EXPANSION_PATTERN
 from utilities.forms.utils import expand_alphanumeric_pattern
 
+# shared helpers live next to this script
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from script_utils import BULK_BATCH_SIZE, COMPONENT_TEMPLATES, ScriptLog, ScriptProfiler, PROFILE_CHOICES, wipe_sites, instantiate_components, record_changes, run_in_own_transaction, run_in_processes
+
 
 #specify the path for a default yaml document, mainly for testing
 YAML_PATH = "/opt/netbox-scripts/"
 DEFAULT_YAML_FILE = "example_1.yaml"
 
+# where chunked imports record the sites they completed, one file per document
+CHECKPOINT_PATH = os.path.join(YAML_PATH, "checkpoints")
+
+# where export mode writes its documents, smaller ones are also the script output
+EXPORT_PATH = os.path.join(YAML_PATH, "exports")
+EXPORT_OUTPUT_LIMIT = 1 << 20
+
 # the YAML document schema tested and working with the above script version
 SUPPORTED_SCHEMA_VERSIONS = [1]
 
+# the tenant named in the vars of the document being built, see process_vars()
+TENANT = None
+
+# keys every object must have a value for, the other keys shown in the
+# example documents may be left empty or out
+REQUIRED_KEYS = {
+    'site': ('name', 'facility'),
+    'rack': ('name',),
+    'device': ('name', 'facility', 'device_type', 'device_role'),
+    'interface': ('name', 'type'),
+    'circuit': ('cid', 'provider', 'type', 'z_facility'),
+    'cable': ('termination_a_device', 'termination_a_interface'),
+}
+
+# most validation errors logged for a rejected document, the rest are counted
+MAX_REPORTED_ERRORS = 500
+
+# keys of a cables row that may hold name patterns, e.g. ge-0/0/[0-47]
+CABLE_END_KEYS = (
+    'termination_a_device',
+    'termination_a_interface',
+    'termination_b_device',
+    'termination_b_interface',
+)
+
+# first level keys that hold lists of objects, in the order they must be built
+SECTION_ORDER = ('sites', 'devices', 'circuits', 'cables')
+
+# the kinds of objects SiteBuilder writes and the kinds they may depend on,
+# this is the one place the build order is defined (see BuildGraph)
+DEPENDENCIES = {
+    'site': (),
+    'rack': ('site',),
+    'device': ('site', 'rack'),
+    'lag': ('device',),
+    'interface': ('device', 'lag'),
+    'circuit': (),
+    'termination': ('circuit', 'site'),
+    'cable': ('device', 'lag', 'interface', 'termination'),
+}
+
 
 NO_CHOICE = ()
 # https://github.com/netbox-community/netbox/issues/8228
@@ -51,21 +120,1555 @@ if [int(n) for n in VERSION.split('-')[0].split('.')] < [3, 1, 5]:
         ('', '---------'),
     )
 
+MODE_CHOICES = (
+    ('create', 'Create'),
+    ('reconcile', 'Reconcile'),
+    ('simulate', 'Simulate (no writes)'),
+    ('export', 'Export sites to YAML'),
+)
+
 TERM_CHOICES = (
     ('interfaces', 'Interfaces'),
     ('frontports', 'Front Ports'),
     ('rearports', 'Rear Ports'),
 )
 
+def batched(iterable, size):
+    '''
+    yield lists of up to size items from any iterable
+    '''
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
 def expand_pattern(value):
     # Example: ge-0/0/[5,7,12-23]
-    if not value:
-        return ['']
-    if re.search(ALPHANUMERIC_EXPANSION_PATTERN, value):
+    if isinstance(value, str) and re.search(ALPHANUMERIC_EXPANSION_PATTERN, value):
         return list(expand_alphanumeric_pattern(value))
     return [value]
 
 
+def expand_items(items, key='name'):
+    '''
+    yield every mapping of a YAML list once per name its key expands to,
+    e.g. a device named 'leaf[1-4]' yields four devices
+    the expanded mappings are overlays on the declared one, so its other
+    keys (interfaces included) are shared rather than copied
+    '''
+    for item in items:
+        names = expand_pattern(item.get(key))
+        if len(names) == 1 and names[0] == item.get(key):
+            yield item
+            continue
+        for name in names:
+            yield ChainMap({key: name}, item)
+
+
+def expand_cable(cable):
+    '''
+    yield the cables one cables row expands to, the patterns in the end
+    keys are zipped and a plain value is used for every cable, e.g.
+    leaf[1-4] et-0/0/48 to spine1 et-0/0/[0-3] is four cables
+    '''
+    expanded = {}
+    for key in CABLE_END_KEYS:
+        values = expand_pattern(cable.get(key))
+        if len(values) > 1 or values[0] != cable.get(key):
+            expanded[key] = values
+    if not expanded:
+        yield cable
+        return
+
+    count = max(len(values) for values in expanded.values())
+    for key, values in expanded.items():
+        if len(values) not in (1, count):
+            raise DocumentError(f"{key} {cable[key]} expands to {len(values)} names, the cable ends expand to {count}")
+    for number in range(count):
+        yield ChainMap({key: values[number % len(values)] for key, values in expanded.items()}, cable)
+
+
+def expand_cables(cables):
+    '''
+    yield every cable of a YAML list, see expand_cable()
+    '''
+    for cable in cables:
+        yield from expand_cable(cable)
+
+
+class SiteTemplate:
+    '''
+    one entry of the first level *templates* key, compiled once and then
+    rendered for every rollout row that names it
+    every string holding {parameter} fields is parsed at compile time, and
+    the parts of the template without any are shared by all the renders
+    '''
+
+    def __init__(self, name, body):
+        self.name = name
+        self.parameters = set()
+        self.problems = []      # (where, message)
+        self.sections = {}
+        if not isinstance(body, dict):
+            self.problems.append((f"templates {name}", "must be a mapping of sections"))
+            return
+        for key, items in body.items():
+            if key not in SECTION_ORDER or not isinstance(items, list):
+                self.problems.append((f"templates {name}", f"{key} is not a list of {', '.join(SECTION_ORDER)}"))
+                continue
+            self.sections[key] = self.compile(items, f"templates {name} {key}")[0]
+
+    def compile(self, node, where):
+        '''
+        returns (function rendering node from the parameters, True if node has no fields)
+        '''
+        if isinstance(node, str):
+            try:
+                fields = [field for _, field, _, _ in Formatter().parse(node) if field is not None]
+            except ValueError as e:
+                self.problems.append((where, f"{node}: {e}"))
+                fields = []
+            if not fields:
+                return (lambda params: node), True
+            for field in fields:
+                name = re.split(r'[.\[]', field)[0]
+                if not name.isidentifier():
+                    self.problems.append((where, f"{node}: fields must be named, e.g. {{code}}"))
+                self.parameters.add(name)
+            # a lone field keeps the type of its parameter, e.g. position: '{position}'
+            if node == f"{{{fields[0]}}}" and fields[0].isidentifier():
+                field = fields[0]
+                return (lambda params: params[field]), False
+            return (lambda params: node.format_map(params)), False
+
+        if isinstance(node, dict):
+            parts = [(key, *self.compile(value, where)) for key, value in node.items()]
+            if all(constant for _, _, constant in parts):
+                return (lambda params: node), True
+            renders = [(key, render) for key, render, _ in parts]
+            return (lambda params: {key: render(params) for key, render in renders}), False
+
+        if isinstance(node, list):
+            parts = [self.compile(value, where) for value in node]
+            if all(constant for _, constant in parts):
+                return (lambda params: node), True
+            renders = [render for render, _ in parts]
+            return (lambda params: [render(params) for render in renders]), False
+
+        return (lambda params: node), True
+
+    def render(self, params):
+        '''
+        {section: [items]} for one rollout row
+        '''
+        return {key: render(params) for key, render in self.sections.items()}
+
+
+def compile_templates(templates):
+    '''
+    compile the *templates* key of a document, returns ({name: SiteTemplate}, problems)
+    '''
+    if not isinstance(templates, dict):
+        return {}, [('templates', "must be a mapping of template names to sections")]
+    compiled = {name: SiteTemplate(name, body) for name, body in templates.items()}
+    problems = [problem for template in compiled.values() for problem in template.problems]
+    return compiled, problems
+
+
+def render_rollout(compiled, rows, start=0):
+    '''
+    render rollout rows with their compiled templates, returns
+    ({section: [items]}, problems), rows with problems are left out
+    '''
+    sections = defaultdict(list)
+    problems = []
+    for number, row in enumerate(rows, start):
+        where = f"rollout[{number}]"
+        if not isinstance(row, dict):
+            problems.append((where, "must be a mapping of parameters"))
+            continue
+        template = compiled.get(row.get('template'))
+        if template is None:
+            problems.append((where, f"there is no template named {row.get('template')}"))
+            continue
+        if template.problems:
+            continue
+        missing = template.parameters - row.keys()
+        if missing:
+            problems.append((where, f"missing parameters for template {template.name}: {', '.join(sorted(missing))}"))
+            continue
+        for key, items in template.render(row).items():
+            sections[key].extend(items)
+    return sections, problems
+
+
+def apply_templates(result):
+    '''
+    render the rollout rows of a loaded document and append the rendered
+    objects to its sections, returns the problems found
+    '''
+    if 'rollout' not in result:
+        return []
+    if not isinstance(result['rollout'], list):
+        return [('rollout', "must be a list of parameter rows")]
+    compiled, problems = compile_templates(result.get('templates'))
+    sections, row_problems = render_rollout(compiled, result['rollout'])
+    for key, items in sections.items():
+        current = result.get(key) or []
+        # anything else is reported by DocumentValidator
+        if isinstance(current, list):
+            result[key] = current + items
+    return problems + row_problems
+
+
+def partition_by_site(result):
+    '''
+    split a loaded document into one sub-document per site facility and one
+    holding whatever spans sites: circuits between two sites and cables whose
+    ends are in different sites (or in devices the document does not declare)
+    returns ({facility: document}, document), the partitions in document order
+    '''
+    def new():
+        return {key: [] for key in SECTION_ORDER}
+
+    partitions = defaultdict(new)
+    cross = new()
+
+    for site in result.get('sites') or []:
+        partitions[str(site['facility'])]['sites'].append(site)
+
+    device_site = {}
+    for device in result.get('devices') or []:
+        facility = str(device['facility'])
+        partitions[facility]['devices'].append(device)
+        for name in expand_pattern(device['name']):
+            device_site[str(name)] = facility
+
+    circuit_site = {}
+    for circuit in result.get('circuits') or []:
+        facilities = {str(circuit['z_facility'])}
+        if circuit.get('a_facility'):
+            facilities.add(str(circuit['a_facility']))
+        if len(facilities) == 1:
+            circuit_site[str(circuit['cid'])] = facilities.pop()
+            partitions[circuit_site[str(circuit['cid'])]]['circuits'].append(circuit)
+        else:
+            cross['circuits'].append(circuit)
+
+    def cable_partition(cable):
+        '''
+        the facility of the partition of one cable, None for the cross-site one
+        '''
+        facilities = {device_site.get(str(cable['termination_a_device']))}
+        if cable.get('termination_b_device'):
+            facilities.add(device_site.get(str(cable['termination_b_device'])))
+        if cable.get('circuit_id'):
+            facilities.add(circuit_site.get(str(cable['circuit_id'])))
+        return facilities.pop() if len(facilities) == 1 else None
+
+    # a row whose cables all go to one partition is kept whole, with its patterns,
+    # only rows that span partitions are split into their cables
+    for row in result.get('cables') or []:
+        facilities = {cable_partition(cable) for cable in expand_cable(row)}
+        if len(facilities) == 1:
+            facility = facilities.pop()
+            (cross if facility is None else partitions[facility])['cables'].append(row)
+            continue
+        for cable in expand_cable(row):
+            facility = cable_partition(cable)
+            (cross if facility is None else partitions[facility])['cables'].append(cable)
+
+    return dict(partitions), cross
+
+
+# kind -> the section of a reconcile document that describes every object of it in scope
+RECONCILED_SECTIONS = {'device': 'devices', 'circuit': 'circuits', 'cable': 'cables'}
+
+
+def stale_keys(result, existing, described):
+    '''
+    the natural keys of existing objects a reconcile document no longer
+    describes, by kind; existing and described are kind -> natural keys in
+    scope, in NetBox and in the document
+    only the kinds of the sections in the document are compared, racks only
+    on the sites that list theirs, so a partial document never deletes what
+    it doesn't mention
+    '''
+    stale = {}
+    for kind, section in RECONCILED_SECTIONS.items():
+        if section in result:
+            stale[kind] = set(existing.get(kind, ())) - set(described.get(kind, ()))
+    listed = {str(site.get('facility')) for site in mappings(result.get('sites')) if 'racks' in site}
+    stale['rack'] = {key for key in existing.get('rack', ()) if key[0] in listed} - set(described.get('rack', ()))
+    return stale
+
+
+def count_objects(document):
+    '''
+    the number of objects a (sub-)document creates, patterns expanded
+    '''
+    count = 0
+    for site in document.get('sites') or []:
+        count += 1 + len(site.get('racks') or [])
+    for device in expand_items(document.get('devices') or []):
+        count += 1 + sum(1 for _ in expand_items(device.get('interfaces') or []))
+    count += 3 * len(document.get('circuits') or [])
+    count += sum(1 for _ in expand_cables(document.get('cables') or []))
+    return count
+
+
+def document_digest(stream):
+    '''
+    sha256 of an uploaded (text or binary) stream, which is rewound afterwards
+    '''
+    digest = hashlib.sha256()
+    while True:
+        block = stream.read(1 << 20)
+        if not block:
+            break
+        digest.update(block.encode() if isinstance(block, str) else block)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def load_checkpoint(digest):
+    '''
+    the keys a chunked import of a document already completed
+    '''
+    try:
+        with open(os.path.join(CHECKPOINT_PATH, f"{digest}.json")) as f:
+            return set(json.load(f)['completed'])
+    except FileNotFoundError:
+        return set()
+
+
+def save_checkpoint(digest, completed):
+    '''
+    record the completed keys of a chunked import, replacing the file in
+    one step so an interrupted run never leaves half a checkpoint behind
+    '''
+    os.makedirs(CHECKPOINT_PATH, exist_ok=True)
+    path = os.path.join(CHECKPOINT_PATH, f"{digest}.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump({'document': digest, 'completed': sorted(completed)}, f, indent=1)
+    os.replace(path + ".tmp", path)
+    return
+
+
+class DocumentError(Exception):
+    '''
+    raised when a problem with the YAML document is found after writes began
+    '''
+    pass
+
+
+def _compose_node(event, events, anchors, resolver):
+    '''
+    turn the parser events of one YAML node into a node tree
+    '''
+    if isinstance(event, yaml.AliasEvent):
+        return anchors[event.anchor]
+
+    if isinstance(event, yaml.ScalarEvent):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = resolver.resolve(yaml.ScalarNode, event.value, event.implicit)
+        node = yaml.ScalarNode(tag, event.value, event.start_mark, event.end_mark, style=event.style)
+
+    elif isinstance(event, yaml.SequenceStartEvent):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = resolver.resolve(yaml.SequenceNode, None, event.implicit)
+        node = yaml.SequenceNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+        for child in events:
+            if isinstance(child, yaml.SequenceEndEvent):
+                break
+            node.value.append(_compose_node(child, events, anchors, resolver))
+
+    elif isinstance(event, yaml.MappingStartEvent):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = resolver.resolve(yaml.MappingNode, None, event.implicit)
+        node = yaml.MappingNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+        for child in events:
+            if isinstance(child, yaml.MappingEndEvent):
+                break
+            key = _compose_node(child, events, anchors, resolver)
+            node.value.append((key, _compose_node(next(events), events, anchors, resolver)))
+
+    else:
+        raise yaml.YAMLError(f"unexpected YAML event {event}")
+
+    if event.anchor:
+        anchors[event.anchor] = node
+    return node
+
+
+def _iter_sections(events, resolver, constructor):
+    '''
+    yield (key, value) for each first level key of one document, the lists
+    in SECTION_ORDER are yielded as lazy iterators of their items
+    '''
+    anchors = {}
+
+    def construct(event):
+        return constructor.construct_document(_compose_node(event, events, anchors, resolver))
+
+    def items():
+        for event in events:
+            if isinstance(event, yaml.SequenceEndEvent):
+                return
+            yield construct(event)
+
+    event = next(events)
+    if not isinstance(event, yaml.MappingStartEvent):
+        # an empty document, e.g. after a trailing ---
+        if construct(event) is None:
+            next(events)
+            return
+        raise yaml.YAMLError("the first level of a YAML document must be a mapping")
+
+    for event in events:
+        if isinstance(event, yaml.MappingEndEvent):
+            break
+        key = construct(event)
+        event = next(events)
+        if key in SECTION_ORDER and isinstance(event, yaml.SequenceStartEvent):
+            section = items()
+            yield key, section
+            # skip whatever the consumer did not read
+            for _ in section:
+                pass
+        else:
+            yield key, construct(event)
+
+    # DocumentEndEvent
+    next(events)
+
+
+def iter_yaml_documents(stream):
+    '''
+    stream a (multi-document) YAML upload without ever loading it whole,
+    yields one _iter_sections() generator per document; empty documents,
+    e.g. after a trailing ---, are skipped like yaml.load_all() results are
+    '''
+    events = iter(yaml.parse(stream, Loader=YamlLoader))
+    resolver = yaml.resolver.Resolver()
+    constructor = yaml.constructor.SafeConstructor()
+    for event in events:
+        if isinstance(event, yaml.DocumentStartEvent):
+            sections = _iter_sections(events, resolver, constructor)
+            first = next(sections, None)
+            if first is None:
+                continue
+            yield chain([first], sections)
+            for _ in sections:
+                pass
+
+
+def natural_key(key):
+    '''
+    normalize a natural key to a tuple of strings, None if any part is empty
+    (empty references, e.g. no rack, are never looked up)
+    '''
+    if any(k is None or k == '' for k in key):
+        return None
+    return tuple(str(k) for k in key)
+
+
+def mappings(value):
+    '''
+    the mappings in a YAML list, anything else is reported by DocumentValidator
+    '''
+    if not isinstance(value, list):
+        return []
+    # expanded or partitioned items may be overlays (ChainMap) on the declared mapping
+    return [item for item in value if isinstance(item, Mapping)]
+
+
+def choice_map(choice_set):
+    '''
+    {value, or value or label in lower case: value} for a NetBox ChoiceSet,
+    so the YAML may use either, e.g. 'Planned' or 'planned', 19 or '19'
+    '''
+    mapping = {}
+    for value, label in choice_set.CHOICES:
+        # grouped choices, e.g. interface types
+        group = label if isinstance(label, (list, tuple)) else ((value, label),)
+        for value, label in group:
+            mapping[str(label).lower()] = value
+            mapping[str(value).lower()] = value
+            mapping[value] = value
+    return mapping
+
+
+def is_empty(value):
+    '''
+    None, '', [] or {}, but not 0 or False
+    '''
+    return not value and (value is None or isinstance(value, (str, list, tuple, dict, set)))
+
+
+class Ref:
+    '''
+    a mapped field that is the object referenced by the values of some YAML keys
+    '''
+
+    def __init__(self, kind, *keys):
+        self.kind = kind
+        self.keys = keys
+
+
+class FieldMapper:
+    '''
+    turns one YAML mapping into model kwargs in a single pass, compiled once
+    per kind of object instead of building and scrubbing a dict per object
+
+    each field is mapped from one of
+        'key'              the value of a YAML key
+        Ref(kind, *keys)   the object a ReferenceResolver finds for those keys
+        callable           a function of the YAML mapping
+    empty values (see is_empty) are left out so the model default applies,
+    choice fields accept the value or the label of the choice
+    '''
+
+    KEY, REF, CALL = range(3)
+
+    def __init__(self, fields, choices=None):
+        self.choices = {attr: choice_map(choice_set) for attr, choice_set in (choices or {}).items()}
+        self.fields = []
+        for attr, source in fields.items():
+            if isinstance(source, str):
+                how = self.KEY
+            elif isinstance(source, Ref):
+                how = self.REF
+            else:
+                how = self.CALL
+            self.fields.append((attr, how, source, self.choices.get(attr)))
+
+    def __call__(self, data, refs, **context):
+        '''
+        the kwargs for one object, context holds values that are not in the
+        YAML mapping (e.g. the parent object) and overrides mapped fields
+        '''
+        kwargs = {}
+        for attr, how, source, choices in self.fields:
+            if attr in context:
+                value = context.pop(attr)
+            elif how is self.KEY:
+                value = data.get(source)
+            elif how is self.REF:
+                value = refs.get(source.kind, *[data.get(key) for key in source.keys])
+            else:
+                value = source(data)
+            if not value and is_empty(value):
+                continue
+            if choices is not None:
+                value = choices.get(value) if value in choices else choices.get(str(value).lower(), value)
+            kwargs[attr] = value
+        # context fields the mapper does not know about, e.g. the parent object
+        for attr, value in context.items():
+            if not value and is_empty(value):
+                continue
+            kwargs[attr] = value
+        return kwargs
+
+
+# one compiled mapper per kind of object SiteBuilder builds from a YAML mapping
+MAPPERS = {
+    'site': FieldMapper(
+        {
+            'name': 'name',
+            'slug': lambda data: slugify(data.get('slug') or data.get('name') or ''),
+            'facility': 'facility',
+            'status': 'status',
+            'physical_address': 'physical_address',
+            'tenant': lambda data: TENANT,
+        },
+        choices={'status': SiteStatusChoices},
+    ),
+    'rack': FieldMapper(
+        {
+            'name': 'name',
+            'status': 'status',
+            'type': 'type',
+            'width': 'width',
+            'u_height': 'u_height',
+            'role': Ref('rack_role', 'role'),
+            'tenant': lambda data: TENANT,
+        },
+        choices={'status': RackStatusChoices, 'type': RackTypeChoices, 'width': RackWidthChoices},
+    ),
+    'location': FieldMapper(
+        {
+            'name': 'name',
+            'slug': lambda data: slugify(data.get('name') or ''),
+            'description': 'description',
+            'tenant': lambda data: TENANT,
+        },
+    ),
+    'device': FieldMapper(
+        {
+            'name': 'name',
+            'site': Ref('site', 'facility'),
+            'device_type': Ref('device_type', 'device_type'),
+            'status': 'status',
+            'device_role': Ref('device_role', 'device_role'),
+            'rack': Ref('rack', 'facility', 'rack'),
+            'position': 'position',
+            'face': 'face',
+            'tenant': lambda data: TENANT,
+        },
+        choices={'status': DeviceStatusChoices, 'face': DeviceFaceChoices},
+    ),
+    'interface': FieldMapper(
+        {
+            'name': 'name',
+            'type': 'type',
+        },
+        choices={'type': InterfaceTypeChoices},
+    ),
+    'circuit': FieldMapper(
+        {
+            'cid': 'cid',
+            'provider': Ref('provider', 'provider'),
+            'type': Ref('circuit_type', 'type'),
+            'status': 'status',
+            'commit_rate': 'commit_rate',
+            'tenant': lambda data: TENANT,
+        },
+        choices={'status': CircuitStatusChoices},
+    ),
+    'cable': FieldMapper(
+        {
+            'type': 'type',
+            'length': 'length',
+            'status': 'status',
+            'tenant': lambda data: TENANT,
+        },
+        choices={'type': CableTypeChoices, 'status': LinkStatusChoices},
+    ),
+}
+
+
+class DocumentValidator:
+    '''
+    checks a whole YAML document before anything is written: the structure of
+    every section, required keys, choice values and duplicate names
+    every problem is collected so they can all be reported at once, the
+    references to existing objects are checked by ReferenceResolver
+    the sections may be fed in batches, e.g. while streaming
+    '''
+
+    def __init__(self):
+        self.errors = []
+        self.documents = 0
+
+    def start_document(self):
+        '''
+        every document is checked on its own, e.g. names may repeat across documents
+        '''
+        self.documents += 1
+        self.keys = []                    # first level keys, in document order
+        self.count = defaultdict(int)     # items checked so far per section
+        self.seen = defaultdict(set)      # natural keys declared so far per kind
+        self.cable_ends = set()
+
+    def end_document(self):
+        if 'vars' not in self.keys:
+            self.error('document', "the 'vars' key is missing")
+
+    def error(self, where, message):
+        if self.documents > 1:
+            where = f"document {self.documents} {where}"
+        self.errors.append(f"{where}: {message}")
+
+    def check_document(self, result):
+        '''
+        check one fully loaded document
+        '''
+        self.start_document()
+        if not isinstance(result, dict):
+            self.error('document', "the first level of a YAML document must be a mapping")
+            return
+        for key, value in result.items():
+            self.check(key, value)
+        self.end_document()
+
+    def check(self, key, value):
+        '''
+        check one first level key, or the next batch of items of a section
+        '''
+        if key not in self.keys:
+            self.keys.append(key)
+        if key == 'vars':
+            self.check_vars(value)
+        elif key in SECTION_ORDER:
+            # an empty section, e.g. 'cables:' with nothing under it
+            if value is None:
+                return
+            if not isinstance(value, list):
+                self.error(key, "must be a list")
+                return
+            check_item = getattr(self, f'check_{key}')
+            for item in value:
+                where = f"{key}[{self.count[key]}]"
+                self.count[key] += 1
+                check_item(where, item)
+
+    def check_vars(self, yaml_vars):
+        if not isinstance(yaml_vars, dict):
+            self.error('vars', "must be a mapping")
+            return
+        schema = yaml_vars.get('schema_verison')
+        if schema not in SUPPORTED_SCHEMA_VERSIONS:
+            self.error('vars', f"schema_verison {schema} is not supported, the script supports {SUPPORTED_SCHEMA_VERSIONS}")
+        for key in ('debug', 'wipe'):
+            if yaml_vars.get(key) is not None and not isinstance(yaml_vars[key], bool):
+                self.error('vars', f"{key} must be true or false")
+        profile = yaml_vars.get('profile')
+        if profile is not None and not isinstance(profile, bool) and profile not in dict(PROFILE_CHOICES):
+            self.error('vars', f"profile must be true, false or one of {', '.join(dict(PROFILE_CHOICES))}")
+        if yaml_vars.get('globals') is not None and not isinstance(yaml_vars['globals'], dict):
+            self.error('vars', "globals must be a mapping")
+
+    def check_object(self, kind, where, item):
+        '''
+        the checks every object gets, False if it is not a mapping at all
+        '''
+        if not isinstance(item, dict):
+            self.error(where, f"a {kind} must be a mapping")
+            return False
+        for key in REQUIRED_KEYS[kind]:
+            if is_empty(item.get(key)):
+                self.error(where, f"the '{key}' key is required")
+        for key, choices in MAPPERS[kind].choices.items():
+            value = item.get(key)
+            if is_empty(value):
+                continue
+            if isinstance(value, (list, dict)) or (value not in choices and str(value).lower() not in choices):
+                valid = sorted({str(choice) for choice in choices.values()})
+                hint = f", expected one of {', '.join(valid)}" if len(valid) <= 12 else ""
+                self.error(where, f"{value} is not a valid {kind} {key}{hint}")
+        return True
+
+    def declare(self, kind, where, *key):
+        '''
+        the same natural key can only be declared once per document
+        '''
+        key = natural_key(key)
+        # a missing key part is reported as a missing required key
+        if key is None:
+            return
+        if key in self.seen[kind]:
+            self.error(where, f"{kind} {'/'.join(key)} is declared more than once")
+        self.seen[kind].add(key)
+
+    def check_sites(self, where, site):
+        if not self.check_object('site', where, site):
+            return
+        self.declare('site', where, site.get('facility'))
+        self.declare('site name', where, site.get('name'))
+        racks = site.get('racks')
+        if racks is not None and not isinstance(racks, list):
+            self.error(where, "racks must be a list")
+            return
+        for number, rack in enumerate(racks or []):
+            rack_where = f"{where} racks[{number}]"
+            if self.check_object('rack', rack_where, rack):
+                self.declare('rack', rack_where, site.get('facility'), rack.get('name'))
+
+    def check_devices(self, where, device):
+        if not self.check_object('device', where, device):
+            return
+        names = expand_pattern(device.get('name'))
+        for name in names:
+            self.declare('device', where, name)
+        interfaces = device.get('interfaces')
+        if interfaces is not None and not isinstance(interfaces, list):
+            self.error(where, "interfaces must be a list")
+            return
+        for number, interface in enumerate(interfaces or []):
+            interface_where = f"{where} interfaces[{number}]"
+            if self.check_object('interface', interface_where, interface):
+                for interface_name in expand_pattern(interface.get('name')):
+                    for name in names:
+                        self.declare('interface', interface_where, name, interface_name)
+
+    def check_circuits(self, where, circuit):
+        if not self.check_object('circuit', where, circuit):
+            return
+        self.declare('circuit', where, circuit.get('cid'))
+        if circuit.get('a_facility') and circuit.get('provider_net'):
+            self.error(where, "the A side is either an a_facility or a provider_net, not both")
+
+    def check_cables(self, where, cable):
+        if not self.check_object('cable', where, cable):
+            return
+        try:
+            cables = list(expand_cable(cable))
+        except DocumentError as e:
+            self.error(where, str(e))
+            return
+        for cable in cables:
+            self.check_cable_ends(where, cable)
+
+    def check_cable_ends(self, where, cable):
+        end_a = ('interface', cable.get('termination_a_device'), cable.get('termination_a_interface'))
+        end_b = ('interface', cable.get('termination_b_device'), cable.get('termination_b_interface'))
+        cid = cable.get('circuit_id')
+        if is_empty(cid):
+            if is_empty(end_b[1]) or is_empty(end_b[2]):
+                self.error(where, "a cable without a circuit_id needs termination_b_device and termination_b_interface")
+            ends = [end_a, end_b]
+        elif is_empty(end_b[1]):
+            ends = [end_a, ('termination', cid, 'A')]
+        else:
+            ends = [end_a, ('termination', cid, 'A'), end_b, ('termination', cid, 'Z')]
+
+        # an interface or circuit termination takes only one cable
+        for end in ends:
+            key = natural_key(end)
+            if key is None:
+                continue
+            if key in self.cable_ends:
+                self.error(where, f"{end[0]} {'/'.join(key[1:])} is cabled more than once")
+            self.cable_ends.add(key)
+
+
+class BuildGraph:
+    '''
+    the objects of a document as a dependency graph, executed in topological
+    waves where every wave is written with bulk operations per model
+    objects that don't depend on each other (e.g. two sites and their
+    racks) land in the same wave
+    '''
+
+    def __init__(self):
+        self.payloads = {}   # (kind, key) -> whatever the writer of that kind needs
+        self.deps = {}       # (kind, key) -> [(kind, key), ...]
+
+    def __len__(self):
+        return len(self.payloads)
+
+    def add(self, kind, key, payload, *deps):
+        '''
+        add one object, deps are (kind, key) tuples of the objects it needs,
+        those that are not part of the graph are assumed to already exist
+        '''
+        node = (kind, natural_key(key))
+        if node in self.payloads:
+            raise DocumentError(f"{kind} {'/'.join(node[1])} is declared more than once")
+        self.payloads[node] = payload
+        self.deps[node] = [(dep_kind, natural_key(dep_key)) for dep_kind, dep_key in deps]
+        return
+
+    def waves(self):
+        '''
+        return a list of waves, each one a {kind: [payloads]} dict
+        '''
+        levels = {}
+
+        def level(node, path):
+            if node in levels:
+                return levels[node]
+            if node in path:
+                raise DocumentError(f"circular reference through {node[0]} {'/'.join(node[1])}")
+            deps = [dep for dep in self.deps[node] if dep in self.payloads]
+            levels[node] = 1 + max((level(dep, path + (node,)) for dep in deps), default=-1)
+            return levels[node]
+
+        waves = defaultdict(lambda: defaultdict(list))
+        for node, payload in self.payloads.items():
+            waves[level(node, ())][node[0]].append(payload)
+        return [waves[number] for number in sorted(waves)]
+
+
+class ReferenceResolver:
+    '''
+    preloads the natural keys referenced by a YAML document with one
+    `__in` query per model, so lookups are served from memory instead of
+    a `.get()` round trip per row
+    '''
+
+    # kind: (model, natural key lookups, related objects needed to build the key)
+    LOOKUPS = {
+        'site': (Site, ('facility',), ()),
+        'rack': (Rack, ('site__facility', 'name'), ('site',)),
+        'rack_role': (RackRole, ('name',), ()),
+        'device_type': (DeviceType, ('model',), ()),
+        'device_role': (DeviceRole, ('name',), ()),
+        'provider': (Provider, ('name',), ()),
+        'circuit_type': (CircuitType, ('name',), ()),
+        'provider_network': (ProviderNetwork, ('name',), ()),
+        'device': (Device, ('name',), ()),
+        'interface': (Interface, ('device__name', 'name'), ('device',)),
+        'circuit': (Circuit, ('cid',), ()),
+        'termination': (CircuitTermination, ('circuit__cid', 'term_side'), ('circuit',)),
+        'tenant': (Tenant, ('name',), ()),
+    }
+
+    def __init__(self):
+        self.wanted = defaultdict(set)    # keys referenced by the document
+        self.declared = defaultdict(set)  # keys the document itself will create
+        self.cache = defaultdict(dict)    # key -> object, loaded or newly created
+        self.device_types = {}            # declared device key -> its device type key
+        self.templates = {}               # device type pk -> interface names of its templates
+
+    def want(self, kind, *key):
+        key = natural_key(key)
+        if key:
+            self.wanted[kind].add(key)
+
+    def declare(self, kind, *key):
+        key = natural_key(key)
+        if key:
+            self.declared[kind].add(key)
+
+    def scan(self, result):
+        '''
+        collect every natural key referenced or declared in a parsed document,
+        anything that is not shaped as expected is left to DocumentValidator
+        '''
+        yaml_vars = result.get('vars')
+        if isinstance(yaml_vars, dict) and isinstance(yaml_vars.get('globals'), dict):
+            self.want('tenant', yaml_vars['globals'].get('tenant'))
+
+        for site in mappings(result.get('sites')):
+            self.declare('site', site.get('facility'))
+            for rack in mappings(site.get('racks')):
+                self.declare('rack', site.get('facility'), rack.get('name'))
+                self.want('rack_role', rack.get('role'))
+
+        for device in expand_items(mappings(result.get('devices'))):
+            self.declare('device', device.get('name'))
+            device_key = natural_key((device.get('name'),))
+            if device_key:
+                self.device_types[device_key] = natural_key((device.get('device_type'),))
+            self.want('site', device.get('facility'))
+            self.want('device_type', device.get('device_type'))
+            self.want('device_role', device.get('device_role'))
+            self.want('rack', device.get('facility'), device.get('rack'))
+            for interface in expand_items(mappings(device.get('interfaces'))):
+                self.declare('interface', device.get('name'), interface.get('name'))
+                self.want('interface', device.get('name'), interface.get('lag'))
+
+        for circuit in mappings(result.get('circuits')):
+            self.declare('circuit', circuit.get('cid'))
+            self.declare('termination', circuit.get('cid'), 'Z')
+            if circuit.get('a_facility') or circuit.get('provider_net'):
+                self.declare('termination', circuit.get('cid'), 'A')
+            self.want('provider', circuit.get('provider'))
+            self.want('circuit_type', circuit.get('type'))
+            self.want('site', circuit.get('a_facility'))
+            self.want('site', circuit.get('z_facility'))
+            self.want('provider_network', circuit.get('provider_net'))
+
+        for row in mappings(result.get('cables')):
+            try:
+                cables = list(expand_cable(row))
+            except DocumentError:
+                # reported by DocumentValidator
+                continue
+            for cable in cables:
+                for side in ('a', 'b'):
+                    self.want('device', cable.get(f'termination_{side}_device'))
+                    self.want('interface', cable.get(f'termination_{side}_device'), cable.get(f'termination_{side}_interface'))
+                if cable.get('circuit_id'):
+                    self.want('circuit', cable.get('circuit_id'))
+                    self.want('termination', cable.get('circuit_id'), 'A')
+                    if cable.get('termination_b_device'):
+                        self.want('termination', cable.get('circuit_id'), 'Z')
+
+    def load(self):
+        '''
+        fetch every wanted key that is not cached yet, one query per model
+        '''
+        for kind, keys in self.wanted.items():
+            missing = keys - self.declared[kind] - self.cache[kind].keys()
+            if not missing:
+                continue
+            model, lookups, related = self.LOOKUPS[kind]
+            filters = {
+                f'{lookup}__in': {key[i] for key in missing}
+                for i, lookup in enumerate(lookups)
+            }
+            for obj in model.objects.filter(**filters).select_related(*related):
+                key = self._object_key(obj, lookups)
+                # composite keys are over-fetched by the per-column filters
+                if key in missing:
+                    self.cache[kind][key] = obj
+        return
+
+    @staticmethod
+    def _object_key(obj, lookups):
+        key = []
+        for lookup in lookups:
+            value = obj
+            for attr in lookup.split('__'):
+                value = getattr(value, attr)
+            key.append(str(value))
+        return tuple(key)
+
+    def unresolved(self):
+        '''
+        keys that are neither in NetBox nor created by the document
+        '''
+        report = {}
+        for kind, keys in self.wanted.items():
+            missing = keys - self.declared[kind] - self.cache[kind].keys()
+            if kind == 'interface':
+                # interfaces of new devices may come from the device type templates
+                missing = {key for key in missing if not self._from_template(key)}
+            if missing:
+                report[kind] = sorted(missing)
+        return report
+
+    def _from_template(self, key):
+        '''
+        True if an interface key is created by the device type of a new
+        device, or can't be checked because the device type is unresolved
+        (reported on its own), the templates are read with one query
+        '''
+        if (key[0],) not in self.declared['device']:
+            return False
+        device_type = self.cache['device_type'].get(self.device_types.get((key[0],)))
+        if device_type is None:
+            return True
+        if device_type.pk not in self.templates:
+            types = {
+                self.cache['device_type'][type_key].pk
+                for type_key in self.device_types.values()
+                if type_key in self.cache['device_type']
+            }
+            types = {pk for pk in types if pk not in self.templates}
+            for pk in types:
+                self.templates[pk] = set()
+            for device_type_id, name in InterfaceTemplate.objects.filter(device_type_id__in=types).values_list('device_type_id', 'name'):
+                self.templates[device_type_id].add(name)
+        return key[1] in self.templates[device_type.pk]
+
+    def get(self, kind, *key):
+        '''
+        return the object for a natural key, falling back to a single query
+        for objects created outside the document (e.g. template interfaces)
+        '''
+        key = natural_key(key)
+        if key is None:
+            return None
+        try:
+            return self.cache[kind][key]
+        except KeyError:
+            pass
+        model, lookups, related = self.LOOKUPS[kind]
+        obj = model.objects.select_related(*related).get(**dict(zip(lookups, key)))
+        self.cache[kind][key] = obj
+        return obj
+
+    def reset(self, *kinds):
+        '''
+        forget everything known about some kinds, they are re-read on demand
+        '''
+        for kind in kinds:
+            self.wanted.pop(kind, None)
+            self.declared.pop(kind, None)
+            self.cache.pop(kind, None)
+        if 'device' in kinds:
+            self.device_types.clear()
+        return
+
+    def add(self, kind, obj, *key):
+        '''
+        register a newly created object so later rows can reference it
+        '''
+        key = natural_key(key)
+        if key:
+            self.cache[kind][key] = obj
+        return obj
+
+
+class BuildSimulator:
+    '''
+    checks what writing a BuildGraph would do without writing it: the
+    natural keys that are already taken, rack units that are occupied,
+    interface names the device type templates create anyway and cable ends
+    that are already connected
+    the indexes are seeded with one query per model and grow with every
+    simulated object, so several documents can be simulated in a row
+    objects of the sites a document wipes are left out of the indexes
+    '''
+
+    def __init__(self, refs):
+        self.refs = refs
+        self.wiped_sites = set()          # pks of the sites the documents wipe
+        self.wiped_circuits = set()       # pks of the circuits that go with them
+        self.conflicts = []               # messages, in the order they were found
+        self.counts = defaultdict(int)    # model name -> objects that would be created
+        self.taken = defaultdict(set)     # kind -> natural keys that exist or are simulated
+        self.units = defaultdict(set)     # (facility, rack) -> {(face, unit)} occupied
+        self.heights = {}                 # (facility, rack) -> rack height in units
+        self.ports = defaultdict(set)     # device type pk -> interface names of its templates
+        self.components = defaultdict(dict)  # device type pk -> {model name: template count}
+        self.device_types = {}            # new device name -> its device type
+        self.cabled = set()               # cable ends taken, (kind, *natural key)
+
+    def conflict(self, kind, key, message):
+        self.conflicts.append(f"{kind} {'/'.join(map(str, key))}: {message}")
+
+    def simulate(self, graph, wiped=()):
+        '''
+        simulate every object of a graph, wiped are the names of sites the
+        document deletes first
+        '''
+        nodes = defaultdict(list)   # kind -> [(natural key, payload)]
+        for (kind, key), payload in graph.payloads.items():
+            nodes[kind].append((key, payload))
+        # a circular reference would stop the real build too
+        graph.waves()
+        self.seed(nodes, set(wiped))
+
+        for key, data in nodes['site']:
+            self.simulate_site(key, data)
+        for key, (data, facility) in nodes['rack']:
+            self.heights[key] = data.get('u_height') or Rack._meta.get_field('u_height').default
+            self.counts[Rack._meta.verbose_name_plural] += 1
+        for key, data in nodes['device']:
+            self.simulate_device(key, data)
+        for kind in ('lag', 'interface'):
+            for key, (device_name, data) in nodes[kind]:
+                self.simulate_interface(key)
+        for key, data in nodes['circuit']:
+            if key in self.taken['circuit']:
+                self.conflict('circuit', key, "a circuit with this ID already exists")
+            self.taken['circuit'].add(key)
+            self.counts[Circuit._meta.verbose_name_plural] += 1
+        for key, payload in nodes['termination']:
+            self.taken['termination'].add(key)
+            self.counts[CircuitTermination._meta.verbose_name_plural] += 1
+        for key, (end_a, end_b, attributes) in nodes['cable']:
+            self.simulate_cable(end_a, end_b)
+        return
+
+    def seed(self, nodes, wiped):
+        '''
+        read what NetBox already holds for the objects of a graph, one query per model
+        '''
+        sites = [MAPPERS['site'](data, self.refs) for _, data in nodes['site']]
+        existing = Site.objects.exclude(name__in=wiped).filter(
+            Q(facility__in=[site.get('facility') for site in sites]) |
+            Q(name__in=[site.get('name') for site in sites]) |
+            Q(slug__in=[site.get('slug') for site in sites])
+        )
+        for facility, name, slug in existing.values_list('facility', 'name', 'slug'):
+            self.taken['site'].add((str(facility),))
+            self.taken['site name'].add(name)
+            self.taken['site slug'].add(slug)
+
+        if wiped:
+            self.wiped_sites.update(Site.objects.filter(name__in=wiped).values_list('pk', flat=True))
+            self.wiped_circuits.update(Circuit.objects.filter(terminations__site__name__in=wiped).values_list('pk', flat=True))
+
+        names = [key[0] for key, _ in nodes['device']]
+        existing = Device.objects.filter(name__in=names).exclude(site__name__in=wiped)
+        self.taken['device'].update((name,) for name in existing.values_list('name', flat=True))
+
+        cids = [key[0] for key, _ in nodes['circuit']]
+        existing = Circuit.objects.filter(cid__in=cids).exclude(terminations__site__name__in=wiped)
+        self.taken['circuit'].update((cid,) for cid in existing.values_list('cid', flat=True))
+
+        # what the device types of new devices instantiate
+        types = {
+            self.refs.get('device_type', data.get('device_type'))
+            for _, data in nodes['device']
+        } - {None}
+        new_types = [device_type.pk for device_type in types if device_type.pk not in self.components]
+        for device_type_id, name in InterfaceTemplate.objects.filter(device_type_id__in=new_types).values_list('device_type_id', 'name'):
+            self.ports[device_type_id].add(name)
+        for relation in COMPONENT_TEMPLATES:
+            if not hasattr(DeviceType, relation):
+                continue
+            template_model = getattr(DeviceType, relation).rel.related_model
+            component = template_model.component_model._meta.verbose_name_plural
+            counts = template_model.objects.filter(device_type_id__in=new_types).values_list('device_type_id').annotate(count=Count('pk'))
+            for device_type_id, count in counts:
+                self.components[device_type_id][component] = count
+        for pk in new_types:
+            self.components.setdefault(pk, {})
+
+        # rack units taken in the existing racks new devices are mounted in
+        racks = {}
+        for key, data in nodes['device']:
+            rack_key = natural_key((data.get('facility'), data.get('rack')))
+            rack = self.refs.cache['rack'].get(rack_key)
+            if rack is not None and rack_key not in self.heights:
+                racks[rack.pk] = rack_key
+                self.heights[rack_key] = rack.u_height
+        mounted = Device.objects.filter(rack_id__in=racks, position__isnull=False).exclude(site__name__in=wiped)
+        for rack_id, position, face, height, full_depth in mounted.values_list(
+            'rack_id', 'position', 'face', 'device_type__u_height', 'device_type__is_full_depth'
+        ):
+            faces = (DeviceFaceChoices.FACE_FRONT, DeviceFaceChoices.FACE_REAR) if full_depth else (face,)
+            for unit in range(int(position), int(position) + int(height)):
+                for face in faces:
+                    self.units[racks[rack_id]].add((face, unit))
+        return
+
+    def simulate_site(self, key, data):
+        attributes = MAPPERS['site'](data, self.refs)
+        if key in self.taken['site']:
+            self.conflict('site', key, "a site with this facility already exists")
+        for field in ('name', 'slug'):
+            if attributes.get(field) in self.taken[f'site {field}']:
+                self.conflict('site', key, f"the {field} {attributes[field]} is already taken")
+            self.taken[f'site {field}'].add(attributes.get(field))
+        self.taken['site'].add(key)
+        self.counts[Site._meta.verbose_name_plural] += 1
+
+    def simulate_device(self, key, data):
+        if key in self.taken['device']:
+            self.conflict('device', key, "a device with this name already exists")
+        self.taken['device'].add(key)
+        self.counts[Device._meta.verbose_name_plural] += 1
+
+        device_type = self.refs.get('device_type', data.get('device_type'))
+        self.device_types[key[0]] = device_type
+        for component, count in self.components[device_type.pk].items():
+            self.counts[component] += count
+
+        rack_key = natural_key((data.get('facility'), data.get('rack')))
+        position = data.get('position')
+        if rack_key is None or is_empty(position) or not device_type.u_height:
+            return
+        face = MAPPERS['device'].choices['face'].get(str(data.get('face')).lower())
+        if face is None:
+            self.conflict('device', key, "a device with a rack position needs a face")
+            return
+        faces = (DeviceFaceChoices.FACE_FRONT, DeviceFaceChoices.FACE_REAR) if device_type.is_full_depth else (face,)
+        units = range(int(position), int(position) + int(device_type.u_height))
+        if units[0] < 1 or units[-1] > int(self.heights.get(rack_key, 0)):
+            span = f"U{units[0]}" if len(units) == 1 else f"U{units[0]}-U{units[-1]}"
+            self.conflict('device', key, f"{span} does not fit in rack {'/'.join(rack_key)}")
+            return
+        occupied = sorted({unit for unit in units for face in faces if (face, unit) in self.units[rack_key]})
+        if occupied:
+            self.conflict('device', key, f"U{', U'.join(map(str, occupied))} of rack {'/'.join(rack_key)} is already occupied")
+        for unit in units:
+            for face in faces:
+                self.units[rack_key].add((face, unit))
+
+    def simulate_interface(self, key):
+        device_type = self.device_types.get(key[0])
+        self.taken['interface'].add(key)
+        # the interfaces the device type creates are only updated
+        if device_type is None or key[1] not in self.ports[device_type.pk]:
+            self.counts[Interface._meta.verbose_name_plural] += 1
+
+    def simulate_cable(self, end_a, end_b):
+        ends = [natural_key(end) for end in (end_a, end_b)]
+        for end in ends:
+            kind, key = end[0], end[1:]
+            existing = self.refs.cache[kind].get(key)
+            if existing is not None and self.is_wiped(kind, existing):
+                # the cache still holds the object the wipe deletes
+                existing = None
+            if key in self.taken[kind]:
+                pass
+            elif kind == 'interface' and key[0] in self.device_types:
+                device_type = self.device_types[key[0]]
+                if key[1] not in self.ports[device_type.pk]:
+                    self.conflict(kind, key, f"not in the document, nor in the templates of {device_type}")
+            elif existing is None:
+                self.conflict(kind, key, "does not exist")
+            if existing is not None and existing.cable_id:
+                self.conflict(kind, key, "is already connected")
+            elif end in self.cabled:
+                self.conflict(kind, key, "is cabled more than once")
+            self.cabled.add(end)
+        self.counts[Cable._meta.verbose_name_plural] += 1
+
+    def is_wiped(self, kind, obj):
+        '''
+        True if an interface or circuit termination goes with a wiped site
+        '''
+        if kind == 'interface':
+            return obj.device.site_id in self.wiped_sites
+        return obj.circuit_id in self.wiped_circuits
+
+
+def plain(value):
+    '''
+    a model value as YAML can write it, e.g. Decimal('2.00') -> 2
+    '''
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    return value
+
+
+class DocumentExporter:
+    '''
+    writes the sites, racks, devices, interfaces, circuits and cables of
+    some sites as a YAML document in the schema SiteBuilder reads, so they
+    can be edited and applied again (e.g. in reconcile mode)
+    each model is read with a fixed number of queries streamed with
+    .iterator(), children are merged with their parents by walking both
+    in the same order and every item is written as soon as it is complete,
+    so memory does not grow with the number of devices or interfaces
+    '''
+
+    def __init__(self, sites):
+        self.sites = Site.objects.filter(pk__in=[site.pk for site in sites])
+        self.counts = defaultdict(int)    # section -> items written
+        self.skipped = defaultdict(int)   # reason -> objects the schema can't express
+
+    def write(self, stream):
+        tenants = set(self.sites.values_list('tenant__name', flat=True))
+        yaml_vars = {
+            'name': f"Export of {self.sites.count()} sites",
+            'description': "exported from NetBox by yaml-to-netbox.py",
+            'schema_verison': SUPPORTED_SCHEMA_VERSIONS[-1],
+            'debug': False,
+            'wipe': False,
+            # the document has one tenant for everything
+            'globals': {'tenant': tenants.pop() if len(tenants) == 1 else None},
+        }
+        if len(tenants) > 1:
+            self.skipped['tenants, the sites have different ones'] += len(tenants)
+        stream.write("---\n")
+        yaml.safe_dump({'vars': yaml_vars}, stream, sort_keys=False, allow_unicode=True)
+        self.section(stream, 'sites', self.iter_sites())
+        self.section(stream, 'devices', self.iter_devices())
+        self.section(stream, 'circuits', self.iter_circuits())
+        self.section(stream, 'cables', self.iter_cables())
+        return
+
+    def section(self, stream, key, items):
+        '''
+        write one first level list an item at a time
+        '''
+        stream.write(f"\n{key}:")
+        empty = True
+        for item in items:
+            if empty:
+                stream.write("\n")
+                empty = False
+            yaml.safe_dump([item], stream, sort_keys=False, allow_unicode=True)
+            self.counts[key] += 1
+        if empty:
+            stream.write(" []\n")
+
+    def iter_sites(self):
+        racks = groupby(
+            Rack.objects.filter(site__in=self.sites).order_by('site_id', 'name').values_list(
+                'site_id', 'name', 'status', 'type', 'width', 'u_height', 'role__name'
+            ).iterator(chunk_size=BULK_BATCH_SIZE),
+            key=lambda rack: rack[0],
+        )
+        site_racks = next(racks, (None, ()))
+        for site in self.sites.order_by('pk').iterator(chunk_size=BULK_BATCH_SIZE):
+            if not site.facility:
+                self.skipped['sites without a facility'] += 1
+                continue
+            while site_racks[0] is not None and site_racks[0] < site.pk:
+                site_racks = next(racks, (None, ()))
+            item = {
+                'name': site.name,
+                'physical_address': site.physical_address,
+                'slug': site.slug,
+                'facility': site.facility,
+                'status': site.status,
+                'racks': [],
+            }
+            if site_racks[0] == site.pk:
+                item['racks'] = [
+                    {
+                        'name': name,
+                        'status': status,
+                        'type': rack_type or None,
+                        'width': width,
+                        'u_height': plain(u_height),
+                        'role': role,
+                    }
+                    for _, name, status, rack_type, width, u_height, role in site_racks[1]
+                ]
+            yield item
+
+    def iter_devices(self):
+        devices = Device.objects.filter(site__in=self.sites).exclude(site__facility='').exclude(name=None)
+        # interfaces the device types create are left to the templates
+        templates = set(
+            InterfaceTemplate.objects.filter(device_type__instances__in=devices).values_list('device_type_id', 'name').distinct()
+        )
+        interfaces = groupby(
+            Interface.objects.filter(device__in=devices).order_by('device_id', '_name').values_list(
+                'device_id', 'device__device_type_id', 'name', 'type', 'lag__name'
+            ).iterator(chunk_size=BULK_BATCH_SIZE),
+            key=lambda interface: interface[0],
+        )
+        device_interfaces = next(interfaces, (None, ()))
+        for device in devices.select_related(
+            'site', 'rack', 'device_type__manufacturer', 'device_role'
+        ).order_by('pk').iterator(chunk_size=BULK_BATCH_SIZE):
+            while device_interfaces[0] is not None and device_interfaces[0] < device.pk:
+                device_interfaces = next(interfaces, (None, ()))
+            item = {
+                'name': device.name,
+                'facility': device.site.facility,
+                'device_role': device.device_role.name,
+                'manufacturer': device.device_type.manufacturer.name,
+                'device_type': device.device_type.model,
+                'rack': device.rack.name if device.rack else None,
+                'position': plain(device.position),
+                'face': device.face or None,
+                'status': device.status,
+                'interfaces': [],
+            }
+            if device_interfaces[0] == device.pk:
+                item['interfaces'] = [
+                    {'name': name, 'type': interface_type, 'lag': lag}
+                    for _, device_type, name, interface_type, lag in device_interfaces[1]
+                    if (device_type, name) not in templates or lag
+                ]
+            yield item
+
+    def circuits(self):
+        return Circuit.objects.filter(terminations__site__in=self.sites).distinct()
+
+    def iter_circuits(self):
+        terminations = groupby(
+            CircuitTermination.objects.filter(circuit__in=self.circuits()).order_by('circuit_id').values_list(
+                'circuit_id', 'term_side', 'site__facility', 'provider_network__name', 'port_speed'
+            ).iterator(chunk_size=BULK_BATCH_SIZE),
+            key=lambda cterm: cterm[0],
+        )
+        circuit_terms = next(terminations, (None, ()))
+        for circuit in self.circuits().select_related('provider', 'type').order_by('pk').iterator(chunk_size=BULK_BATCH_SIZE):
+            while circuit_terms[0] is not None and circuit_terms[0] < circuit.pk:
+                circuit_terms = next(terminations, (None, ()))
+            sides = {}
+            if circuit_terms[0] == circuit.pk:
+                sides = {side: (facility, network, speed) for _, side, facility, network, speed in circuit_terms[1]}
+            a_facility, provider_net, a_speed = sides.get('A', (None, None, None))
+            z_facility, _, z_speed = sides.get('Z', (None, None, None))
+            if not z_facility:
+                # SiteBuilder always puts the Z side at a site
+                self.skipped['circuits without a Z side at a site'] += 1
+                continue
+            yield {
+                'cid': circuit.cid,
+                'provider': circuit.provider.name,
+                'type': circuit.type.name,
+                'status': circuit.status,
+                'commit_rate': circuit.commit_rate,
+                'port_speed': z_speed or a_speed,
+                'a_facility': a_facility,
+                'z_facility': z_facility,
+                'provider_net': provider_net,
+            }
+
+    def iter_cables(self):
+        '''
+        cables between two interfaces are written as they are read, those
+        on a circuit are held back until both sides of the circuit are
+        known, as one cables row describes both
+        '''
+        interface_type = ContentType.objects.get_for_model(Interface)
+        cterm_type = ContentType.objects.get_for_model(CircuitTermination)
+        cables = Cable.objects.filter(
+            Q(_termination_a_device__site__in=self.sites) |
+            Q(_termination_b_device__site__in=self.sites) |
+            Q(termination_a_type=cterm_type, termination_a_id__in=CircuitTermination.objects.filter(circuit__in=self.circuits()).values('pk')) |
+            Q(termination_b_type=cterm_type, termination_b_id__in=CircuitTermination.objects.filter(circuit__in=self.circuits()).values('pk'))
+        )
+        # the ends of every cable, both merged with the cables by cable id
+        interface_ends = groupby(
+            Interface.objects.filter(cable__in=cables).order_by('cable_id').values_list(
+                'cable_id', 'pk', 'device__name', 'name'
+            ).iterator(chunk_size=BULK_BATCH_SIZE),
+            key=lambda end: end[0],
+        )
+        cterm_ends = groupby(
+            CircuitTermination.objects.filter(cable__in=cables).order_by('cable_id').values_list(
+                'cable_id', 'pk', 'circuit__cid', 'term_side'
+            ).iterator(chunk_size=BULK_BATCH_SIZE),
+            key=lambda end: end[0],
+        )
+        next_interfaces = next(interface_ends, (None, ()))
+        next_cterms = next(cterm_ends, (None, ()))
+        on_circuits = {}   # cid -> cables row so far
+
+        for cable in cables.order_by('pk').values_list(
+            'pk', 'type', 'length', 'status', 'termination_a_type_id', 'termination_a_id'
+        ).iterator(chunk_size=BULK_BATCH_SIZE):
+            pk, cable_type, length, status, a_type, a_id = cable
+            ends = {}   # (content type, pk) -> ('interface', device, name) or ('termination', cid, side)
+            while next_interfaces[0] is not None and next_interfaces[0] < pk:
+                next_interfaces = next(interface_ends, (None, ()))
+            if next_interfaces[0] == pk:
+                ends.update({(interface_type.pk, end[1]): ('interface', end[2], end[3]) for end in next_interfaces[1]})
+            while next_cterms[0] is not None and next_cterms[0] < pk:
+                next_cterms = next(cterm_ends, (None, ()))
+            if next_cterms[0] == pk:
+                ends.update({(cterm_type.pk, end[1]): ('termination', end[2], end[3]) for end in next_cterms[1]})
+            if len(ends) != 2:
+                # front/rear ports, power, console, ...
+                self.skipped['cables to other kinds of ports'] += 1
+                continue
+
+            end_a = ends.pop((a_type, a_id), None) or ends.popitem()[1]
+            end_b = ends.popitem()[1]
+            if end_a[0] == 'termination':
+                end_a, end_b = end_b, end_a
+            row = {'type': cable_type or None, 'length': plain(length), 'status': status}
+            if end_a[0] == 'termination':
+                self.skipped['cables between two circuits'] += 1
+                continue
+            if end_b[0] == 'interface':
+                yield dict(
+                    row,
+                    termination_a_device=end_a[1], termination_a_interface=end_a[2],
+                    termination_b_device=end_b[1], termination_b_interface=end_b[2],
+                    circuit_id=None,
+                )
+                continue
+            # the A side of the circuit is termination_a, the Z side termination_b
+            cid, side = end_b[1], end_b[2]
+            circuit_row = on_circuits.setdefault(cid, dict(row, circuit_id=cid))
+            prefix = 'termination_a' if side == 'A' else 'termination_b'
+            circuit_row[f'{prefix}_device'] = end_a[1]
+            circuit_row[f'{prefix}_interface'] = end_a[2]
+
+        for cid, row in on_circuits.items():
+            if not row.get('termination_a_device'):
+                self.skipped['circuits cabled on the Z side only'] += 1
+                continue
+            yield {
+                'type': row['type'],
+                'length': row['length'],
+                'status': row['status'],
+                'termination_a_device': row['termination_a_device'],
+                'termination_a_interface': row['termination_a_interface'],
+                'termination_b_device': row.get('termination_b_device'),
+                'termination_b_interface': row.get('termination_b_interface'),
+                'circuit_id': cid,
+            }
+
+
+
+
+def default_yaml():
+    '''
+    the example document shown in the form, empty if it can't be read
+    '''
+    try:
+        with open(YAML_PATH+DEFAULT_YAML_FILE, "r") as f:
+            return f.read()
+    except OSError:
+        return ""
 
 
 class SiteBuilder(Script):
@@ -79,83 +1682,80 @@ class SiteBuilder(Script):
         required=False,
     )
 
+    # the form calls default_yaml() when it is rendered, not when NetBox
+    # imports this module to list the scripts
     yamltext = TextVar(
         description="edit or paste in YAML text",
-        default=open(YAML_PATH+DEFAULT_YAML_FILE, "r").read()
+        default=default_yaml,
     )
 
+    mode = ChoiceVar(
+        choices=MODE_CHOICES,
+        default='create',
+        description="create everything (fails on duplicates), reconcile NetBox with the document, simulate a create without writing anything, or export sites",
+    )
 
+    export_sites = MultiObjectVar(
+        model=Site,
+        required=False,
+        description="the sites to write as a YAML document in export mode",
+    )
 
-    def run(self, data, commit):
+    stream = BooleanVar(
+        description="stream very large documents section by section (keys must be in order: vars, sites, devices, circuits, cables)",
+        required=False,
+    )
 
-        def remove_empty_from_dict(d):
-            '''
-            used to scrub the attributes passed to create objects
-            in this case any empty value are removed from the dict
-            '''
-            if type(d) is dict:
-                return dict((k, remove_empty_from_dict(v)) for k, v in d.items() if v and remove_empty_from_dict(v))
-            elif type(d) is list:
-                return [remove_empty_from_dict(v) for v in d if v and remove_empty_from_dict(v)]
-            else:
-                return d
+    chunk_size = IntegerVar(
+        description="commit in chunks of about this many objects, whole sites at a time, and resume from a checkpoint when re-run (0 = one transaction)",
+        required=False,
+        default=0,
+        min_value=0,
+    )
 
+    verbose = BooleanVar(
+        description="log every object, instead of a few examples and a summary table",
+        required=False,
+    )
 
-        def create_site(data):
-            '''
-            custom logic for creating new sites
-            '''
-            
-            #do a quick slug validation
-            if data['slug'] == None:
-                slug=slugify(data['name'])
-            else:
-                slug=slugify(data['slug'])
+    workers = IntegerVar(
+        description="build the chunks of different sites in this many parallel processes, cross-site circuits and cables follow serially (0 = no workers)",
+        required=False,
+        default=0,
+        min_value=0,
+    )
+
+    profile = ChoiceVar(
+        choices=PROFILE_CHOICES,
+        default='off',
+        description="report time, SQL queries, rows written and peak memory per phase (slows the run down)",
+    )
 
-            attributes = {
-                'name':data['name'],
-                'slug':slug,
-                'facility':data['facility'],
-                'status':data['status'],
-                'physical_address': data['physical_address'],
-                'tenant':TENANT,
-            }
-            kargs = remove_empty_from_dict(attributes)
 
-            site = Site(**kargs)
 
-            site.save()
-            self.log_success(f"Created new site: {site}")
-            return site
+    def run(self, data, commit):
+
+        # natural key lookups shared by all create_* helpers
+        refs = ReferenceResolver()
 
+        # per object messages are summarized unless verbose is checked
+        log = ScriptLog(self, verbose=data.get('verbose'))
 
-        def create_rack(data, site):
+        # per phase timings, switched on by the profile variable or the document vars
+        profiler = ScriptProfiler(self, data.get('profile'))
+
+        def site_attributes(data):
             '''
-            custom logic for creating new racks
+            model attributes of a site described in the YAML document
             '''
+            return MAPPERS['site'](data, refs)
 
-            attributes = {
-                'name':data['name'],
-                'status':data['status'],
-                'type':data['type'],
-                'width':data['width'],
-                'u_height':data['u_height'],
-                'site':site,
-                'role':RackRole.objects.get(name=data['role']),
-                'tenant' : TENANT,
-            }
-            kargs = remove_empty_from_dict(attributes)
-
-            rack = Rack(**kargs)
-            try:
-                with transaction.atomic():
-                    rack.full_clean()
-                    rack.save()
-            except Exception as e:
-                self.log_failure(f'Unable to create {rack}:{e}')
 
-            self.log_success(f"Created rack: {rack}")
-            return rack
+        def rack_attributes(data, site):
+            '''
+            model attributes of a rack described in the YAML document
+            '''
+            return MAPPERS['rack'](data, refs, site=site)
 
 
         def create_location(data, site):
@@ -163,333 +1763,445 @@ class SiteBuilder(Script):
             FUTURE USE: Not implemented fully yet
             custom logic for creating new locations
             '''
-
-            attributes = {
-                'name':data['name'],
-                'slug':slugify(data['name']),
-                'site':site,
-                'role':RackRole.objects.get(name=data['role']),
-                'tenant':TENANT,
-            }
-            kargs = remove_empty_from_dict(attributes)
-
-            location = Location(**kargs)
+            location = Location(**MAPPERS['location'](data, refs, site=site))
 
             location.save()
-            self.log_success(f"Created location: {location} in {site}")
+            log.record('created', location, f"Created location: {location} in {site}")
             return location
 
 
-        def create_device(data):
+        def device_attributes(data):
             '''
-            custom logic for creating new devices
+            model attributes of a device described in the YAML document
             '''
+            return MAPPERS['device'](data, refs)
 
-            site = Site.objects.get(facility=data['facility'])
 
-            attributes = {
-                'name':data['name'],
-                'site':site,
-                'device_type':DeviceType.objects.get(model=data['device_type']),
-                'status':data['status'],
-                'device_role':DeviceRole.objects.get(name=data['device_role']),
-                'rack':Rack.objects.get(site=site, name=data['rack']),
-                'position':data['position'],
-                'face':data['face'],
-                'tenant':TENANT,
-            }
-            kargs = remove_empty_from_dict(attributes)
+        def interface_attributes(data, device, lag=None):
+            '''
+            model attributes of an interface described in the YAML document,
+            lag is always set so an interface taken out of its LAG leaves it
+            '''
+            attributes = MAPPERS['interface'](data, refs, device=device, description=f"{device} {data['name']}")
+            attributes['lag'] = lag
+            return attributes
 
-            device = Device(**kargs)
 
-            device.save()
-            self.log_success(f"Created new device: {device} in {data['rack']}")
-            return device
+        def build_interface(data, device, lag=None):
+            '''
+            custom logic for building (not saving) new interfaces
+            '''
+            return Interface(**interface_attributes(data, device, lag))
 
 
-        def create_interface(data, device):
+        def circuit_attributes(data):
             '''
-            custom logic for creating new interfaces
+            model attributes of a circuit described in the YAML document
             '''
+            return MAPPERS['circuit'](data, refs)
 
-            # lookup the LAG id, if the 'lag' key is not empty
-            if data['lag'] != None :
-                lag = Interface.objects.get(device=device, name=data['lag'])
-                self.log_info(f"LAG was found: {lag}")
-            else:
-                lag = None
 
+        def termination_attributes(data, side):
+            '''
+            model attributes of one side of a circuit, None if that side is not used
+            the Z side is always a site, the A side is a site (point-to-point)
+            or a provider network (MPLS/Multi-point)
+            '''
             attributes = {
-                'name':data['name'],
-                'device':device,
-                'type':data['type'],
-                'lag':lag,
-                'description':f"{device} {data['name']}",
+                'term_side':side,
+                'site':None,
+                'provider_network':None,
+                'port_speed':data.get('port_speed'),
+                'description':'',
             }
-            kargs = remove_empty_from_dict(attributes)
+            if side == 'Z':
+                attributes['site'] = refs.get('site', data['z_facility'])
+            elif data.get('a_facility') != None:
+                attributes['site'] = refs.get('site', data['a_facility'])
+            elif data.get('provider_net') != None:
+                attributes['provider_network'] = refs.get('provider_network', data['provider_net'])
+            else:
+                return None
+            return attributes
 
-            interface = Interface(**kargs)
 
-            interface.save()
-            self.log_success(f"-- created new interface: {interface} for {device}")
-            return interface
+        def cable_specs(data):
+            '''
+            the physical cables described by one cables row, yields
+            (A end natural key, B end natural key, cable attributes)
+            '''
+
+            end_a = ('interface', data['termination_a_device'], data['termination_a_interface'])
 
+            #no circuit ID specified, so use direct <DeviceA>--<DeviceB> connection
+            if data.get('circuit_id') == None:
+                end_b = ('interface', data.get('termination_b_device'), data.get('termination_b_interface'))
+                yield end_a, end_b, MAPPERS['cable'](data, refs)
+                return
 
-        def create_circuit(data):
+            # the cables to circuit terminations are planned and have no tenant
+            attributes = MAPPERS['cable'](data, refs, status=LinkStatusChoices.STATUS_PLANNED, tenant=None)
+
+            #use <DeviceA>--(circuitA-circuitZ)--<DeviceB> logic
+            if data.get('termination_b_device') != None:
+                yield end_a, ('termination', data['circuit_id'], 'A'), attributes
+                end_b = ('interface', data['termination_b_device'], data.get('termination_b_interface'))
+                yield end_b, ('termination', data['circuit_id'], 'Z'), attributes
+
+            #assumes <DeviceA>--(circuitA-circuitZ)--<ProviderNetwork> logic
+            else:
+                yield end_a, ('termination', data['circuit_id'], 'A'), attributes
+
+
+        def cable_end_label(termination):
             '''
-            custom logic for creating new circuits
+            text used to build the cable label for one end
             '''
+            if isinstance(termination, CircuitTermination):
+                return f"{termination} CKTID={termination.circuit}"
+            return f"{termination.device} {termination}"
 
-            #build the circuit object
-            circuit = Circuit(
-                cid=data['cid'],
-                provider=Provider.objects.get(name=data['provider']),
-                type=CircuitType.objects.get(name=data['type']),
-                status=data['status'],
-                commit_rate=data['commit_rate'],
-                tenant=TENANT,
-            )
-            circuit.save()
-
-            #get the Z side for circuit termination, this must be a site
-            z_facility = Site.objects.get(facility=data['z_facility'])
-
-            #build the Z-side circuit termination
-            z_cterm = CircuitTermination(
-                circuit=Circuit.objects.get(cid=data['cid']),
-                term_side='Z',
-                site=z_facility,
-                #provider_network='',
-                port_speed=data['port_speed'],
-                description=''
+
+        def build_cable(termination_a, termination_b, attributes):
+            '''
+            custom logic for building (not saving) one cable between two resolved ends
+            '''
+            label = f"{cable_end_label(termination_a)} to {cable_end_label(termination_b)}"
+            if DEBUG: self.log_debug(f"Building cable: {label}")
+
+            return Cable(
+                termination_a=termination_a,
+                termination_b=termination_b,
+                label=label,
+                **attributes
             )
-            z_cterm.save()
-
-            #get the A side for circuit termination, this can be a site or provider network
-            if data['a_facility'] != None :
-                a_facility = Site.objects.get(facility=data['a_facility'])
-
-                # build the A-side circuit termination (this is a point-to-point)
-                a_cterm = CircuitTermination(
-                    circuit=Circuit.objects.get(cid=data['cid']),
-                    term_side='A',
-                    site=a_facility,
-                    port_speed=data['port_speed'],
-                    description=''
-                )
-                a_cterm.save()                
-            
-            if data['provider_net'] != None :
-                provider_net = ProviderNetwork.objects.get(name=data['provider_net'])
-
-                #build the A-side circuit termination for MPLS/Multi-point (provider is always the A side)
-                a_cterm = CircuitTermination(
-                    circuit=Circuit.objects.get(cid=data['cid']),
-                    term_side='A',
-                    provider_network=provider_net,
-                    port_speed=data['port_speed'],
-                    description=''
-                    
-                )
-                a_cterm.save()
 
-            self.log_success(f"Created circuit {circuit}")
-            return 
 
+        #the write_ functions create every object of one kind in a BuildGraph wave,
+        #bulk_create skips save() and its signals, so they record the changelog themselves
 
-        def create_cable(data):
+        def write_sites(payloads):
             '''
-            custom logic for creating new cables
+            bulk create sites, payloads are site data
             '''
+            for chunk in batched(payloads, BULK_BATCH_SIZE):
+                sites = Site.objects.bulk_create([Site(**site_attributes(data)) for data in chunk])
+                record_changes(self, sites)
+                for site in sites:
+                    refs.add('site', site, site.facility)
+                    log.record('created', site, f"Created new site: {site}")
+            return
 
-            #no circuit ID specified, so use direct <DeviceA>--<DeviceB> connection
-            if data['circuit_id'] == None:
-                #setup the A side
-                termination_a_type = ContentType.objects.get(app_label='dcim', model='interface')
-                #get the device and interface
-                device_a = Device.objects.get(name=data['termination_a_device'])
-                interface_a = Interface.objects.get(device=device_a, name=data['termination_a_interface'])
-                label=f"{device_a} {interface_a}"
-                
-                #setup the B side
-                termination_b_type = ContentType.objects.get(app_label='dcim', model='interface')
-                #get the device and interface
-                device_b = Device.objects.get(name=data['termination_b_device'])
-                interface_b = Interface.objects.get(device=device_b, name=data['termination_b_interface'])
-                label+=f" to {device_b} {interface_b}"
-
-                #build the <DeviceA>--<DeviceB> cable object
-                cable = Cable(
-                    termination_a_type=termination_a_type,
-                    termination_a=interface_a,
-                    termination_b_type=termination_b_type,
-                    termination_b=interface_b,
-                    type=data['type'],
-                    length=data['length'],
-                    label=label,
-                    #status=LinkStatusChoices.STATUS_PLANNED,
-                    status=data['status'],
-                    tenant=TENANT,
-                )
-                cable.save()
-                self.log_success(f"Created cable: {cable}")
-                return
 
+        def write_racks(payloads):
+            '''
+            bulk create racks, payloads are (rack data, site facility)
+            '''
+            racks = []
+            for data, facility in payloads:
+                rack = Rack(**rack_attributes(data, refs.get('site', facility)))
+                # full_clean() would cost queries per rack, the field checks don't
+                try:
+                    rack.clean_fields()
+                except Exception as e:
+                    log.failed(rack, f'Unable to create {rack}:{e}')
+                    continue
+                racks.append(rack)
+
+            for chunk in batched(racks, BULK_BATCH_SIZE):
+                chunk = Rack.objects.bulk_create(chunk)
+                record_changes(self, chunk)
+                for rack in chunk:
+                    refs.add('rack', rack, rack.site.facility, rack.name)
+                    log.record('created', rack, f"Created rack: {rack}")
+            return
 
 
-            #use <DeviceA>--(circuitA-circuitZ)--<DeviceB> logic
-            elif data['termination_b_device'] != None:  
-                #setup the A side                
-                termination_a_type = ContentType.objects.get(app_label='dcim', model='interface')
-                #get the device and interface
-                device_a = Device.objects.get(name=data['termination_a_device'])
-                interface_a = Interface.objects.get(device=device_a, name=data['termination_a_interface'])
-                label = f"{device_a} {interface_a}"
-                
-                #setup the B side (A side of circuit)
-                termination_b_type = ContentType.objects.get(app_label='circuits', model='circuittermination')
-                #derive termination from the circuit ID and A-side
-                circuit_id = Circuit.objects.get(cid=data['circuit_id'])
-                interface_b = CircuitTermination.objects.get(circuit=circuit_id, term_side='A')
-                label += f" to {interface_b} CKTID={circuit_id}"
-
-                #build the <DeviceA>--(circuitA..... cable object
-                cable = Cable(
-                    termination_a_type=termination_a_type,
-                    termination_a=interface_a,
-                    termination_b_type=termination_b_type,
-                    termination_b=interface_b,
-                    type=data['type'],
-                    length=data['length'],
-                    label=label,
-                    status=LinkStatusChoices.STATUS_PLANNED
-                )
-                cable.save()
-                self.log_success(f"Created cable: {cable}")
-
-                #setup the B side                
-                termination_a_type = ContentType.objects.get(app_label='dcim', model='interface')
-                #get the device and interface
-                device_a = Device.objects.get(name=data['termination_b_device'])
-                interface_a = Interface.objects.get(device=device_a, name=data['termination_b_interface'])
-                label = f"{device_a} {interface_a}"
-                
-                #setup the B side (Z side of circuit)
-                termination_b_type = ContentType.objects.get(app_label='circuits', model='circuittermination')
-                #derive termination from the circuit ID and A-side
-                circuit_id = Circuit.objects.get(cid=data['circuit_id'])
-                interface_b = CircuitTermination.objects.get(circuit=circuit_id, term_side='Z')
-                label += f" to {interface_b} CKTID={circuit_id}"
-
-                #build the <DeviceB>--(circuitZ..... cable object
-                cable = Cable(
-                    termination_a_type=termination_a_type,
-                    termination_a=interface_a,
-                    termination_b_type=termination_b_type,
-                    termination_b=interface_b,
-                    type=data['type'],
-                    length=data['length'],
-                    label=label,
-                    status=LinkStatusChoices.STATUS_PLANNED
-                )
-                cable.save()
-                self.log_success(f"Created cable: {cable}")
+        def write_devices(payloads):
+            '''
+            bulk create devices and their template components, payloads are device data
+            '''
+            for chunk in batched(payloads, BULK_BATCH_SIZE):
+                devices = []
+                for data in chunk:
+                    device = Device(**device_attributes(data))
+                    if device.rack:
+                        device.location = device.rack.location
+                    devices.append(device)
+
+                devices = Device.objects.bulk_create(devices)
+                record_changes(self, devices)
+                instantiate_components(devices)
+                for device in devices:
+                    refs.add('device', device, device.name)
+                    log.record('created', device, f"Created new device: {device} in {device.rack}")
+            return
 
-            #assumes <DeviceA>--(circuitA-circuitZ)--<ProviderNetwork> logic
-            else:  
-                #setup the A side                
-                termination_a_type = ContentType.objects.get(app_label='dcim', model='interface')
-                #get the device and interface
-                device_a = Device.objects.get(name=data['termination_a_device'])
-                interface_a = Interface.objects.get(device=device_a, name=data['termination_a_interface'])
-                label = f"{device_a} {interface_a}"
-                
-                #setup the B side (A side of circuit)
-                termination_b_type = ContentType.objects.get(app_label='circuits', model='circuittermination')
-                #derive termination from the circuit ID and A-side
-                circuit_id = Circuit.objects.get(cid=data['circuit_id'])
-                interface_b = CircuitTermination.objects.get(circuit=circuit_id, term_side='A')
-                label += f" to {interface_b} CKTID={circuit_id}"
-                if DEBUG: self.log_debug(f"Building cable: {label}")
-
-                #build the <DeviceA>--(circuitA..... cable object
-                cable = Cable(
-                    termination_a_type=termination_a_type,
-                    termination_a=interface_a,
-                    termination_b_type=termination_b_type,
-                    termination_b=interface_b,
-                    type=data['type'],
-                    length=data['length'],
-                    label=label,
-                    status=LinkStatusChoices.STATUS_PLANNED
-                )
-                cable.save()
-                self.log_success(f"Created cable: {cable}")
 
+        def write_interfaces(payloads):
+            '''
+            bulk create interfaces, payloads are (device name, interface data)
+            LAG parents are written by an earlier wave than their members, so
+            the LAG is always found in memory
+            interfaces the device type templates created already (e.g. the
+            LAG members of an export) are updated with their type and LAG instead
+            '''
 
+            # LAGs not in the document come from the device type templates
+            for name, data in payloads:
+                refs.want('interface', name, data.get('lag'))
+            refs.load()
+
+            # the interfaces of the payloads that were instantiated from templates, one query each
+            devices = {name: refs.get('device', name) for name, _ in payloads}
+            templates = set(InterfaceTemplate.objects.filter(
+                device_type_id__in={device.device_type_id for device in devices.values()}
+            ).values_list('device_type_id', 'name'))
+            names = {str(data['name']) for name, data in payloads if (devices[name].device_type_id, str(data['name'])) in templates}
+            instantiated = {}
+            if names:
+                instantiated = {
+                    (interface.device_id, interface.name): interface
+                    for interface in Interface.objects.filter(device__in=list(devices.values()), name__in=names)
+                }
+
+            updated = []
+            counts = defaultdict(int)
+            for chunk in batched(payloads, BULK_BATCH_SIZE):
+                interfaces = []
+                for name, data in chunk:
+                    device = devices[name]
+                    lag = refs.get('interface', name, data.get('lag'))
+                    interface = instantiated.get((device.pk, str(data['name'])))
+                    if interface is None:
+                        interfaces.append(build_interface(data, device, lag))
+                        continue
+                    interface.device = device
+                    interface.lag = lag
+                    interface.type = interface_attributes(data, device).get('type', interface.type)
+                    refs.add('interface', interface, name, interface.name)
+                    updated.append(interface)
+                interfaces = Interface.objects.bulk_create(interfaces)
+                record_changes(self, interfaces)
+                for interface in interfaces:
+                    refs.add('interface', interface, interface.device.name, interface.name)
+                    counts[interface.device] += 1
+
+            for device, count in counts.items():
+                log.record_many('created', Interface, count, f"-- created {count} interfaces for {device}")
+            if updated:
+                Interface.objects.bulk_update(updated, ['type', 'lag'], batch_size=BULK_BATCH_SIZE)
+                record_changes(self, updated, ObjectChangeActionChoices.ACTION_UPDATE)
+                log.record_many('updated', Interface, len(updated), f"Set the type and LAG of {len(updated)} interfaces from the device type templates")
+            return
+
+
+        def write_circuits(payloads):
+            '''
+            bulk create circuits, payloads are circuit data
+            '''
+            count = 0
+            for chunk in batched(payloads, BULK_BATCH_SIZE):
+                circuits = Circuit.objects.bulk_create([Circuit(**circuit_attributes(data)) for data in chunk])
+                record_changes(self, circuits)
+                for circuit in circuits:
+                    refs.add('circuit', circuit, circuit.cid)
+                    count += 1
+            log.record_many('created', Circuit, count, f"Created {count} circuits")
+            return
 
-        #the purpose of all of these sb_ functions is to iterate through the object lists
 
-        def sb_sites(sites):
+        def write_terminations(payloads):
             '''
-            part of SiteBuilder to create any site, if any exist in the YAML document            
+            bulk create circuit terminations, payloads are (circuit data, side),
+            then point each circuit at its new terminations the way the
+            CircuitTermination post_save signal would
             '''
+            circuits = {}
+            count = 0
+            for chunk in batched(payloads, BULK_BATCH_SIZE):
+                cterms = []
+                for data, side in chunk:
+                    circuit = refs.get('circuit', data['cid'])
+                    cterms.append(CircuitTermination(circuit=circuit, **termination_attributes(data, side)))
+                cterms = CircuitTermination.objects.bulk_create(cterms)
+                record_changes(self, cterms)
+                for cterm in cterms:
+                    refs.add('termination', cterm, cterm.circuit.cid, cterm.term_side)
+                    setattr(cterm.circuit, f'termination_{cterm.term_side.lower()}', cterm)
+                    circuits[cterm.circuit.pk] = cterm.circuit
+                    count += 1
+
+            Circuit.objects.bulk_update(list(circuits.values()), ['termination_a', 'termination_z'], batch_size=BULK_BATCH_SIZE)
+            log.record_many('created', CircuitTermination, count, f"Created {count} circuit terminations")
+            return
+
 
-            print('\nProcessing Sites...')
+        def write_cables(payloads):
+            '''
+            create cables, payloads are cable_specs() tuples
+            all (device, interface) and (cid, term_side) ends are resolved up
+            front with one query per termination type, including interfaces
+            instantiated from device type templates
+            Cable.save() traces the cable paths, so cables can't be bulk
+            created; they are saved in batches inside one transaction, with a
+            savepoint per row so a bad row is reported without losing the batch
+            '''
+            for end_a, end_b, attributes in payloads:
+                refs.want(*end_a)
+                refs.want(*end_b)
+            refs.load()
+
+            used = set()
+            failed = 0
+            with transaction.atomic():
+                for chunk in batched(payloads, BULK_BATCH_SIZE):
+                    for end_a, end_b, attributes in chunk:
+                        ends = '/'.join(map(str, end_a[1:])) + ' to ' + '/'.join(map(str, end_b[1:]))
+                        try:
+                            termination_a = refs.get(*end_a)
+                            termination_b = refs.get(*end_b)
+                        except ObjectDoesNotExist as e:
+                            log.failed(Cable, f"Unable to create cable {ends}: {e}")
+                            failed += 1
+                            continue
+
+                        # cheap checks first, they save a rolled back savepoint
+                        busy = [
+                            t for t in (termination_a, termination_b)
+                            if t.cable_id or (type(t), t.pk) in used
+                        ]
+                        if busy:
+                            log.failed(Cable, f"Unable to create cable {ends}: {', '.join(map(cable_end_label, busy))} already connected")
+                            failed += 1
+                            continue
+
+                        cable = build_cable(termination_a, termination_b, attributes)
+                        try:
+                            with transaction.atomic():
+                                cable.save()
+                        except Exception as e:
+                            log.failed(Cable, f"Unable to create cable {ends}: {e}")
+                            failed += 1
+                            continue
+                        used.add((type(termination_a), termination_a.pk))
+                        used.add((type(termination_b), termination_b.pk))
+                        log.record('created', cable, f"Created cable: {cable}")
+
+            if failed:
+                self.log_warning(f"{failed} of {len(payloads)} cables could not be created")
+            return
+
+
+        # the writer for each kind in DEPENDENCIES
+        WRITERS = {
+            'site': write_sites,
+            'rack': write_racks,
+            'device': write_devices,
+            'lag': write_interfaces,
+            'interface': write_interfaces,
+            'circuit': write_circuits,
+            'termination': write_terminations,
+            'cable': write_cables,
+        }
+
+
+        def run_graph(graph):
+            '''
+            write every object in a BuildGraph, one wave after the other
+            '''
+            for number, wave in enumerate(graph.waves(), 1):
+                if DEBUG: self.log_debug(f"Wave {number}: {', '.join(f'{len(wave[kind])} {kind}' for kind in wave)}")
+                with log.phase(f"{log.current} wave {number}".strip()):
+                    for kind in DEPENDENCIES:
+                        if kind in wave:
+                            with profiler.phase(kind):
+                                WRITERS[kind](wave[kind])
+            return
+
+
+        #the purpose of all of these sb_ functions is to add the objects of
+        #each first level key to a BuildGraph
+
+        def sb_sites(graph, sites):
+            '''
+            part of SiteBuilder to build any site, if any exist in the YAML document            
+            '''
             for site in sites:
-                #print(site.items())
-                #print(site['name'])
-                new_site = create_site(site)
-                if "racks" in site:
+                graph.add('site', (site['facility'],), site)
+                if site.get('racks'):
                     for rack in site['racks']:
-                        #print(rack.items())
-                        #print('...', rack['name'])
-                        create_rack(rack, new_site)
+                        graph.add('rack', (site['facility'], rack['name']), (rack, site['facility']), ('site', (site['facility'],)))
                 else:
-                    self.log_info(f"{new_site} has no racks")
+                    log.detail(f"{site['name']} has no racks")
             return
 
-        def sb_devices(devices):
+        def sb_interfaces(graph, device_name, interfaces):
             '''
-            part of SiteBuilder to create any devices, if any exist in the YAML document            
+            part of SiteBuilder to build the interfaces of one device, any
+            interface referenced as a 'lag' by a sibling is a LAG parent, even
+            if its type was not declared as 'lag'
             '''
-
-            print('\nProcessing Devices...')
-            for device in devices:
-                #print(device.items())
-                #print(device['name'])
-                new_device = create_device(device)
-                if "interfaces" in device:
-                    for interface in device['interfaces']:
-                        #print(interface.items())
-                        print('...', interface['name'])
-                        create_interface(interface, new_device)
+            lag_names = {str(interface['lag']) for interface in interfaces if interface.get('lag')}
+            for interface in expand_items(interfaces):
+                key = (device_name, interface['name'])
+                if interface.get('type') == 'lag' or str(interface['name']) in lag_names:
+                    graph.add('lag', key, (device_name, interface), ('device', (device_name,)))
                 else:
-                    print('(no interfaces)')
+                    graph.add('interface', key, (device_name, interface), ('device', (device_name,)), ('lag', (device_name, interface.get('lag'))))
             return
 
-        def sb_circuits(circuits):
+        def sb_devices(graph, devices):
             '''
-            part of SiteBuilder to create any circuits, if any exist in the YAML document            
+            part of SiteBuilder to build any devices, if any exist in the YAML document            
             '''
+            for device in expand_items(devices):
+                graph.add('device', (device['name'],), device, ('site', (device['facility'],)), ('rack', (device['facility'], device.get('rack'))))
+                if device.get('interfaces'):
+                    sb_interfaces(graph, device['name'], device['interfaces'])
+                else:
+                    log.detail(f"{device['name']} has no interfaces")
+            return
 
-            print('\nProcessing circuits...')
+        def sb_circuits(graph, circuits):
+            '''
+            part of SiteBuilder to build any circuits, if any exist in the YAML document            
+            '''
             for circuit in circuits:
-                #print(circuit.items())
-                #print(circuit['name'])
-                create_circuit(circuit)
+                graph.add('circuit', (circuit['cid'],), circuit)
+                sb_terminations(graph, circuit)
             return
 
-        def sb_cables(cables):
+        def sb_terminations(graph, circuit, sides=('A', 'Z')):
             '''
-            part of SiteBuilder to create any cables, if any exist in the YAML document            
+            part of SiteBuilder to build the terminations of one circuit, the
+            Z side is always a site, the A side a site or a provider network
             '''
+            for side in sides:
+                if side == 'A' and circuit.get('a_facility') == None and circuit.get('provider_net') == None:
+                    continue
+                graph.add(
+                    'termination', (circuit['cid'], side), (circuit, side),
+                    ('circuit', (circuit['cid'],)),
+                    ('site', (circuit.get(f'{side.lower()}_facility'),)),
+                )
+            return
 
-            print('\nProcessing Cables...')
-            for cable in cables:
-                #print(cable.items())
-                #print(cable['name'])
-                create_cable(cable)
+        def sb_cables(graph, cables):
+            '''
+            part of SiteBuilder to build any cables, if any exist in the YAML document            
+            '''
+            for cable in expand_cables(cables):
+                for end_a, end_b, attributes in cable_specs(cable):
+                    deps = []
+                    for end in (end_a, end_b):
+                        if end[0] == 'interface':
+                            # template interfaces exist once their device does
+                            deps += [('device', end[1:2]), ('lag', end[1:]), ('interface', end[1:])]
+                        else:
+                            deps.append(('termination', end[1:]))
+                    # cables have no natural key, they are numbered instead
+                    graph.add('cable', ('#', len(graph)), (end_a, end_b, attributes), *deps)
             return
 
 
@@ -500,62 +2212,21 @@ class SiteBuilder(Script):
             '''
             # alternate means to lookup up sites
             # sites = Site.objects.filter(name__contains=name_contains).all()
-            
-            self.log_warning(f"{len(sites)} sites will be wiped/erased, if they already exist")
-            
-            for site in sites:
-                
-                #query for the site name
-                s = Site.objects.filter(name=site['name'])
-
-                if s.count() == 1:
-                    #if site exists, the expectation is exactly one site is found
-                    # thus, reference first item in list returned from the site query above
-                    siteid = s.first()
-                    self.log_debug(f"found existing {siteid} and it will be deleted")
-                else:
-                    self.log_debug(f"No sites to delete, skipping this")
-                    return
-
-                for device in Device.objects.filter(site=siteid):
-                    self.log_debug(f"Deleted {device.delete()}")
-                
-                for racks in Rack.objects.filter(site=siteid):
-                    self.log_debug(f"Deleted {racks.delete()}")
-
-                for racks in Rack.objects.filter(site=siteid):
-                    self.log_debug(f"Deleted {racks.delete()}")
-
-                ct = CircuitTermination.objects.filter(site=siteid, term_side='A').all()
-                for ct_item in ct:
-                    circuit_to_delete = Circuit.objects.get(cid=ct_item.circuit)
-                    self.log_debug(f"Deleted {circuit_to_delete.delete()}")
-
-                self.log_warning(f"{siteid.delete()} was deleted!")
 
+            # sites that don't exist yet are simply not found
+            existing = Site.objects.filter(name__in=[site['name'] for site in sites])
+            # wipe_sites() logs its own counts, they are only added to the summary
+            with log.phase('wipe'), profiler.phase('wipe'):
+                log.merge({(log.current, label, 'deleted'): count for label, count in wipe_sites(self, existing).items()})
             return
 
 
-        def SiteBuilder(yaml_doc):
+        def process_vars(yaml_vars):
             '''
-            loads and parses through YAML data first level keys
+            deal with the first level *vars* key, returns the wipe flag
+            the schema version and the tenant were checked by the validation
             '''
 
-            result =  yaml.safe_load(yaml_doc)
-
-            # The yaml document is loaded as one big nested python dictonary
-            #  the first level keys are referenced as result['key'] 
-            
-            # these are some variables that might be useful in the future
-            yaml_vars = result['vars']
-
-            # version support pre-checks
-            schema = yaml_vars['schema_verison']
-            if schema in SUPPORTED_SCHEMA_VERSIONS:
-                self.log_success(f"Passed version check: script supports {SUPPORTED_SCHEMA_VERSIONS} and yaml schema is ver {schema}")
-            else:
-                self.log_failure(f"Sorry, yaml schema verison {schema} not supported")
-
             #deal with the *debug* key
             global DEBUG #make this global
             try:
@@ -570,14 +2241,16 @@ class SiteBuilder(Script):
                 self.log_debug(f"yaml_vars: {yaml_vars}")
                 # for dev/testing during debugging
 
+            #deal with the *profile* key, True/table or json
+            profiler.configure(yaml_vars.get('profile'))
+
             #deal with the *tenant* key
             global TENANT #make this global
-            try:                
-                TENANT = Tenant.objects.get(name=yaml_vars['globals']['tenant'])                
+            TENANT = refs.get('tenant', (yaml_vars.get('globals') or {}).get('tenant'))
+            if TENANT:
                 self.log_info(f"Certain objects will be created under tenant: {TENANT}")
-            except:
+            else:
                 self.log_info(f"No Tenant was specified")
-                TENANT = None
 
             #deal with the *wipe* key
             try:
@@ -587,26 +2260,789 @@ class SiteBuilder(Script):
             except:
                 WIPE = False
 
+            return WIPE
+
+
+        def check_document(validator):
+            '''
+            report every problem found by a DocumentValidator together with
+            every reference that can't be resolved, True if there are none
+            '''
+            with profiler.phase('lookup'):
+                refs.load()
+            errors = validator.errors + [
+                f"{kind}: not in NetBox nor in the document: {', '.join('/'.join(key) for key in keys)}"
+                for kind, keys in refs.unresolved().items()
+            ]
+            for error in errors[:MAX_REPORTED_ERRORS]:
+                self.log_failure(error)
+            if len(errors) > MAX_REPORTED_ERRORS:
+                self.log_failure(f"... and {len(errors) - MAX_REPORTED_ERRORS} more errors")
+            if errors:
+                self.log_failure(f"The YAML document was rejected with {len(errors)} errors, nothing was written")
+            else:
+                self.log_success(f"Passed document validation")
+            return not errors
+
+
+        def validate_documents(documents):
+            '''
+            check every loaded document before the first one is written
+            '''
+            validator = DocumentValidator()
+            for result in documents:
+                problems = apply_templates(result) if isinstance(result, dict) else []
+                validator.check_document(result)
+                for where, message in problems:
+                    validator.error(where, message)
+                if isinstance(result, dict):
+                    refs.scan(result)
+            return check_document(validator)
+
+
+        def validate_stream(yaml_doc):
+            '''
+            check a streamed upload with a first pass over the parser events,
+            nothing but the natural keys is kept in memory
+            '''
+            validator = DocumentValidator()
+            for sections in iter_yaml_documents(yaml_doc):
+                validator.start_document()
+                last = -1
+                compiled = None
+                for key, value in sections:
+                    if key == 'templates':
+                        compiled, problems = compile_templates(value)
+                        for where, message in problems:
+                            validator.error(where, message)
+                        continue
+
+                    # rendered in batches of rows, after the plain sections they may point at
+                    if key == 'rollout':
+                        if compiled is None:
+                            validator.error(key, "the 'templates' key must come before 'rollout' when streaming")
+                            continue
+                        if not isinstance(value, list):
+                            validator.error(key, "must be a list of parameter rows")
+                            continue
+                        last = len(SECTION_ORDER)
+                        for start in range(0, len(value), BULK_BATCH_SIZE):
+                            rendered, problems = render_rollout(compiled, value[start:start + BULK_BATCH_SIZE], start)
+                            for where, message in problems:
+                                validator.error(where, message)
+                            for section in SECTION_ORDER:
+                                validator.check(section, rendered.get(section))
+                            refs.scan(rendered)
+                        continue
+
+                    # lists are handed over lazily, anything else is already loaded
+                    if key not in SECTION_ORDER or not hasattr(value, '__next__'):
+                        validator.check(key, value)
+                        if isinstance(value, (dict, list)):
+                            refs.scan({key: value})
+                        continue
+
+                    # sections can't be reordered without loading them in memory
+                    if 'vars' not in validator.keys:
+                        validator.error(key, "the 'vars' key must come first when streaming")
+                    elif SECTION_ORDER.index(key) < last:
+                        validator.error(key, f"streamed sections must follow the order {', '.join(SECTION_ORDER)}, rollout")
+                    last = max(last, SECTION_ORDER.index(key))
+
+                    for batch in batched(value, BULK_BATCH_SIZE):
+                        validator.check(key, batch)
+                        refs.scan({key: batch})
+                validator.end_document()
+            return check_document(validator)
+
+
+        def check_references():
+            '''
+            report every reference that can't be resolved, True if there are none
+            '''
+            unresolved = refs.unresolved()
+            for kind, keys in unresolved.items():
+                self.log_failure(f"Unresolved {kind} references: {', '.join('/'.join(key) for key in keys)}")
+            return not unresolved
+
+
+        def run_section(key, items):
+            '''
+            build the items of one first level key on their own
+            '''
+            graph = BuildGraph()
+            STAGES[key](graph, items)
+            run_graph(graph)
+            return
+
+
+        def build_document(result):
+            '''
+            build everything in one fully loaded YAML document
+            '''
+
+            # The yaml document is loaded as one big nested python dictonary
+            #  the first level keys are referenced as result['key'] 
+            WIPE = process_vars(result['vars'])
+
             if WIPE:
                 # for dev/testing during debugging
-                WipeSite(result['sites'])
+                WipeSite(result.get('sites') or [])
+
+                # the references were loaded by the validation, some of them may be gone now
+                refs.reset('site', 'rack', 'device', 'interface', 'circuit', 'termination')
+                refs.scan(result)
+                refs.load()
+                if not check_references():
+                    raise DocumentError(f"the wipe deleted objects the document references, import aborted")
+
+            # compile every key that exists in the YAML document into one graph,
+            # so e.g. circuits are written in the same wave as racks
+            graph = BuildGraph()
+            for key in SECTION_ORDER:
+                if key in result:
+                    STAGES[key](graph, result[key])
+            run_graph(graph)
+            return
+
+
+        def diff_fields(obj, attributes):
+            '''
+            apply the attributes to an existing object, returns the changed field names
+            '''
+            changed = []
+            for field, value in attributes.items():
+                current = getattr(obj, field)
+                # YAML may hand us numbers for text fields, e.g. facility: 101
+                if isinstance(current, str) and value is not None and not isinstance(value, str):
+                    value = str(value)
+                if current != value:
+                    setattr(obj, field, value)
+                    changed.append(field)
+            return changed
+
+
+        def reconcile_document(result):
+            '''
+            compare the document with the objects already in NetBox by natural
+            key, then apply only the creates, updates and deletes that are needed
+            the scope is every site in the document, plus the devices and
+            circuits it names, objects are only deleted for the sections the
+            document has (see stale_keys)
+            '''
+
+            WIPE = process_vars(result['vars'])
+            if WIPE:
+                self.log_warning(f"wipe is ignored when reconciling")
+
+            sites = result.get('sites') or []
+            # pattern items are expanded as they are compared, only their natural keys are kept
+            device_names = {str(data['name']) for data in expand_items(result.get('devices') or [])}
+            circuits = result.get('circuits') or []
+
+            # load everything in scope with one query per model
+            existing_sites = {
+                site.facility: site
+                for site in Site.objects.filter(facility__in=[str(site['facility']) for site in sites])
+            }
+            existing_racks = {
+                (rack.site.facility, rack.name): rack
+                for rack in Rack.objects.filter(site__in=existing_sites.values()).select_related('site')
+            }
+            existing_devices = {
+                device.name: device
+                for device in Device.objects.filter(
+                    Q(site__in=existing_sites.values()) | Q(name__in=device_names)
+                ).select_related('site', 'device_type')
+            }
+            existing_interfaces = {
+                (interface.device.name, interface.name): interface
+                for interface in Interface.objects.filter(device__in=existing_devices.values()).select_related('device')
+            }
+            existing_circuits = {
+                circuit.cid: circuit
+                for circuit in Circuit.objects.filter(
+                    Q(cid__in=[circuit['cid'] for circuit in circuits]) | Q(terminations__site__in=existing_sites.values())
+                ).distinct()
+            }
+            existing_terms = {
+                (cterm.circuit.cid, cterm.term_side): cterm
+                for cterm in CircuitTermination.objects.filter(circuit__in=existing_circuits.values()).select_related('circuit')
+            }
+
+            # cables are matched by the natural keys of both ends
+            end_keys = {}
+            interface_type = ContentType.objects.get_for_model(Interface)
+            cterm_type = ContentType.objects.get_for_model(CircuitTermination)
+            for key, interface in existing_interfaces.items():
+                end_keys[(interface_type.pk, interface.pk)] = ('interface',) + key
+            for key, cterm in existing_terms.items():
+                end_keys[(cterm_type.pk, cterm.pk)] = ('termination',) + key
+            existing_cables = {}
+            for cable in Cable.objects.filter(
+                Q(_termination_a_device__in=existing_devices.values()) | Q(_termination_b_device__in=existing_devices.values())
+            ):
+                end_a = end_keys.get((cable.termination_a_type_id, cable.termination_a_id))
+                end_b = end_keys.get((cable.termination_b_type_id, cable.termination_b_id))
+                # leave cables to front/rear ports and other objects alone
+                if end_a and end_b:
+                    existing_cables[frozenset((end_a, end_b))] = cable
+
+            # existing objects are served to the create_* helpers from memory
+            for facility, site in existing_sites.items():
+                refs.add('site', site, facility)
+            for key, rack in existing_racks.items():
+                refs.add('rack', rack, *key)
+            for name, device in existing_devices.items():
+                refs.add('device', device, name)
+            for key, interface in existing_interfaces.items():
+                refs.add('interface', interface, *key)
+            for cid, circuit in existing_circuits.items():
+                refs.add('circuit', circuit, cid)
+            for key, cterm in existing_terms.items():
+                refs.add('termination', cterm, *key)
+
+            # the plan is built and applied one section at a time, as later
+            # sections may point at objects created by earlier ones
+            totals = defaultdict(int)
+            deletes = defaultdict(list)   # model -> objects, removed at the end
+
+            def plan_update(updates, obj, attributes):
+                changed = diff_fields(obj, attributes)
+                if changed:
+                    updates[type(obj)].setdefault(obj, set()).update(changed)
+
+            def apply_updates(updates):
+                for model, changes in updates.items():
+                    for obj, fields in changes.items():
+                        log.record('updated', obj, f"Plan: update {model._meta.verbose_name} {obj}: {', '.join(sorted(fields))}")
+                    fields = sorted(set().union(*changes.values()))
+                    model.objects.bulk_update(list(changes), fields, batch_size=BULK_BATCH_SIZE)
+                    record_changes(self, changes, ObjectChangeActionChoices.ACTION_UPDATE)
+                    self.log_success(f"Updated {len(changes)} {model._meta.verbose_name_plural} ({', '.join(fields)})")
+                    totals['updated'] += len(changes)
+
+            def apply_deletes(*models):
+                # children before parents
+                for model in models:
+                    objs = deletes.pop(model, [])
+                    for obj in objs:
+                        log.record('deleted', obj, f"Plan: delete {model._meta.verbose_name} {obj}")
+                    if objs:
+                        model.objects.filter(pk__in=[obj.pk for obj in objs]).delete()
+                        self.log_warning(f"Deleted {len(objs)} {model._meta.verbose_name_plural}")
+                        totals['deleted'] += len(objs)
+
+            def plan_creates(model, count):
+                if count:
+                    self.log_info(f"Plan: create {count} {model}(s)")
+                    totals['created'] += count
+
+            # sites and racks
+            updates = defaultdict(dict)
+            new_sites = []
+            new_racks = []     # (data, site) on existing sites
+            rack_keys = set()
+            for data in sites:
+                site = existing_sites.get(str(data['facility']))
+                if site is None:
+                    new_sites.append(data)
+                    continue
+                plan_update(updates, site, site_attributes(data))
+                for rack_data in data.get('racks') or []:
+                    key = (site.facility, str(rack_data['name']))
+                    rack_keys.add(key)
+                    rack = existing_racks.get(key)
+                    if rack is None:
+                        new_racks.append((rack_data, site))
+                    else:
+                        plan_update(updates, rack, rack_attributes(rack_data, site))
+
+            plan_creates('site', len(new_sites))
+            plan_creates('rack', len(new_racks) + sum(len(data.get('racks') or []) for data in new_sites))
+            apply_updates(updates)
+            graph = BuildGraph()
+            sb_sites(graph, new_sites)
+            for data, site in new_racks:
+                graph.add('rack', (site.facility, data['name']), (data, site.facility))
+            run_graph(graph)
+
+            # devices and interfaces
+            updates = defaultdict(dict)
+            new_devices = []
+            new_interfaces = defaultdict(list)   # device name -> data, on existing devices
+            late_lags = []        # existing members of LAGs that are new
+            interface_keys = set()
+            listed = set()        # devices that list their interfaces
+            for data in expand_items(result.get('devices') or []):
+                device = existing_devices.get(str(data['name']))
+                if device is None:
+                    new_devices.append(data)
+                    continue
+                if data.get('interfaces'):
+                    listed.add(device.name)
+                plan_update(updates, device, device_attributes(data))
+                for interface_data in expand_items(data.get('interfaces') or []):
+                    key = (device.name, str(interface_data['name']))
+                    interface_keys.add(key)
+                    interface = existing_interfaces.get(key)
+                    if interface is None:
+                        new_interfaces[device.name].append(interface_data)
+                        continue
+                    attributes = interface_attributes(interface_data, device)
+                    if interface_data.get('lag'):
+                        lag = existing_interfaces.get((device.name, str(interface_data['lag'])))
+                        if lag is None:
+                            # set once the LAG is created, not cleared before
+                            late_lags.append((interface, interface_data['lag']))
+                            del attributes['lag']
+                        else:
+                            attributes['lag'] = lag
+                    plan_update(updates, interface, attributes)
+
+            # interfaces missing from the document are removed only from devices
+            # that list their interfaces, and never if they come from the device type
+            template_names = defaultdict(set)
+            for template in InterfaceTemplate.objects.filter(
+                device_type__in={device.device_type for device in existing_devices.values()}
+            ):
+                template_names[template.device_type_id].add(template.name)
+            deletes[Interface] = [
+                interface for key, interface in existing_interfaces.items()
+                if key[0] in listed and key not in interface_keys
+                and interface.name not in template_names[interface.device.device_type_id]
+            ]
+
+            plan_creates('device', len(new_devices))
+            plan_creates('interface', sum(map(len, new_interfaces.values())) + sum(1 for data in new_devices for _ in expand_items(data.get('interfaces') or [])))
+            apply_updates(updates)
+            graph = BuildGraph()
+            sb_devices(graph, new_devices)
+            for name, interfaces in new_interfaces.items():
+                sb_interfaces(graph, name, interfaces)
+            run_graph(graph)
+            if late_lags:
+                for interface, lag in late_lags:
+                    interface.lag = refs.get('interface', interface.device.name, lag)
+                Interface.objects.bulk_update([interface for interface, lag in late_lags], ['lag'])
+                record_changes(self, [interface for interface, lag in late_lags], ObjectChangeActionChoices.ACTION_UPDATE)
+                self.log_success(f"Updated the LAG of {len(late_lags)} interfaces")
+                totals['updated'] += len(late_lags)
+
+            # circuits and their terminations
+            updates = defaultdict(dict)
+            new_circuits = []
+            new_terms = []     # (data, circuit, side) on existing circuits
+            cids = set()
+            for data in circuits:
+                cids.add(str(data['cid']))
+                circuit = existing_circuits.get(str(data['cid']))
+                if circuit is None:
+                    new_circuits.append(data)
+                    continue
+                plan_update(updates, circuit, circuit_attributes(data))
+                for side in ('A', 'Z'):
+                    attributes = termination_attributes(data, side)
+                    cterm = existing_terms.get((circuit.cid, side))
+                    if attributes is None:
+                        if cterm is not None:
+                            deletes[CircuitTermination].append(cterm)
+                    elif cterm is None:
+                        new_terms.append((data, circuit, side))
+                    else:
+                        plan_update(updates, cterm, attributes)
+
+            plan_creates('circuit', len(new_circuits))
+            plan_creates('circuit termination', len(new_terms))
+            apply_updates(updates)
+            graph = BuildGraph()
+            sb_circuits(graph, new_circuits)
+            for data, circuit, side in new_terms:
+                sb_terminations(graph, data, (side,))
+            run_graph(graph)
+
+            # cables, stale ones are removed first to free their interfaces
+            updates = defaultdict(dict)
+            new_cables = []
+            cable_keys = set()
+            for data in expand_cables(result.get('cables') or []):
+                for end_a, end_b, attributes in cable_specs(data):
+                    key = frozenset((
+                        end_a[:1] + tuple(str(k) for k in end_a[1:]),
+                        end_b[:1] + tuple(str(k) for k in end_b[1:]),
+                    ))
+                    cable_keys.add(key)
+                    cable = existing_cables.get(key)
+                    if cable is None:
+                        new_cables.append((end_a, end_b, attributes))
+                    else:
+                        plan_update(updates, cable, {k: v for k, v in attributes.items() if k != 'tenant'})
+
+            # only the sections in the document are compared, see stale_keys
+            existing = {
+                'rack': existing_racks,
+                'device': [name for name, device in existing_devices.items() if device.site.facility in existing_sites],
+                'circuit': existing_circuits,
+                'cable': existing_cables,
+            }
+            stale = stale_keys(result, existing, {'rack': rack_keys, 'device': device_names, 'circuit': cids, 'cable': cable_keys})
+            deletes[Rack] = [existing_racks[key] for key in stale['rack']]
+            deletes[Device] = [existing_devices[name] for name in stale.get('device', ())]
+            deletes[Circuit] = [existing_circuits[cid] for cid in stale.get('circuit', ())]
+            deletes[Cable] = [existing_cables[key] for key in stale.get('cable', ())]
+
+            plan_creates('cable', len(new_cables))
+            apply_deletes(Cable)
+            # the ends of deleted cables are free again, re-read them
+            refs.reset('interface', 'termination')
+            apply_updates(updates)
+            if new_cables:
+                write_cables(new_cables)
+
+            # whatever the document no longer describes
+            apply_deletes(Interface, Device, Rack, CircuitTermination, Circuit)
+
+            if totals:
+                self.log_success(f"Reconciled: {totals['created']} created, {totals['updated']} updated, {totals['deleted']} deleted")
+            else:
+                self.log_success(f"Nothing to do, NetBox already matches the document")
+            return
+
 
+        def simulate_document(simulator, result):
+            '''
+            what building one document would create and where it would
+            conflict with NetBox, nothing is written (the wipe included)
+            '''
+            WIPE = process_vars(result['vars'])
+            wiped = [site['name'] for site in result.get('sites') or []] if WIPE else []
+            if wiped:
+                self.log_warning(f"The wipe of {len(wiped)} sites is simulated, their objects are left out of the checks")
+
+            graph = BuildGraph()
+            for key in SECTION_ORDER:
+                if key in result:
+                    STAGES[key](graph, result[key])
+            simulator.simulate(graph, wiped)
+            return
 
 
-            # using if statements to only process the keys that exist in the YAML document
-            if "sites" in result:
-                sb_sites(result['sites'])
+        def report_simulation(simulator):
+            '''
+            log the would-be creation counts and every conflict found
+            '''
+            for model, count in simulator.counts.items():
+                log.record_many('simulated', model, count, f"Would create {count} {model}")
+            conflicts = simulator.conflicts
+            for conflict in conflicts[:MAX_REPORTED_ERRORS]:
+                log.failed('conflict', conflict)
+            if len(conflicts) > MAX_REPORTED_ERRORS:
+                self.log_failure(f"... and {len(conflicts) - MAX_REPORTED_ERRORS} more conflicts")
+            if conflicts:
+                self.log_failure(f"The simulation found {len(conflicts)} conflicts, nothing was written")
+            else:
+                self.log_success(f"The simulation found no conflicts, nothing was written")
+            return
 
-            if "devices" in result:
-                sb_devices(result['devices'])
 
-            if "circuits" in result:
-                sb_circuits(result['circuits'])
+        def export_document(sites):
+            '''
+            write some sites as a YAML document to EXPORT_PATH, it is also
+            returned as the script output when it is small enough
+            '''
+            exporter = DocumentExporter(sites)
+            path = os.path.join(EXPORT_PATH, f"sites-{time.strftime('%Y%m%d-%H%M%S')}.yaml")
+            try:
+                os.makedirs(EXPORT_PATH, exist_ok=True)
+                with open(path + ".tmp", "w") as f:
+                    exporter.write(f)
+                os.replace(path + ".tmp", path)
+            except OSError as e:
+                self.log_warning(f"Unable to write {path}: {e}, the document is only in the output")
+                path = None
+                exporter = DocumentExporter(sites)
+                with io.StringIO() as f:
+                    exporter.write(f)
+                    output = f.getvalue()
+
+            for key, count in exporter.counts.items():
+                log.record_many('exported', key, count, f"Exported {count} {key}")
+            for reason, count in exporter.skipped.items():
+                self.log_warning(f"Left out {count} {reason}, the YAML schema can't describe them")
+            if path is None:
+                return output
+            self.log_success(f"Exported the sites to {path}")
+            if os.path.getsize(path) > EXPORT_OUTPUT_LIMIT:
+                self.log_info(f"The document is too large for the script output, it is only in {path}")
+                return None
+            with open(path) as f:
+                return f.read()
+
+
+        def build_chunk(chunk, WIPE):
+            '''
+            build one chunk of a partitioned document, see build_chunked()
+            '''
+            if WIPE and chunk['sites']:
+                WipeSite(chunk['sites'])
+
+            # earlier chunks are committed, so only this chunk's keys are kept
+            refs.reset('site', 'rack', 'device', 'interface', 'circuit', 'termination')
+            refs.scan(chunk)
+            refs.load()
+            if not check_references():
+                raise DocumentError(f"unresolved references in chunk, import aborted")
+
+            graph = BuildGraph()
+            for key in SECTION_ORDER:
+                STAGES[key](graph, chunk[key])
+            run_graph(graph)
+            return
 
-            # note: cables should be processed last    
-            if "cables" in result:
-                sb_cables(result['cables'])
 
+        def build_chunked(result, digest, number):
+            '''
+            build a loaded document in chunks of whole sites, each one committed
+            in a transaction of its own and recorded in a checkpoint file, so a
+            re-run of the same document skips the chunks already done
+            with workers the site chunks are built in parallel processes, the
+            circuits and cables that span sites are always built last
+            '''
+            WIPE = process_vars(result['vars'])
+
+            partitions, cross = partition_by_site(result)
+            chunks = []
+            facilities, chunk, size = [], {key: [] for key in SECTION_ORDER}, 0
+            for facility, partition in partitions.items():
+                facilities.append(f"{number}:{facility}")
+                for key in SECTION_ORDER:
+                    chunk[key] += partition[key]
+                size += count_objects(partition)
+                if size >= (data['chunk_size'] or 0):
+                    chunks.append((facilities, chunk))
+                    facilities, chunk, size = [], {key: [] for key in SECTION_ORDER}, 0
+            if facilities:
+                chunks.append((facilities, chunk))
+            if cross['circuits'] or cross['cables']:
+                chunks.append(([f"{number}:cross-site"], cross))
+
+            completed = load_checkpoint(digest)
+            pending = []
+            for done, (keys, chunk) in enumerate(chunks, 1):
+                if completed.issuperset(keys):
+                    self.log_info(f"Skipping chunk {done}/{len(chunks)} ({', '.join(keys)}), completed by an earlier run")
+                else:
+                    pending.append((done, keys, chunk))
+
+            def build_chunk_in_worker(task):
+                '''
+                build_chunk() in a worker process, returns the log entries and
+                counts it made so they can be merged into the Script output
+                '''
+                done, chunk = task
+                start = len(self.log)
+                before = dict(log.counts)
+                measured = profiler.snapshot()
+                ok = True
+                try:
+                    with transaction.atomic(), log.phase(f"chunk {done}"):
+                        build_chunk(chunk, WIPE)
+                except Exception as e:
+                    log.failed('chunk', f"{e}")
+                    ok = False
+                counts = {key: count - before.get(key, 0) for key, count in log.counts.items()}
+                return self.log[start:], counts, profiler.since(measured), ok
+
+            # sites don't depend on each other, the cross-site chunk depends on them all
+            parallel = [task for task in pending if task[1] != [f"{number}:cross-site"]]
+            if (data['workers'] or 0) > 1 and len(parallel) > 1:
+                self.log_info(f"Building {len(parallel)} chunks in {min(data['workers'], len(parallel))} worker processes")
+                outcomes = run_in_processes(build_chunk_in_worker, [(done, chunk) for done, _, chunk in parallel], data['workers'])
+                failed = 0
+                for (done, keys, chunk), (result, error) in zip(parallel, outcomes):
+                    if result:
+                        entries, counts, stats, ok = result
+                        self.log.extend(entries)
+                        log.merge(counts)
+                        profiler.merge(stats)
+                    else:
+                        self.log_failure(error)
+                        ok = False
+                    if ok:
+                        completed.update(keys)
+                        self.log_success(f"Committed chunk {done}/{len(chunks)} ({', '.join(keys)})")
+                    else:
+                        self.log_failure(f"Chunk {done}/{len(chunks)} ({', '.join(keys)}) failed")
+                        failed += 1
+                save_checkpoint(digest, completed)
+                if failed:
+                    self.log_warning(f"The other chunks are committed, run the same document again to resume")
+                    raise DocumentError(f"{failed} chunks failed, the cross-site objects were not built")
+                pending = [task for task in pending if task not in parallel]
+            elif data['workers']:
+                reason = "one worker is the same as none" if data['workers'] == 1 else f"{len(parallel)} site chunks"
+                self.log_info(f"Workers ignored ({reason}), building the chunks serially")
+
+            for done, keys, chunk in pending:
+                try:
+                    with log.phase(f"chunk {done}"):
+                        run_in_own_transaction(build_chunk, chunk, WIPE)
+                except Exception as e:
+                    self.log_failure(f"Chunk {done}/{len(chunks)} ({', '.join(keys)}) failed: {e}")
+                    self.log_warning(f"The chunks before it are committed, run the same document again to resume")
+                    raise DocumentError(f"chunked import stopped at chunk {done}/{len(chunks)}")
+                completed.update(keys)
+                save_checkpoint(digest, completed)
+                self.log_success(f"Committed chunk {done}/{len(chunks)} ({', '.join(keys)})")
+            return
+
+
+        def build_rollout(compiled, rows, WIPE):
+            '''
+            build streamed rollout rows, the objects rendered from a batch of
+            rows are written together as one graph
+            '''
+            for start in range(0, len(rows), BULK_BATCH_SIZE):
+                rendered = render_rollout(compiled, rows[start:start + BULK_BATCH_SIZE], start)[0]
+                if WIPE:
+                    WipeSite(rendered.get('sites') or [])
+                refs.scan(rendered)
+                refs.load()
+                if not check_references():
+                    raise DocumentError(f"unresolved references in rollout, import aborted")
+                graph = BuildGraph()
+                for key in SECTION_ORDER:
+                    if key in rendered:
+                        STAGES[key](graph, rendered[key])
+                run_graph(graph)
+                refs.reset('device', 'interface', 'circuit', 'termination')
+            return
+
+
+        def build_stream(sections):
+            '''
+            build one YAML document fed section by section from parser events,
+            so memory depends on BULK_BATCH_SIZE rather than on document size
+            the stream was checked by validate_stream() beforehand
+            '''
+            WIPE = False
+            compiled = {}
+            for key, value in sections:
+                if key == 'vars':
+                    WIPE = process_vars(value)
+                    continue
+                if key == 'templates':
+                    compiled = compile_templates(value)[0]
+                    continue
+                if key == 'rollout':
+                    build_rollout(compiled, value, WIPE)
+                    continue
+                if key not in SECTION_ORDER or value is None:
+                    continue
+
+                for batch in batched(value, BULK_BATCH_SIZE):
+                    if key == 'sites' and WIPE:
+                        WipeSite(batch)
+                    refs.scan({key: batch})
+                    refs.load()
+                    if not check_references():
+                        # earlier batches are already written, so roll everything back
+                        raise DocumentError(f"unresolved references in {key}, import aborted")
+                    with log.phase(key):
+                        run_section(key, batch)
+                    # objects built by this batch are re-read if a later batch needs them
+                    refs.reset('device', 'interface', 'circuit', 'termination')
+            return
+
+
+        def SiteBuilder(yaml_doc):
+            '''
+            loads and parses through YAML data first level keys,
+            every document of a multi-document (---) stream is built on its own
+            '''
+            if data['mode'] == 'simulate':
+                if data['stream'] or data['chunk_size'] or data['workers']:
+                    self.log_warning(f"documents are simulated whole, stream, chunk size and workers are ignored")
+                documents = [result for result in yaml.load_all(yaml_doc, Loader=YamlLoader) if result]
+                with profiler.phase('validate'):
+                    valid = validate_documents(documents)
+                if valid:
+                    # one simulator for all documents, later ones see what earlier ones create
+                    simulator = BuildSimulator(refs)
+                    with log.phase('simulate'), profiler.phase('simulate'):
+                        for result in documents:
+                            simulate_document(simulator, result)
+                        report_simulation(simulator)
+            elif data['mode'] == 'reconcile':
+                if data['stream'] or data['chunk_size'] or data['workers']:
+                    self.log_warning(f"documents are reconciled whole in one transaction, stream, chunk size and workers are ignored")
+                documents = [result for result in yaml.load_all(yaml_doc, Loader=YamlLoader) if result]
+                with profiler.phase('validate'):
+                    valid = validate_documents(documents)
+                if valid:
+                    for result in documents:
+                        with log.phase('reconcile'), profiler.phase('reconcile'):
+                            reconcile_document(result)
+            elif data['stream']:
+                if data['chunk_size'] or data['workers']:
+                    self.log_warning(f"streamed documents are built in one transaction, chunk size and workers are ignored")
+                with profiler.phase('validate'):
+                    valid = validate_stream(yaml_doc)
+                if not valid:
+                    return
+                # only the keys of the objects built by the document itself
+                # are needed again, and those are re-read batch by batch
+                refs.reset('device', 'interface', 'circuit', 'termination')
+                yaml_doc.seek(0)
+                for sections in iter_yaml_documents(yaml_doc):
+                    build_stream(sections)
+            elif (data['chunk_size'] or (data['workers'] or 0) > 1) and commit:
+                digest = document_digest(yaml_doc)
+                documents = [result for result in yaml.load_all(yaml_doc, Loader=YamlLoader) if result]
+                with profiler.phase('validate'):
+                    valid = validate_documents(documents)
+                if valid:
+                    for number, result in enumerate(documents):
+                        build_chunked(result, digest, number)
+            else:
+                if (data['chunk_size'] or data['workers']) and not commit:
+                    self.log_warning(f"chunks and workers need commit to be checked, using one transaction")
+                elif data['workers']:
+                    self.log_info(f"Workers ignored (one worker is the same as none), using one transaction")
+                documents = [result for result in yaml.load_all(yaml_doc, Loader=YamlLoader) if result]
+                with profiler.phase('validate'):
+                    valid = validate_documents(documents)
+                if valid:
+                    for result in documents:
+                        with log.phase('build'):
+                            build_document(result)
+            return
+
+
+        # first level keys handled by the sb_ functions, in processing order
+        STAGES = {
+            'sites': sb_sites,
+            'devices': sb_devices,
+            'circuits': sb_circuits,
+            'cables': sb_cables,
+        }
+
+
+        def build_input(stream):
+            '''
+            build every document of one input; YAML errors are logged as they
+            always were, a DocumentError (found after writes began) is logged
+            too and rolls back what this run wrote, chunks already committed
+            on their own stay
+            '''
+            try:
+                with transaction.atomic():
+                    try:
+                        SiteBuilder(stream)
+                    except yaml.YAMLError as exc:
+                        self.log_failure(exc)
+            except DocumentError as exc:
+                self.log_failure(f"{exc}")
             return
 
 
@@ -614,22 +3050,32 @@ class SiteBuilder(Script):
         # Main Execution Begins Here..
         ##
 
-        # import a file
-        if data['yamlfile']:
-            with data['yamlfile'] as stream:
-                try:
-                    SiteBuilder(stream)
-                except yaml.YAMLError as exc:
-                    self.log_failure(exc)
-        
-        # use the default sample YAML file
-        else:
-            with io.StringIO(data['yamltext']) as stream:
-                try:
-                    SiteBuilder(stream)
-                except yaml.YAMLError as exc:
-                    self.log_failure(exc)
+        # nothing is read from the YAML input
+        if data['mode'] == 'export':
+            if not data.get('export_sites'):
+                self.log_failure(f"Choose the sites to export")
+                return
+            with log.phase('export'), profiler.phase('run'):
+                output = export_document(data['export_sites'])
+            log.summary()
+            profiler.report()
+            return output
+
+        # switched on from the document vars, the run row is left out
+        with profiler.phase('run'):
+
+            # import a file
+            if data['yamlfile']:
+                with data['yamlfile'] as stream:
+                    build_input(stream)
+
+            # use the default sample YAML file
+            else:
+                with io.StringIO(data['yamltext']) as stream:
+                    build_input(stream)
 
+        log.summary()
+        profiler.report()
         self.log_success(f"YAML processing completed")
 
         return 